@@ -0,0 +1,218 @@
+"""
+Altitude-indexed wind vectors, to answer questions like "what was the wind between 3 km and 4 km?" without scanning
+every vector. Ascent and descent are indexed separately, each as vectors sorted by altitude with prefix sums of their
+wind components, so range, nearest-altitude and binned queries are bisections.
+"""
+from typing import List, NamedTuple, Optional
+import math
+
+import numpy as np
+
+import binary_output
+
+ASCENT = 'ascent'
+DESCENT = 'descent'
+PHASES = (ASCENT, DESCENT)
+
+
+class WindSummary(NamedTuple):
+    count: int
+    wind_y: float  # Mean northward wind, m/s (NaN without vectors)
+    wind_x: float  # Mean eastward wind, m/s (NaN without vectors)
+
+
+class _SortedVectors:
+    """
+    Vectors of one phase sorted by altitude, with the prefix sums of their wind components. New vectors wait in a
+    pending list and are merged into the sorted arrays (without sorting them again) before the next query. Only the
+    prefix sums from the lowest new vector up are recomputed, which during an ascent (or descent) is only the new ones.
+    """
+
+    def __init__(self):
+        self.alts = np.empty(0)
+        self.winds = np.empty((0, 2))
+        self.prefix = np.zeros((1, 2))
+        self.pending = []
+
+    def __len__(self):
+        return len(self.alts) + len(self.pending)
+
+    def add(self, alt, wind_y, wind_x):
+        self.pending.append((alt, wind_y, wind_x))
+
+    def merge(self):
+        if not self.pending:
+            return
+        new = np.array(self.pending, dtype=float)
+        new = new[np.argsort(new[:, 0], kind='stable')]
+        self.pending = []
+
+        positions = np.searchsorted(self.alts, new[:, 0], side='right')
+        self.alts = np.insert(self.alts, positions, new[:, 0])
+        self.winds = np.insert(self.winds, positions, new[:, 1:], axis=0)
+        # The sums below the first new vector don't change; carrying on from there adds in the same order as a full
+        # cumsum would
+        first = int(positions[0])
+        self.prefix = np.concatenate((self.prefix[:first],
+                                      np.cumsum(np.concatenate((self.prefix[first:first + 1], self.winds[first:])),
+                                                axis=0)))
+
+    def sums(self, low, high):
+        """
+        :return: (counts, sums of [wind_y, wind_x]) of the vectors from each low (included) to each high (excluded)
+        """
+        self.merge()
+        start = np.searchsorted(self.alts, low, side='left')
+        end = np.searchsorted(self.alts, high, side='left')
+        return end - start, self.prefix[end] - self.prefix[start]
+
+
+class AltitudeIndex:
+    """
+    Index of [Altitude, WindY, WindX] vectors, as returned by Analyzer.vectors. Vectors are split into ascent and
+    descent as they are added: the phase changes once the altitude has moved by more than hysteresis meters against
+    it (from the highest altitude of an ascent, or the lowest of a descent). Vectors can be added at any time, e.g. as a
+    live flight is decoded.
+    """
+
+    def __init__(self, vectors=(), hysteresis=50.0):
+        """
+        :param vectors: [Altitude, WindY, WindX] rows, oldest first
+        :param hysteresis: # of meters the altitude has to move against the current phase to change phases
+        """
+        self.hysteresis = hysteresis
+        self.segments = {phase: _SortedVectors() for phase in PHASES}
+        self.phase = ASCENT
+        self._extreme = None
+        self.extend(vectors)
+
+    @staticmethod
+    def from_file(filename, hysteresis=50.0) -> 'AltitudeIndex':
+        """
+        :param filename: vectors written by Analyzer.output_vectors, as CSV or .npy
+        """
+        records = binary_output.load_vectors(filename, mmap=False)
+        return AltitudeIndex(np.column_stack((records['Altitude'], records['WindY'], records['WindX'])), hysteresis)
+
+    def __len__(self):
+        return sum(len(segment) for segment in self.segments.values())
+
+    def append(self, vector):
+        """
+        :param vector: [Altitude, WindY, WindX], newer than every vector already in the index. Vectors without an
+                       altitude (NaN) are ignored.
+        """
+        alt, wind_y, wind_x = (float(value) for value in vector[:3])
+        if math.isnan(alt):
+            return
+
+        if self._extreme is None:
+            self._extreme = alt
+        elif self.phase == ASCENT:
+            if alt < self._extreme - self.hysteresis:
+                self.phase, self._extreme = DESCENT, alt
+            else:
+                self._extreme = max(self._extreme, alt)
+        else:
+            if alt > self._extreme + self.hysteresis:
+                self.phase, self._extreme = ASCENT, alt
+            else:
+                self._extreme = min(self._extreme, alt)
+
+        self.segments[self.phase].add(alt, wind_y, wind_x)
+
+    def extend(self, vectors):
+        """
+        :param vectors: [Altitude, WindY, WindX] rows, oldest first and newer than every vector already in the index
+        """
+        for vector in vectors:
+            self.append(vector)
+
+    """
+    Queries. phase is ASCENT, DESCENT or None for both.
+    """
+
+    def summary(self, low, high, phase=None) -> WindSummary:
+        """
+        :return: number of vectors from low (included) to high (excluded) meters, and their mean wind components
+        """
+        count = 0
+        sums = np.zeros(2)
+        for segment in self._segments(phase):
+            segment_count, segment_sums = segment.sums(low, high)
+            count += int(segment_count)
+            sums += segment_sums
+        if count == 0:
+            return WindSummary(0, math.nan, math.nan)
+        return WindSummary(count, float(sums[0] / count), float(sums[1] / count))
+
+    def between(self, low, high, phase=None) -> np.ndarray:
+        """
+        :return: the [Altitude, WindY, WindX] vectors from low (included) to high (excluded) meters, sorted by altitude
+        """
+        rows = []
+        for segment in self._segments(phase):
+            segment.merge()
+            start, end = np.searchsorted(segment.alts, [low, high], side='left')
+            rows.append(np.column_stack((segment.alts[start:end], segment.winds[start:end])))
+        rows = np.concatenate(rows) if rows else np.empty((0, 3))
+        return rows[np.argsort(rows[:, 0], kind='stable')]
+
+    def nearest(self, altitude, phase=None) -> Optional[List[float]]:
+        """
+        :return: the [Altitude, WindY, WindX] vector closest to altitude, or None if there are no vectors
+        """
+        best = None
+        for segment in self._segments(phase):
+            segment.merge()
+            i = np.searchsorted(segment.alts, altitude)
+            for j in (i - 1, i):
+                if 0 <= j < len(segment.alts):
+                    distance = abs(segment.alts[j] - altitude)
+                    if best is None or distance < best[0]:
+                        best = (distance, [float(segment.alts[j])] + segment.winds[j].tolist())
+        return None if best is None else best[1]
+
+    def bins(self, step=100.0, low=None, high=None, phase=None, max_bins=None) -> np.ndarray:
+        """
+        Mean wind in fixed altitude bins.
+
+        :param step: height of each bin, in meters
+        :param low: bottom of the first bin (default: lowest altitude, rounded down to a multiple of step)
+        :param high: top of the last bin (default: highest altitude, rounded up)
+        :param max_bins: optional largest # of bins
+        :return: one [bin bottom, count, mean WindY, mean WindX] row per bin; the means are NaN for empty bins
+        :raises ValueError: if there would be more than max_bins bins
+        """
+        segments = self._segments(phase)
+        for segment in segments:
+            segment.merge()
+        alts = [segment.alts for segment in segments if len(segment.alts)]
+        if not alts:
+            return np.empty((0, 4))
+        if low is None:
+            low = math.floor(min(a[0] for a in alts) / step) * step
+        if high is None:
+            high = (math.floor(max(a[-1] for a in alts) / step) + 1) * step
+
+        span = (high - low) / step
+        if max_bins is not None and not span <= max_bins:
+            raise ValueError(f"Too many bins requested, at most {max_bins} allowed")
+        edges = low + step * np.arange(max(math.ceil(span), 0) + 1)
+        counts = np.zeros(len(edges) - 1, dtype=int)
+        sums = np.zeros((len(edges) - 1, 2))
+        for segment in segments:
+            index = np.searchsorted(segment.alts, edges, side='left')
+            counts += np.diff(index)
+            sums += np.diff(segment.prefix[index], axis=0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = sums / counts[:, None]
+        return np.column_stack((edges[:-1], counts, means))
+
+    def _segments(self, phase) -> List[_SortedVectors]:
+        if phase is None:
+            return [self.segments[name] for name in PHASES]
+        if phase not in self.segments:
+            raise ValueError(f"Unknown phase {phase!r}, expected one of {PHASES} or None")
+        return [self.segments[phase]]
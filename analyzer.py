@@ -1,12 +1,20 @@
 """
 Parent class for Analyzers
 """
-from typing import List
+from typing import List, Tuple
 import math
-from statistics import mean
+import os
 import csv
 
+import numpy as np
+
+import altitude_index
+import binary_output
 import config
+import geodesy
+import instrumentation
+import map_export
+from datapoints import DataPointTable
 
 
 class Analyzer:
@@ -15,50 +23,162 @@ class Analyzer:
     High level functions
     """
 
-    def __init__(self, filename, timestep):
+    def __init__(self, filename, timestep, stats=None):
         """
         :param filename: Name of a CSV file
         :param timestep: # of seconds desired between two datapoints.
+        :param stats: optional instrumentation.PipelineStats to record stage timings and glitch counts in
         """
         self.filename = filename
         self.timestep = timestep
+        self.stats = stats if stats is not None else instrumentation.NULL_STATS
+        # Earth model used to compute the vectors, one of geodesy.MODELS; can be changed at any time
+        self.earth_model = geodesy.SPHERE
+        # Longest time between two data points of the same segment, in seconds. None computes every vector with
+        # timestep; otherwise the flight is split at longer gaps (see DataPointTable.segments) and vectors use the
+        # actual time between their data points, when the input has times. Can be changed at any time.
+        self.max_gap = None
+        self._data_points_cache = None
+        self._vectors_cache = None
+        self._source_stamp = None
 
     @property
-    def data_points(self) -> List[List[float]]:
+    def data_points(self) -> DataPointTable:
         """
-        List of data points where each data point is [Lat, Long, Altitude, sensor wind speed]
+        Table of data points where each data point is [Lat, Long, Altitude, sensor wind speed]
+
+        The input file is only parsed again when its size or modification time changes, when one of the
+        data_point_settings changes (or after reload()).
         """
-        return []
+        stamp = (self.source_stamp(), self.data_point_settings())
+        if self._data_points_cache is None or stamp != self._source_stamp:
+            self._data_points_cache = self.read_data_points()
+            self._vectors_cache = None
+            self._source_stamp = stamp
+        return self._data_points_cache
 
     @property
     def vectors(self) -> [List[List[float]]]:
         """
         List of velocity vectors for a given altitude; Format for each point [Altitude, Y_component, X_component]
         """
-        temp = []
-        for i in range(len(self.data_points) - 1):
-            (y_wind, x_wind) = Analyzer.calculate_components_dd(self.data_points[i + 1][1], self.data_points[i][1],
-                                                                self.data_points[i + 1][0], self.data_points[i][0],
-                                                                self.data_points[i + 1][2], self.data_points[i][2],
-                                                                mean([self.data_points[i + 1][3],
-                                                                      self.data_points[i][3]]),
-                                                                self.timestep)
-            temp.append([self.data_points[i][2], y_wind, x_wind])
+        data_points = self.data_points
+        settings = (self.timestep, self.earth_model, self.max_gap)
+        if self._vectors_cache is not None and self._vectors_cache[0] == settings:
+            return self._vectors_cache[1]
+
+        with self.stats.stage('vectors') as stage:
+            if len(data_points) < 2:
+                temp = []
+            else:
+                temp = Analyzer.calculate_segment_vectors(data_points, self.timestep, self.max_gap, self.stats,
+                                                          self.earth_model, self.pair_breaks()).tolist()
+            stage.add(rows_in=len(data_points), rows_out=len(temp))
 
+        self._vectors_cache = (settings, temp)
         return temp
 
+    def data_point_settings(self) -> Tuple:
+        """
+        :return: every setting that read_data_points depends on. Analyzers with more settings add theirs.
+        """
+        return self.timestep, self.max_gap
+
+    def pair_breaks(self):
+        """
+        :return: None, or a boolean for each pair of consecutive data points, True where no vector must be computed
+                 between them (see CompressedAnalyzer.read_data_points). Only valid once data_points was read.
+        """
+        return None
+
+    def altitude_index(self, hysteresis=50.0) -> altitude_index.AltitudeIndex:
+        """
+        :param hysteresis: see AltitudeIndex
+        :return: index of the vectors by altitude, for range, nearest-altitude and binned wind queries
+        """
+        return altitude_index.AltitudeIndex(self.vectors, hysteresis)
+
+    def read_data_points(self) -> DataPointTable:
+        """
+        Parses the input file. Overridden by each analyzer; use data_points to get the cached result.
+        """
+        return DataPointTable()
+
+    def reload(self):
+        """
+        Forgets the cached data points and vectors so that the next access re-parses the input file.
+        """
+        self._data_points_cache = None
+        self._vectors_cache = None
+        self._source_stamp = None
+
+    def source_stamp(self):
+        """
+        :return: (size, modification time) of the input file, or None if it can't be found
+        """
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
     def output_vectors(self, filename):
+        """
+        :param filename: CSV file to write, or a .npy file for the binary format (see binary_output)
+        """
+        vectors = self.vectors
+        with self.stats.stage('write') as stage:
+            if binary_output.is_binary(filename):
+                binary_output.write_vectors(filename, vectors)
+            else:
+                with open(filename, 'w', newline="") as file:
+                    writer = csv.writer(file)
+                    file.write("Altitude,WindY,WindX\n")
+                    writer.writerows(vectors)
+            if self.stats.enabled:
+                stage.add(rows_in=len(vectors), rows_out=len(vectors), bytes_written=os.path.getsize(filename))
 
-        with open(filename, 'w', newline="") as file:
-            writer = csv.writer(file)
-            file.write("Altitude,WindY,WindX\n")
-            writer.writerows(self.vectors)
+    def save_datapoints(self, filename):
+        """
+        :param filename: CSV file to write, or a .npy file for the binary format (see binary_output)
+        """
+        data_points = self.data_points
+        with self.stats.stage('write') as stage:
+            if binary_output.is_binary(filename):
+                binary_output.write_datapoints(filename, data_points)
+            else:
+                with open(filename, 'w', newline="") as file:
+                    writer = csv.writer(file)
+                    file.write("Lat, Long, Alt, Wind\n")
+                    writer.writerows(data_points)
+            if self.stats.enabled:
+                stage.add(rows_in=len(data_points), rows_out=len(data_points),
+                          bytes_written=os.path.getsize(filename))
 
     def output_map_line(self, filename):
-        with open(filename, 'w', newline="") as mapfile:
-            mapfile.write("Datapoint_ID,Latitude,Longitude,Altitude\n")
-            for i in range(len(self.data_points)):
-                mapfile.write(f"{i + 1},{self.data_points[i][0]},{self.data_points[i][1]},{self.data_points[i][2]}\n")
+        data_points = self.data_points
+        with self.stats.stage('write') as stage:
+            with open(filename, 'w', newline="") as mapfile:
+                mapfile.write("Datapoint_ID,Latitude,Longitude,Altitude\n")
+                for i, data_point in enumerate(data_points):
+                    mapfile.write(f"{i + 1},{data_point[0]},{data_point[1]},{data_point[2]}\n")
+                stage.add(rows_in=len(data_points), rows_out=len(data_points), bytes_written=mapfile.tell())
+
+    def output_map(self, filename, tolerance=None, vectors=True):
+        """
+        Writes the track, and the wind vectors along it, as a map file (see map_export).
+
+        :param filename: .geojson (or .json) file, or .kml / .kmz file for Google Earth
+        :param tolerance: optional distance in meters within which the track is simplified (see map_export.simplify)
+        :param vectors: also add a point for each wind vector, at its first data point
+        """
+        data_points = self.data_points
+        wind_vectors = self.vectors if vectors else None
+        starts = Analyzer.vector_starts(data_points, self.max_gap, self.pair_breaks()) if vectors else None
+        with self.stats.stage('write') as stage:
+            map_export.write_map(filename, data_points, wind_vectors, tolerance, starts=starts)
+            if self.stats.enabled:
+                stage.add(rows_in=len(data_points), bytes_written=os.path.getsize(filename))
 
     """
     Supporting methods for vectors(self)
@@ -148,6 +268,107 @@ class Analyzer:
         return (disp_lat / time_step + sensor_speed_lat,
                 disp_long / time_step + sensor_speed_long)
 
+    """
+    Vectorized versions of the above, for whole flights at once
+    """
+
+    @staticmethod
+    def calculate_bearing_batch(delta_lat, delta_long):
+        """
+        Array version of calculate_bearing, including its sentinel and zero-longitude return values.
+
+        :param delta_lat: array of changes in latitude
+        :param delta_long: array of changes in longitude
+        :return: array of bearings, in degrees
+        """
+        delta_lat = np.asarray(delta_lat, dtype=float)
+        delta_long = np.asarray(delta_long, dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            raw_angle = np.degrees(np.arctan(delta_lat / delta_long))
+
+        # NE and SE when heading east, SW and NW (same formula) when heading west
+        bearing = np.where(delta_long > 0.0,
+                           np.where(delta_lat >= 0.0, 90 - raw_angle, 90.0 + raw_angle),
+                           270 - raw_angle)
+        bearing = np.where(delta_long == 0.0, np.where(delta_long > 0, math.pi / 2, -1.0 * math.pi / 2), bearing)
+        return np.where((delta_lat == 0.0) & (delta_long == 0.0), 0.123456, bearing)
+
+    @staticmethod
+    def calculate_components_batch(lats, longs, alts, wind_speeds, time_step, stats=instrumentation.NULL_STATS,
+                                   earth_model=geodesy.SPHERE):
+        """
+        Computes the wind vector for every pair of consecutive points in one pass. Gives the same results as calling
+        calculate_components_dd on each pair, with the sensor speed averaged over the pair, when earth_model is
+        'sphere'.
+
+        :param lats: latitudes, in decimal degrees
+        :param longs: longitudes, in decimal degrees
+        :param alts: altitudes, in meters
+        :param wind_speeds: velocities measured by sensor
+        :param time_step: time between two measurements, in seconds (a number, or an array with one entry per pair)
+        :param stats: PipelineStats to count the 0.123456 bearing glitches in
+        :param earth_model: one of geodesy.MODELS, see geodesy.displacements
+        :return: array with one [Altitude, WindY, WindX] row per pair, altitude taken at the start of the pair
+        """
+        alts = np.asarray(alts, dtype=float)
+        wind_speeds = np.asarray(wind_speeds, dtype=float)
+
+        # Steps are numbered as in calculate_components_dd
+        disp_lat, disp_long = geodesy.displacements(lats, longs, earth_model)
+        bearing = Analyzer.calculate_bearing_batch(disp_lat, disp_long)
+        if stats.enabled:
+            stats.count(instrumentation.BEARING_GLITCHES, np.count_nonzero(bearing == 0.123456))
+
+        vertical_speed = np.diff(alts) / time_step
+        sensor_speed = (wind_speeds[1:] + wind_speeds[:-1]) / 2
+        sensor_speed_horizontal = np.sqrt(np.abs(sensor_speed ** 2 - vertical_speed ** 2))
+
+        bearing_radians = np.radians(bearing)
+        y_wind = disp_lat / time_step + sensor_speed_horizontal * np.cos(bearing_radians)
+        x_wind = disp_long / time_step + sensor_speed_horizontal * np.sin(bearing_radians)
+        return np.column_stack((alts[:-1], y_wind, x_wind))
+
+    @staticmethod
+    def calculate_segment_vectors(data_points: DataPointTable, time_step, max_gap=None,
+                                  stats=instrumentation.NULL_STATS, earth_model=geodesy.SPHERE,
+                                  breaks=None) -> np.ndarray:
+        """
+        Computes the vectors of a flight that may have gaps. Without max_gap and breaks, this is
+        calculate_components_batch over every pair with time_step. Otherwise the data points are split into segments
+        at breaks and, when every data point has a time, at gaps longer than max_gap seconds; the vectors of each
+        segment are then computed with the time between each pair of data points (time_step without times). No vector
+        spans a gap.
+
+        :param data_points: the flight
+        :param time_step: time between two data points, in seconds, when their times aren't used
+        :param max_gap: see DataPointTable.segments
+        :param breaks: see DataPointTable.segments
+        :return: array with one [Altitude, WindY, WindX] row per pair of consecutive data points of the same segment
+        """
+        timed = max_gap is not None and data_points.has_times
+        if not timed and breaks is None:
+            return Analyzer.calculate_components_batch(data_points.lats, data_points.longs, data_points.alts,
+                                                       data_points.wind_speeds, time_step, stats, earth_model)
+        vectors = [Analyzer.calculate_components_batch(segment.lats, segment.longs, segment.alts, segment.wind_speeds,
+                                                       np.diff(segment.times) if timed else time_step, stats,
+                                                       earth_model)
+                   for segment in (data_points[start:end]
+                                   for start, end in data_points.segments(max_gap if timed else None, breaks))
+                   if len(segment) > 1]
+        return np.concatenate(vectors) if vectors else np.empty((0, 3))
+
+    @staticmethod
+    def vector_starts(data_points: DataPointTable, max_gap=None, breaks=None) -> np.ndarray:
+        """
+        :return: index of the first data point of each vector given by calculate_segment_vectors
+        """
+        timed = max_gap is not None and data_points.has_times
+        if not timed and breaks is None:
+            return np.arange(max(len(data_points) - 1, 0))
+        return np.concatenate([np.arange(start, end - 1)
+                               for start, end in data_points.segments(max_gap if timed else None, breaks)] +
+                              [np.empty(0, dtype=int)])
+
     @staticmethod
     def feet_to_meters(num):
         return num / 3.2808399
@@ -1,33 +1,70 @@
-from typing import List
+from typing import List, Dict, Iterable, Iterator
 import csv
 import codecs
-import shutil
+import io
+import itertools
+import os
 
 
 import analyzer_compressed
 
 class AprsFiAnalyzer(analyzer_compressed.CompressedAnalyzer):
 
-    def __init__(self, filename, timestep):
-        super().__init__(filename, timestep)
+    def __init__(self, filename, timestep, stats=None, time_interpolation=False, deduplicate=True, cache=None):
+        super().__init__(filename, timestep, stats, time_interpolation, deduplicate, cache)
 
-    @property
-    def data_points(self) -> List[List[float]]:
-        no_quotes_filename = AprsFiAnalyzer.copy_file_without_comment_quotes(self.filename)
-        with open(no_quotes_filename, 'r', newline="") as input_file:
-            reader = csv.DictReader(input_file)
-            split_rows = [{'lat': x['lat'],
-                           'long': x['lng'],
-                           'alt': x['altitude'],
-                           'comment': AprsFiAnalyzer.decode_comment_utf8(x['comment'])}
-                          for x in reader]
-        return AprsFiAnalyzer.process_input(split_rows)
+    def read_packets(self) -> List[Dict[str, str]]:
+        with self.stats.stage('read') as stage, open(self.filename, 'r', newline="", encoding='utf-8') as input_file:
+            split_rows = [AprsFiAnalyzer.packet(x) for x in AprsFiAnalyzer.read_rows(input_file)]
+            stage.add(rows_out=len(split_rows), bytes_read=os.fstat(input_file.fileno()).st_size)
 
-    def save_datapoints(self, filename):
-        with open(filename, 'w', newline="") as file:
-            writer = csv.writer(file)
-            file.write("Lat, Long, Alt, Wind\n")
-            writer.writerows(self.data_points)
+        with self.stats.stage('unescape') as stage:
+            for row in split_rows:
+                row['comment'] = AprsFiAnalyzer.decode_comment_utf8(row['comment'])
+            stage.add(rows_in=len(split_rows), rows_out=len(split_rows))
+        return split_rows
+
+    def parse_lines(self, header: bytes, data: bytes) -> List[Dict[str, str]]:
+        # Comments are unescaped here, as part of the read stage
+        lines = itertools.chain([header.decode('utf-8')], io.StringIO(data.decode('utf-8'), newline=""))
+        split_rows = [AprsFiAnalyzer.packet(x) for x in AprsFiAnalyzer.read_rows(lines)]
+        for row in split_rows:
+            row['comment'] = AprsFiAnalyzer.decode_comment_utf8(row['comment'])
+        return split_rows
+
+    @staticmethod
+    def packet(row: Dict[str, str]) -> Dict[str, str]:
+        """
+        :param row: row of the export, keyed by its header
+        :return: the packet dictionary of the row, with its comment still escaped
+        """
+        return {'lat': row['lat'],
+                'long': row['lng'],
+                'alt': row['altitude'],
+                'comment': row['comment'],
+                'time': row.get('time')}
+
+    @staticmethod
+    def read_rows(lines: Iterable[str]) -> Iterator[Dict[str, str]]:
+        """
+        Reads an aprs.fi export one line at a time. aprs.fi escapes quotes inside the comment with a backslash
+        instead of doubling them, which the csv module can't parse, so the comment (always the last column) is taken
+        as everything after the other columns, with its surrounding quotes removed. Escapes are left for
+        decode_comment_utf8.
+        :param lines: the lines of the export, header first (e.g. an open file)
+        :return: generator of rows as dictionaries keyed by the header
+        """
+        lines = iter(lines)
+        header = next(csv.reader([next(lines, "")]), [])
+        for line in lines:
+            line = line.rstrip("\r\n")
+            if not line:
+                continue
+            values = line.split(",", len(header) - 1)
+            comment = values[-1]
+            if len(comment) >= 2 and comment[0] == '"' and comment[-1] == '"':
+                values[-1] = comment[1:-1]
+            yield dict(zip(header, values))
 
     @staticmethod
     def decode_comment_utf8(original: str) -> str:
@@ -41,28 +78,8 @@ class AprsFiAnalyzer(analyzer_compressed.CompressedAnalyzer):
         """
         new = original.strip('"')
         new.replace(" ", ",")
-        return codecs.decode(new.encode('utf-8'), 'unicode_escape')
-
-    @staticmethod
-    def copy_file_without_comment_quotes(filename: str) -> str:
-        no_quotes_filename = filename.split(".", 1)[0] + "_noQuotes.csv"
-        with open(filename, 'r', newline="") as infile:
-            lines = infile.readlines()
-
-        with open(no_quotes_filename, 'w') as outfile:
-            outfile.write(lines[0])
-            for line in lines[1:]:
-                no_quote_line = AprsFiAnalyzer.rreplace(line, '"', "", 1).replace('"', "", 1)
-                outfile.write(no_quote_line)
-
-        return no_quotes_filename
-
-    @staticmethod
-    def rreplace(s, old, new, occurrence):
-        """
-        Replaces rightmost occurence of old in s with new up to occurence times.
-        CREDITS: User "mg." on Stackoverflow: https://stackoverflow.com/a/2556252
-        """
-        li = s.rsplit(old, occurrence)
-        return new.join(li)
-
+        if "\\" not in new and new.isascii():
+            # Nothing to unescape
+            return new
+        # unicode_escape reads the other bytes as latin-1, so characters beyond it are passed as escapes too
+        return codecs.decode(new.encode('latin-1', 'backslashreplace'), 'unicode_escape')
@@ -1,78 +1,446 @@
-from typing import List, Dict, Union
+from typing import List, Dict, Optional, Tuple, Union
 import csv
 import codecs
+import datetime
+import os
+
+import numpy as np
 
 import analyzer
+import checkpoint
 import config
+import decode_cache
+import dedup
+import geodesy
+import instrumentation
+import interpolation
+from datapoints import DataPointTable
+
+"""
+Lookup tables for bulk base91 decoding, indexed by raw byte values
+"""
+
+# Wind speed for each possible character
+WIND_SPEED_TABLE = np.array([analyzer.Analyzer.knots_to_meters_per_sec(1.08 ** (byte - 33) - 1.0)
+                             for byte in range(256)])
+
+# Altitude for each possible pair of characters, including the 0.12345 glitch value for out-of-range characters
+ALTITUDE_TABLE = np.array([[0.12345 if (high - 33 > 124) or (low - 33 > 124)
+                            else analyzer.Analyzer.feet_to_meters(1.002 ** ((high - 33) * 91.0 + (low - 33)))
+                            for low in range(256)]
+                           for high in range(256)])
+
 
 class CompressedAnalyzer(analyzer.Analyzer):
     """
     Parent class for analyzers that deal with base-91 compressed data.
     """
 
-    def __init__(self, filename, timestep):
-        super().__init__(filename, timestep)
+    # True if the log starts with a header line (see read_packets_after)
+    has_header = True
+    # True if data points without a position or altitude are dropped (see drop_missing)
+    drops_missing = False
+
+    def __init__(self, filename, timestep, stats=None, time_interpolation=False, deduplicate=True, cache=None):
+        """
+        :param time_interpolation: place samples using the time between packets, when the input has packet times
+                                   (see interpolation.InterpolationPlan.apply)
+        :param deduplicate: drop repeated copies of a packet (see dedup.PacketDeduplicator)
+        :param cache: optional decode_cache.DecodeCache (or the name of its file) keeping the decoded packets, so that
+                      only the lines added to the log since the last run are read and decoded
+        """
+        super().__init__(filename, timestep, stats)
+        self.time_interpolation = time_interpolation
+        self.deduplicate = deduplicate
+        self.cache = decode_cache.DecodeCache(cache) if isinstance(cache, (str, os.PathLike)) else cache
+        self._breaks = None
 
-    @property
-    def data_points(self) -> List[List[float]]:
+    def read_data_points(self) -> DataPointTable:
+        packets = self.load_packets()
+        if self.deduplicate:
+            packets = CompressedAnalyzer.drop_duplicates(packets, self.stats)
+        # Packet times are only parsed when they are used
+        timed = self.time_interpolation or self.max_gap is not None
+        times = CompressedAnalyzer.packet_times(packets) if timed else None
+        data_points = self.process_input(packets, self.stats, times, self.timestep, self.time_interpolation,
+                                         self.max_gap)
+        self._breaks = None
+        if self.drops_missing:
+            # No vector may span the dropped data points: they were one timestep apart from their neighbours, but
+            # the data points on either side of them aren't
+            kept = np.flatnonzero(~CompressedAnalyzer.missing(data_points))
+            self._breaks = np.diff(kept) > 1
+            data_points = data_points[kept]
+        return data_points
 
+    def data_point_settings(self):
+        return super().data_point_settings() + (self.time_interpolation, self.deduplicate, self.drops_missing)
+
+    def pair_breaks(self):
+        return self._breaks
+
+    def read_packets(self) -> List[Dict[str, Union[float, str, bytes]]]:
+        """
+        Reads the packets from the input file. Overridden by each analyzer.
+
+        :return: one dictionary per packet, oldest first, with at least its 'lat', 'long', 'alt' and 'comment', and
+                 its 'time' if the input has one
+        """
         return []
 
+    def load_packets(self) -> List[Dict[str, Union[float, str, bytes]]]:
+        """
+        :return: the packets of read_packets, taken from the cache where possible; cached packets come with their
+                 'decoded' values (see unpack_packets)
+        """
+        if self.cache is None:
+            return self.read_packets()
+
+        key = self.cache_key()
+        cached, offset = self.cache.load(key, self.filename)
+        packets, end, partial = self.read_packets_after(offset)
+        if packets:
+            with self.stats.stage('base91') as stage:
+                for packet, decoded in zip(packets, zip(*CompressedAnalyzer.decode_packets(packets))):
+                    packet['decoded'] = decoded
+                stage.add(rows_in=len(packets), rows_out=len(packets))
+        self.cache.store(key, self.filename, offset, end, packets)
+        return cached + packets + partial
+
+    def cache_key(self) -> str:
+        """
+        :return: name of the input file in the decode cache
+        """
+        return f"{type(self).__name__}:{os.path.abspath(self.filename)}"
+
+    def read_packets_after(self, offset) -> Tuple[List[Dict], int, List[Dict]]:
+        """
+        Reads the packets of the lines from a given byte offset on, for the decode cache.
+
+        :param offset: 0, or an offset returned by a previous call on the same (possibly grown) file
+        :return: (packets of the complete lines, offset after the last complete line, packets of the last line if it
+                 doesn't end with a newline and can be decoded)
+        """
+        with self.stats.stage('read') as stage, open(self.filename, 'rb') as input_file:
+            header = input_file.readline() if self.has_header else b""
+            start = max(offset, input_file.tell())
+            input_file.seek(start)
+            data = input_file.read()
+            split = data.rfind(b"\n") + 1
+            packets = self.parse_lines(header, data[:split])
+            try:
+                partial = self.parse_lines(header, data[split:]) if data[split:].strip() else []
+                CompressedAnalyzer.decode_packets(partial)
+            except (AttributeError, KeyError, TypeError, ValueError):
+                # The last line is still being written
+                partial = []
+            stage.add(rows_out=len(packets) + len(partial), bytes_read=len(header) + len(data))
+        return packets, start + split, partial
+
+    def parse_lines(self, header: bytes, data: bytes) -> List[Dict[str, Union[float, str, bytes]]]:
+        """
+        Parses whole lines of the input file. Overridden by each analyzer that can be used with a decode cache.
+
+        :param header: the header line of the file (empty if has_header is False)
+        :param data: complete lines of the file, after the header
+        :return: packets, as returned by read_packets
+        """
+        raise NotImplementedError(f"{type(self).__name__} can't read part of its input, so it can't use a cache")
+
+    """
+    Incremental outputs
+    """
+
+    def update_outputs(self, vectors_filename, datapoints_filename=None, checkpoint_filename=None):
+        """
+        Brings CSV outputs up to date with the input, only decoding and appending the packets added to the input since
+        the last call. The decoder's state is kept in a checkpoint file (see checkpoint); without a usable checkpoint,
+        e.g. on the first call or if the input was rewritten, the outputs are written from the start. Packets that
+        can't be decoded are skipped, as when streaming. The rows of a last line that isn't complete yet are written
+        after the checkpoint, so that they are written again by the next call.
+
+        :param vectors_filename: CSV file of the vectors
+        :param datapoints_filename: optional CSV file of the data points
+        :param checkpoint_filename: checkpoint file (default: the vectors file name followed by .checkpoint)
+        :return: (# of data points, # of vectors) written to the outputs
+        """
+        if checkpoint_filename is None:
+            checkpoint_filename = f"{vectors_filename}.checkpoint"
+        outputs = [(vectors_filename, "Altitude,WindY,WindX\n")]
+        if datapoints_filename is not None:
+            outputs.append((datapoints_filename, "Lat, Long, Alt, Wind\n"))
+        settings = {'analyzer': type(self).__name__, 'input': os.path.abspath(self.filename),
+                    'timestep': self.timestep, 'time_interpolation': self.time_interpolation,
+                    'deduplicate': self.deduplicate, 'earth_model': self.earth_model, 'max_gap': self.max_gap,
+                    'config': decode_cache.config_fingerprint(),
+                    'outputs': [os.path.abspath(filename) for filename, header in outputs]}
+
+        state = checkpoint.Checkpoint.load(checkpoint_filename)
+        if state is None or not state.resumable(self.filename, settings):
+            state = checkpoint.Checkpoint(settings)
+        decoder = IncrementalDecoder(self.timestep, self.stats, self.time_interpolation, self.drops_missing,
+                                     self.earth_model, self.max_gap)
+        if state.decoder is not None:
+            decoder.load_state(state.decoder)
+        deduplicator = dedup.PacketDeduplicator() if self.deduplicate else None
+        if deduplicator is not None and state.deduplicator is not None:
+            deduplicator.load_state(state.deduplicator)
+
+        packets, end, partial = self.read_packets_after(state.offset)
+        files = []
+        try:
+            with self.stats.stage('write'):
+                for filename, header in outputs:
+                    path = os.path.abspath(filename)
+                    if path in state.outputs:
+                        # Cut off rows written after the checkpoint was saved; they are written again
+                        os.truncate(filename, state.outputs[path])
+                        files.append(open(filename, 'a', newline=""))
+                    else:
+                        files.append(open(filename, 'w', newline=""))
+                        files[-1].write(header)
+
+            counts = self._append_packets(packets, decoder, deduplicator, files)
+            sizes = {os.path.abspath(output_file.name): output_file.tell() for output_file in files}
+            checkpoint.Checkpoint(settings, end, checkpoint.Checkpoint.input_identity(self.filename, end),
+                                  decoder.to_state(), None if deduplicator is None else deduplicator.to_state(),
+                                  sizes).save(checkpoint_filename)
+
+            partial_counts = self._append_packets(partial, decoder, deduplicator, files)
+        finally:
+            for output_file in files:
+                output_file.close()
+        return counts[0] + partial_counts[0], counts[1] + partial_counts[1]
+
+    def _append_packets(self, packets, decoder, deduplicator, files):
+        """
+        Decodes packets and appends their vectors (and data points) to the open output files, flushed to disk.
+
+        :return: (# of data points, # of vectors) appended
+        """
+        new_data_points = DataPointTable()
+        new_vectors = []
+        for packet in packets:
+            if deduplicator is not None and deduplicator.is_duplicate(packet):
+                self.stats.count(instrumentation.DUPLICATE_PACKETS)
+                continue
+            try:
+                data_points, vectors = decoder.feed(packet)
+            except (KeyError, ValueError):
+                self.stats.count(instrumentation.SKIPPED_PACKETS)
+                continue
+            new_data_points.extend(data_points)
+            new_vectors.extend(vectors)
+
+        with self.stats.stage('write') as stage:
+            for output_file, rows in zip(files, (new_vectors, new_data_points.tolist())):
+                start = output_file.tell()
+                csv.writer(output_file).writerows(rows)
+                output_file.flush()
+                os.fsync(output_file.fileno())
+                stage.add(rows_in=len(rows), rows_out=len(rows), bytes_written=output_file.tell() - start)
+        return len(new_data_points), len(new_vectors)
 
     """
     Supporting functions for data_points
     """
 
     @staticmethod
-    def process_input(raw: List[Dict[str, Union[List, str]]]) -> List[List[float]]:
-
-        ds = []
-        for element in raw:
-            # last char in comment is for latest windspeed
-            # then come the additional GPS positions (end index 8*GPS_QUANTITY acknowledges that we start at index 1, not 0)
-            # finally come all of the altitude/velocity data, to the very end
-            latest_wind_speed = CompressedAnalyzer.unpack_wind_speed(element['comment'][-1])
-            #string_chain = codecs.decode(element['comment'].encode('utf-8'), 'unicode_escape')
-            string_chain = element['comment']
-            gps_data_stringchain = string_chain[0:(8 * (config.GPS_POINTS_DESIRED - 1))]
-            sens_data_stringchain = string_chain[
-                                    (8 * (config.GPS_POINTS_DESIRED - 1)):-1]  # from end of GPS sentence!
-
-            latitudes = []
-            longitudes = []
-            altitudes = []
-            wind_speeds = []
-
-            # Split each string contianing multiple GPS/sensor datapoints into individual pieces of data
-            # example: Lat1Long1Lat2Long2Lat3Long3 --> (Lat1, Lat2, Lat3...) and (Long1, Long2, Long3...
-            for i in range(config.GPS_POINTS_DESIRED - 1):
-                latitudes.append(CompressedAnalyzer.unpack_latitude(gps_data_stringchain[(8 * i):(8 * (i + 1) - 4)]))
-                longitudes.append(
-                    CompressedAnalyzer.unpack_longitude(gps_data_stringchain[((8 * i) + 4):(8 * (i + 1))]))
-
-            for i in range(config.SENS_POINTS_DESIRED - 1):
-                altitudes.append(CompressedAnalyzer.unpack_altitude(sens_data_stringchain[(3 * i):(3 * (i + 1) - 1)]))
-                wind_speeds.append(CompressedAnalyzer.unpack_wind_speed(sens_data_stringchain[(3 * i) + 2]))
-
-            # Append the latest data, which doesn't come from the comment (except for windspeed which does)
-            latitudes.append(float(element['lat']))
-            longitudes.append(float(element['long']))
-            altitudes.append(float(element['alt']))
-            wind_speeds.append(float(latest_wind_speed))
-
-            ds.append(
-                {'lats': latitudes, 'longs': longitudes, 'altitudes': altitudes, 'wind_speeds': wind_speeds})
-
-        data_points_builder = []
-        for i in range(len(ds) - 1):
-            interpolated_pos = CompressedAnalyzer.interpolate_gps_positions(ds[i],
-                                                                    ds[i + 1])  # We lose the first minute of data
-            for j in range(config.SENS_POINTS_DESIRED):
-                data_points_builder.append(
-                    [interpolated_pos[j][0], interpolated_pos[j][1], ds[i + 1]['altitudes'][j],
-                     ds[i + 1]['wind_speeds'][j]])
-
-        return data_points_builder
+    def process_input(raw: List[Dict[str, Union[List, str]]], stats=instrumentation.NULL_STATS, times=None,
+                      timestep=None, time_interpolation=True, max_gap=None) -> DataPointTable:
+
+        # We lose the first minute of data (of each segment, with max_gap)
+        return CompressedAnalyzer.packets_to_data_points(*CompressedAnalyzer.unpack_packets(raw, stats), stats=stats,
+                                                         times=times, timestep=timestep,
+                                                         time_interpolation=time_interpolation, max_gap=max_gap)
+
+    @staticmethod
+    def drop_duplicates(raw: List[Dict[str, Union[List, str]]], stats=instrumentation.NULL_STATS):
+        """
+        :param raw: packets, as returned by read_packets
+        :param stats: PipelineStats to record the 'dedup' stage and the number of duplicates in
+        :return: the packets without the repeated copies of a packet
+        """
+        with stats.stage('dedup') as stage:
+            deduplicator = dedup.PacketDeduplicator()
+            packets = deduplicator.filter(raw)
+            stage.add(rows_in=len(raw), rows_out=len(packets))
+        stats.count(instrumentation.DUPLICATE_PACKETS, deduplicator.dropped)
+        return packets
+
+    @staticmethod
+    def packet_times(raw: List[Dict[str, Union[List, str]]]) -> Optional[np.ndarray]:
+        """
+        :param raw: packets, as returned by read_packets
+        :return: time of each packet in seconds since the epoch, or None unless every packet has a 'time' (seconds
+                 since the epoch, or an ISO date and time in UTC)
+        """
+        times = [CompressedAnalyzer.parse_time(element.get('time')) for element in raw]
+        if None in times:
+            return None
+        return np.array(times)
+
+    @staticmethod
+    def parse_time(value) -> Optional[float]:
+        """
+        :param value: seconds since the epoch, or an ISO date and time in UTC (None or "" when unknown)
+        :return: seconds since the epoch, or None
+        """
+        if value is None or value == "":
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            moment = datetime.datetime.fromisoformat(value)
+            if moment.tzinfo is None:
+                moment = moment.replace(tzinfo=datetime.timezone.utc)
+            return moment.timestamp()
+
+    @staticmethod
+    def unpack_packets(raw: List[Dict[str, Union[List, str]]], stats=instrumentation.NULL_STATS):
+        """
+        :param raw: packets, each a dictionary with the 'lat', 'long', 'alt' and 'comment' of the packet, or with its
+                    'decoded' values when it comes from a decode cache
+        :param stats: PipelineStats to record the 'base91' stage and the 0.12345 altitude glitches in
+        :return: (latitudes, longitudes, altitudes, wind_speeds) arrays with one row per packet, oldest first. The last
+                 column of each holds the latest data, which doesn't come from the comment (except for windspeed).
+        """
+        with stats.stage('base91') as stage:
+            fresh = [element for element in raw if 'decoded' not in element]
+            unpacked = CompressedAnalyzer.decode_packets(fresh)
+            if len(fresh) < len(raw):
+                cached = np.array(['decoded' in element for element in raw], dtype=bool)
+                columns = []
+                for i, column in enumerate(unpacked):
+                    rows = [element['decoded'][i] for element in raw if 'decoded' in element]
+                    merged = np.empty((len(raw), len(rows[0])))
+                    merged[cached] = rows
+                    merged[~cached] = column
+                    columns.append(merged)
+                unpacked = tuple(columns)
+            stage.add(rows_in=len(raw), rows_out=len(raw))
+        if stats.enabled:
+            stats.count(instrumentation.ALTITUDE_GLITCHES, np.count_nonzero(unpacked[2] == 0.12345))
+        return unpacked
+
+    @staticmethod
+    def decode_packets(raw: List[Dict[str, Union[List, str]]]):
+        """
+        :param raw: packets, each a dictionary with the 'lat', 'long', 'alt' and 'comment' of the packet
+        :return: see unpack_packets
+        """
+        lats, longs, alts, wind_speeds = CompressedAnalyzer.decode_comments([element['comment'] for element in raw])
+        return (np.column_stack((lats, [float(element['lat']) for element in raw])),
+                np.column_stack((longs, [float(element['long']) for element in raw])),
+                np.column_stack((alts, [float(element['alt']) for element in raw])),
+                wind_speeds)
+
+    @staticmethod
+    def packets_to_data_points(lats, longs, alts, wind_speeds, stats=instrumentation.NULL_STATS, times=None,
+                               timestep=None, time_interpolation=True, max_gap=None) -> DataPointTable:
+        """
+        :param lats: latitudes of each packet, as returned by unpack_packets
+        :param longs: longitudes of each packet
+        :param alts: altitudes of each packet
+        :param wind_speeds: wind speeds of each packet
+        :param stats: PipelineStats to record the 'interpolate' stage in
+        :param times: optional time of each packet, in seconds, to time the samples the same way their positions are
+                      interpolated: timestep seconds apart and ending at the time of their packet with
+                      time_interpolation, otherwise spread evenly over the time since the previous packet
+        :param timestep: # of seconds between two samples, needed with times and time_interpolation
+        :param time_interpolation: interpolate positions by time when times are given (see InterpolationPlan.apply)
+        :param max_gap: with times, a packet sent more than max_gap seconds after the previous one (packets were lost
+                        in between) starts a new segment: like the first packet, it is only used to interpolate the
+                        positions of the next one
+        :return: the data points of every packet but the first, one per sample, with interpolated positions. The
+                 first packet is only used to interpolate the positions of the second.
+        """
+        with stats.stage('interpolate') as stage:
+            if len(lats) < 2:
+                return DataPointTable()
+
+            plan = interpolation.plan_for(lats.shape[1], alts.shape[1])
+            sample_lats, sample_longs = plan.apply(lats, longs, times if time_interpolation else None, timestep)
+            sample_times = None
+            if times is not None:
+                times = np.asarray(times, dtype=float)
+                if time_interpolation:
+                    sample_times = times[1:, None] + timestep * np.arange(1 - alts.shape[1], 1)
+                else:
+                    fractions = np.arange(1, alts.shape[1] + 1) / alts.shape[1]
+                    sample_times = times[:-1, None] + np.diff(times)[:, None] * fractions
+            data_points = DataPointTable.from_columns(sample_lats, sample_longs, alts[1:], wind_speeds[1:],
+                                                      sample_times)
+            if max_gap is not None and sample_times is not None:
+                data_points = data_points[np.repeat(np.diff(times) <= max_gap, alts.shape[1])]
+            stage.add(rows_in=len(lats), rows_out=len(data_points))
+        return data_points
+
+    @staticmethod
+    def missing(data_points: DataPointTable) -> np.ndarray:
+        """
+        :return: True for each data point without a latitude, longitude or altitude (packets salvaged from a raw log
+                 may not have them)
+        """
+        return np.isnan(data_points.lats) | np.isnan(data_points.longs) | np.isnan(data_points.alts)
+
+    @staticmethod
+    def drop_missing(data_points: DataPointTable) -> DataPointTable:
+        """
+        :return: the data points that have a latitude, longitude and altitude (see missing)
+        """
+        return data_points[~CompressedAnalyzer.missing(data_points)]
+
+    @staticmethod
+    def decode_comments(comments: List[Union[str, bytes]]):
+        """
+        Decodes a batch of compressed comments at once using the lookup tables above.
+
+        Each comment holds (GPS_POINTS_DESIRED - 1) 8-character lat/long pairs, then (SENS_POINTS_DESIRED - 1)
+        3-character altitude/wind groups, and ends with the latest wind speed. Anything between the last group and the
+        final character is ignored, as before.
+
+        :param comments: compressed comments, as str or bytes. Characters above chr(255) count as chr(255).
+        :return: (latitudes, longitudes, altitudes, wind_speeds) arrays with one row per comment. Wind speeds have
+                 SENS_POINTS_DESIRED columns, the last one being the latest wind speed.
+        """
+        gps_length = 8 * (config.GPS_POINTS_DESIRED - 1)
+        sens_length = 3 * (config.SENS_POINTS_DESIRED - 1)
+        body_length = gps_length + sens_length
+
+        chunks = []
+        for i, comment in enumerate(comments):
+            comment = CompressedAnalyzer.comment_bytes(comment)
+            if len(comment) < body_length + 1:
+                raise ValueError(f"Compressed comment {i} is {len(comment)} characters long, "
+                                 f"expected {body_length + 1}")
+            chunks.append(comment if len(comment) == body_length + 1 else comment[:body_length] + comment[-1:])
+
+        buffer = np.frombuffer(b"".join(chunks), dtype=np.uint8).reshape(len(chunks), body_length + 1)
+
+        gps = buffer[:, :gps_length].reshape(len(chunks), config.GPS_POINTS_DESIRED - 1, 8).astype(np.int64) - 33
+        lat_codes = ((gps[:, :, 0] * 91 + gps[:, :, 1]) * 91 + gps[:, :, 2]) * 91 + gps[:, :, 3]
+        long_codes = ((gps[:, :, 4] * 91 + gps[:, :, 5]) * 91 + gps[:, :, 6]) * 91 + gps[:, :, 7]
+
+        sens = buffer[:, gps_length:body_length].reshape(len(chunks), config.SENS_POINTS_DESIRED - 1, 3)
+
+        return (90.0 - lat_codes / 380926.0,
+                -180.0 + long_codes / 190463.0,
+                ALTITUDE_TABLE[sens[:, :, 0], sens[:, :, 1]],
+                np.column_stack((WIND_SPEED_TABLE[sens[:, :, 2]], WIND_SPEED_TABLE[buffer[:, -1]])))
+
+    @staticmethod
+    def comment_bytes(comment: Union[str, bytes]) -> bytes:
+        """
+        :param comment: compressed comment
+        :return: the comment as bytes, one byte per character
+        """
+        if isinstance(comment, bytes):
+            return comment
+        try:
+            return comment.encode('latin-1')
+        except UnicodeEncodeError:
+            return bytes(min(ord(x), 255) for x in comment)
 
     @staticmethod
     def base91_to_int(compressed_char):
@@ -157,39 +525,107 @@ class CompressedAnalyzer(analyzer.Analyzer):
     @staticmethod
     def interpolate_gps_positions(unpacked_prev, unpacked_curr):
         """
-        IMPORTANT: the number of GPS positions must be the same for both unpacked1 and unpacked2. Same thing with the number
-        of sensor measurements. The function assumes that the number of sensor measurements determines the number of final
-        gps positions.
-
-        :param unpacked_prev: A dictionary containing the latitudes, longitudes, altitudes, and wind velocities observed
-                            during the previous minute's transmission.
-        :param unpacked_curr: A dictionary containing the " during the current minute's transmission
-        :return: A list of datapoints containing " where some of the GPS data has been interpolated.
-        """
-        output_positions = []
-        q_known = len(unpacked_curr['lats'])
-        q_want = len(unpacked_curr['altitudes'])
-
-        for i in range(q_want):
-            # Checks if we'll find a measurement in the known set that is at the same relative time as in the want set.
-            if q_known / q_want * i % 1 == 0:
-                # No interpolation
-                output_positions.append([unpacked_curr['lats'][int(q_known / q_want * i)],
-                                         unpacked_curr['longs'][int(q_known / q_want * i)]])
-            else:
-                # Interpolate
-                next_latest = 1 / q_known
-                while next_latest < i / q_want:
-                    next_latest += 1 / q_known
-
-                ratio = q_known * (i / q_want - next_latest)
-                if i == 1:
-                    output_positions.append(CompressedAnalyzer.interpolate_linear(unpacked_prev['lats'][-1], unpacked_prev['longs'][-1],
-                                                                                  unpacked_curr['lats'][i], unpacked_curr['longs'][i],
-                                                                                  ratio))
-                else:
-                    output_positions.append(
-                        CompressedAnalyzer.interpolate_linear(unpacked_curr['lats'][i - 1], unpacked_curr['longs'][i - 1],
-                                                              unpacked_curr['lats'][i], unpacked_curr['longs'][i], ratio))
+        Positions of one packet's samples. packets_to_data_points does the same for all packets at once.
+
+        :param unpacked_prev: A dictionary containing the latitudes and longitudes observed during the previous
+                            minute's transmission (only the latest of each is used).
+        :param unpacked_curr: A dictionary containing the latitudes, longitudes and altitudes observed during the
+                            current minute's transmission. There may be any number of positions and altitudes.
+        :return: A list with the [lat, long] of each altitude, where some of the GPS data has been interpolated.
+        """
+        gps_points = len(unpacked_curr['lats'])
+        plan = interpolation.plan_for(gps_points, len(unpacked_curr['altitudes']))
+        # Only the last column of the previous row is used
+        lats, longs = plan.apply([np.full(gps_points, unpacked_prev['lats'][-1]), unpacked_curr['lats']],
+                                 [np.full(gps_points, unpacked_prev['longs'][-1]), unpacked_curr['longs']])
+        return np.column_stack((lats[0], longs[0])).tolist()
+
+
+class IncrementalDecoder:
+    """
+    Decodes packets one at a time, with a constant amount of work per packet. Only the previous packet (needed by
+    interpolate_gps_positions) and the previous data point (needed for the next vector) are kept.
+    """
+
+    def __init__(self, timestep, stats=instrumentation.NULL_STATS, time_interpolation=False, drop_missing=False,
+                 earth_model=geodesy.SPHERE, max_gap=None):
+        """
+        :param timestep: # of seconds between two datapoints.
+        :param stats: PipelineStats to record the stages of every packet in
+        :param time_interpolation: place samples using the time between packets, when both have a 'time'
+        :param drop_missing: drop data points without a position or altitude (see CompressedAnalyzer.drop_missing)
+        :param earth_model: one of geodesy.MODELS, used to compute the vectors
+        :param max_gap: start a new segment after a gap of more than max_gap seconds between two packets, and compute
+                        vectors with the time between data points (see Analyzer.calculate_segment_vectors)
+        """
+        self.timestep = timestep
+        self.stats = stats
+        self.time_interpolation = time_interpolation
+        self.drop_missing = drop_missing
+        self.earth_model = earth_model
+        self.max_gap = max_gap
+        self.previous_packet = None
+        self.previous_time = None
+        self.previous_data_point = None
+
+    def to_state(self) -> Dict:
+        """
+        :return: the previous packet and data point, as a JSON-serializable dictionary (see load_state)
+        """
+        return {'previous_packet': None if self.previous_packet is None else
+                [column.tolist() for column in self.previous_packet],
+                'previous_time': None if self.previous_time is None else self.previous_time.tolist(),
+                'previous_data_point': self.previous_data_point}
 
-        return output_positions
+    def load_state(self, state: Dict):
+        """
+        :param state: dictionary returned by to_state, to carry on decoding where that decoder stopped
+        """
+        packet, packet_time = state['previous_packet'], state['previous_time']
+        self.previous_packet = None if packet is None else tuple(np.array(column, dtype=float) for column in packet)
+        self.previous_time = None if packet_time is None else np.array(packet_time, dtype=float)
+        self.previous_data_point = state['previous_data_point']
+
+    def feed(self, packet: Dict[str, str]):
+        """
+        :param packet: dictionary with the 'lat', 'long', 'alt' and 'comment' of the newest packet
+        :return: (data points, vectors) added by this packet. Both are empty for the first packet.
+        """
+        unpacked = CompressedAnalyzer.unpack_packets([packet], self.stats)
+        timed = self.time_interpolation or self.max_gap is not None
+        times = CompressedAnalyzer.packet_times([packet]) if timed else None
+        previous_packet, previous_time = self.previous_packet, self.previous_time
+        self.previous_packet, self.previous_time = unpacked, times
+        if previous_packet is None:
+            return DataPointTable(), []
+        if (self.max_gap is not None and times is not None and previous_time is not None
+                and times[0] - previous_time[-1] > self.max_gap):
+            # Packets were lost: this packet starts a new segment, as the first packet did
+            return DataPointTable(), []
+
+        if times is not None and previous_time is not None:
+            times = np.concatenate((previous_time, times))
+        else:
+            times = None
+        data_points = CompressedAnalyzer.packets_to_data_points(
+            *(np.concatenate(columns) for columns in zip(previous_packet, unpacked)), stats=self.stats, times=times,
+            timestep=self.timestep, time_interpolation=self.time_interpolation)
+        if not data_points:
+            return data_points, []
+        with self.stats.stage('vectors') as stage:
+            points = DataPointTable(len(data_points) + 1)
+            if self.previous_data_point is not None:
+                points.append(*self.previous_data_point)
+            points.extend(data_points)
+            breaks = None
+            if self.drop_missing:
+                # As in CompressedAnalyzer.read_data_points, no vector spans a dropped data point
+                missing = CompressedAnalyzer.missing(points)
+                breaks = missing[:-1] | missing[1:]
+            vectors = CompressedAnalyzer.calculate_segment_vectors(points, self.timestep, self.max_gap, self.stats,
+                                                                   self.earth_model, breaks).tolist()
+            stage.add(rows_in=len(points), rows_out=len(vectors))
+        self.previous_data_point = data_points[-1] + [float(data_points.times[-1])]
+        if self.drop_missing:
+            data_points = CompressedAnalyzer.drop_missing(data_points)
+        return data_points, vectors
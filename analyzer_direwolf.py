@@ -1,26 +1,197 @@
-from typing import List
+from typing import List, Dict
+import asyncio
+import concurrent.futures
 import csv
+import io
+import os
+import time
 
 import analyzer_compressed
+import dedup
+import instrumentation
 
 
 class DirewolfAnalyzer(analyzer_compressed.CompressedAnalyzer):
 
-    def __init__(self, filename, timestep):
-        super().__init__(filename, timestep)
+    def __init__(self, filename, timestep, stats=None, time_interpolation=False, deduplicate=True, cache=None):
+        super().__init__(filename, timestep, stats, time_interpolation, deduplicate, cache)
 
-    @property
-    def data_points(self) -> List[List[float]]:
-        with open(self.filename, 'r', newline="") as input_file:
-            reader = csv.DictReader(input_file)
-            split_rows = [{'lat': x['latitude'],
-                           'long': x['longitude'],
-                           'alt': x['altitude'],
-                           'comment': x['comment'] }
-                          for x in reader]
+    def read_packets(self) -> List[Dict[str, str]]:
+        with self.stats.stage('read') as stage, \
+                open(self.filename, 'r', newline="", encoding='latin-1') as input_file:
+            split_rows = [DirewolfAnalyzer.packet(x) for x in csv.DictReader(input_file)]
+            stage.add(rows_out=len(split_rows), bytes_read=os.fstat(input_file.fileno()).st_size)
 
-        return DirewolfAnalyzer.process_input(split_rows)
+        return split_rows
 
+    def parse_lines(self, header: bytes, data: bytes) -> List[Dict[str, str]]:
+        fieldnames = next(csv.reader([header.decode('latin-1')]), [])
+        reader = csv.DictReader(io.StringIO(data.decode('latin-1'), newline=""), fieldnames=fieldnames)
+        return [DirewolfAnalyzer.packet(x) for x in reader]
 
+    @staticmethod
+    def packet(row: Dict[str, str]) -> Dict[str, str]:
+        """
+        :param row: row of the log, keyed by its header
+        :return: the packet dictionary of the row
+        """
+        return {'lat': row['latitude'],
+                'long': row['longitude'],
+                'alt': row['altitude'],
+                'comment': row['comment'],
+                'source': row.get('source'),
+                'time': row.get('utime')}
 
+    """
+    Live decoding of a log that Direwolf is still writing
+    """
 
+    def stream(self, follow=False, poll_interval=0.5, vectors_filename=None, datapoints_filename=None):
+        """
+        Decodes the log packet by packet, yielding as soon as each packet has been decoded.
+
+        :param follow: keep waiting for new packets at the end of the file (like tail -f) instead of stopping
+        :param poll_interval: # of seconds to wait before checking the file again when following
+        :param vectors_filename: optional CSV file that each new vector is appended to
+        :param datapoints_filename: optional CSV file that each new data point is appended to
+        :return: generator of (new data points, new vectors) for each packet that produced data points
+        """
+        for update in self._stream_updates(follow, vectors_filename, datapoints_filename):
+            if update is None:
+                time.sleep(poll_interval)
+            else:
+                yield update
+
+    async def astream(self, follow=False, poll_interval=0.5, vectors_filename=None, datapoints_filename=None):
+        """
+        Same as stream(), as an async iterator that doesn't block the event loop while waiting for new packets. File
+        reads and decoding run in a worker thread, one packet at a time.
+        """
+        loop = asyncio.get_running_loop()
+        # A single thread, so that the generator is never resumed (or closed) while a previous step is still running
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        updates = self._stream_updates(follow, vectors_filename, datapoints_filename)
+        end = object()
+        try:
+            while True:
+                update = await loop.run_in_executor(executor, next, updates, end)
+                if update is end:
+                    break
+                if update is None:
+                    await asyncio.sleep(poll_interval)
+                else:
+                    yield update
+        finally:
+            # Closes the output files once any step still running has finished
+            executor.submit(updates.close)
+            executor.shutdown(wait=False)
+
+    def _stream_updates(self, follow, vectors_filename, datapoints_filename):
+        """
+        Yields (data points, vectors) updates, or None whenever there is nothing new to read yet.
+        """
+        decoder = analyzer_compressed.IncrementalDecoder(self.timestep, self.stats, self.time_interpolation,
+                                                         earth_model=self.earth_model, max_gap=self.max_gap)
+        deduplicator = dedup.PacketDeduplicator() if self.deduplicate else None
+        vectors_file = DirewolfAnalyzer._open_output(vectors_filename, "Altitude,WindY,WindX\n")
+        datapoints_file = DirewolfAnalyzer._open_output(datapoints_filename, "Lat, Long, Alt, Wind\n")
+        try:
+            for row in self.follow_rows(follow):
+                if row is None:
+                    yield None
+                    continue
+
+                try:
+                    packet = DirewolfAnalyzer.packet(row)
+                    if deduplicator is not None and deduplicator.is_duplicate(packet):
+                        self.stats.count(instrumentation.DUPLICATE_PACKETS)
+                        continue
+                    data_points, vectors = decoder.feed(packet)
+                except (KeyError, ValueError):
+                    # A corrupted packet shouldn't stop a live decode; skip it and wait for the next one.
+                    self.stats.count(instrumentation.SKIPPED_PACKETS)
+                    continue
+                if not data_points:
+                    continue
+
+                for output_file, rows in ((datapoints_file, data_points), (vectors_file, vectors)):
+                    if output_file is not None:
+                        with self.stats.stage('write') as stage:
+                            csv.writer(output_file).writerows(rows)
+                            output_file.flush()
+                            stage.add(rows_in=len(rows), rows_out=len(rows))
+                yield data_points, vectors
+        finally:
+            for output_file in (vectors_file, datapoints_file):
+                if output_file is not None:
+                    output_file.close()
+
+    def follow_rows(self, follow=False):
+        """
+        Reads the log one row at a time. A last line without a newline is only read once it has been completed (or
+        at the end of the file when not following). When following, the log is reopened from the start if it is
+        replaced (rotated) or truncated.
+
+        :param follow: keep waiting for new rows at the end of the file
+        :return: generator of rows as dictionaries keyed by the CSV header; yields None while waiting for new data
+        """
+        input_file = None
+        header = None
+        pending = b""
+        try:
+            while True:
+                if input_file is None:
+                    try:
+                        input_file = open(self.filename, 'rb')
+                    except FileNotFoundError:
+                        if not follow:
+                            raise
+                        yield None
+                        continue
+                    header = None
+                    pending = b""
+
+                line = input_file.readline()
+                if line.endswith(b"\n") or (line == b"" and pending and not follow):
+                    line, pending = pending + line, b""
+                    values = next(csv.reader([line.decode('latin-1')]), None)
+                    if not values:
+                        continue
+                    if header is None:
+                        header = values
+                    else:
+                        yield dict(zip(header, values))
+                    continue
+
+                pending += line
+                if not follow:
+                    return
+                if DirewolfAnalyzer._was_rotated(self.filename, input_file):
+                    input_file.close()
+                    input_file = None
+                    continue
+                yield None
+        finally:
+            if input_file is not None:
+                input_file.close()
+
+    @staticmethod
+    def _was_rotated(filename, input_file) -> bool:
+        """
+        :return: True if filename no longer refers to input_file, or if the file got shorter than what was read.
+        """
+        try:
+            current = os.stat(filename)
+        except FileNotFoundError:
+            return False
+        opened = os.fstat(input_file.fileno())
+        return (current.st_ino, current.st_dev) != (opened.st_ino, opened.st_dev) or current.st_size < input_file.tell()
+
+    @staticmethod
+    def _open_output(filename, header):
+        if filename is None:
+            return None
+        output_file = open(filename, 'w', newline="")
+        output_file.write(header)
+        output_file.flush()
+        return output_file
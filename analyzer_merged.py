@@ -0,0 +1,29 @@
+from typing import List, Dict, Union
+
+import analyzer_compressed
+import dedup
+
+
+class MergedAnalyzer(analyzer_compressed.CompressedAnalyzer):
+    """
+    Decodes one flight from the logs of several ground stations (or several logs of one station). Packets are merged
+    in the order they were heard, and the copies heard by more than one station are only decoded once.
+    """
+
+    def __init__(self, analyzers: List[analyzer_compressed.CompressedAnalyzer], timestep, stats=None,
+                 time_interpolation=False, deduplicate=True):
+        """
+        :param analyzers: one analyzer per log, of any compressed format (each with its own decode cache, if any)
+        """
+        super().__init__(", ".join(str(t.filename) for t in analyzers), timestep, stats, time_interpolation,
+                         deduplicate)
+        self.analyzers = analyzers
+        # Packets of a raw log may have no position, wherever they were merged
+        self.drops_missing = any(t.drops_missing for t in analyzers)
+
+    def source_stamp(self):
+        stamps = tuple(t.source_stamp() for t in self.analyzers)
+        return None if None in stamps else stamps
+
+    def read_packets(self) -> List[Dict[str, Union[float, str, bytes]]]:
+        return dedup.merge_packets([t.load_packets() for t in self.analyzers])
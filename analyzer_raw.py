@@ -0,0 +1,150 @@
+from typing import List, Dict, Optional, Union
+import mmap
+import re
+
+import numpy as np
+
+import analyzer_compressed
+import config
+
+"""
+Patterns for TNC2-format packets: "[timestamp: ]source>dest,path:payload", one per line
+"""
+
+# Payload of a compressed position report: data type, optional /hhmmssh timestamp, the 13-byte compressed position
+# (symbol table, lat, long, symbol, cs, type) and the comment. Bytes the igate couldn't print appear as <0xNN>.
+PAYLOAD_PATTERN = (rb'(?:[/@](?P<timestamp>\d{6}[hz/])|[!=])'
+                   rb'(?P<position>(?:<0x[0-9a-fA-F]{2}>|[^\r\n]){13})'
+                   rb'(?P<comment>[^\r\n]*?)')
+
+PACKET_PATTERN = re.compile(rb'^(?:(?P<received>\d{4}-\d\d-\d\d[ T]\d\d:\d\d:\d\d(?: ?[A-Za-z]+)?):? )?'
+                            rb'(?P<source>[^>\s:]+)>(?P<path>[^:\r\n]*):' + PAYLOAD_PATTERN +
+                            rb'(?P<invalid> \[Invalid compressed packet\])?\r?$',
+                            re.MULTILINE)
+
+ESCAPE_PATTERN = re.compile(rb'<0x([0-9a-fA-F]{2})>')
+
+# Latitude and longitude of a compressed position sent without a GPS fix
+NO_FIX_POSITION = b"NN!!NN!!"
+
+# Hours from UTC of the time zones igates label their logs with
+TIME_ZONES = {'UTC': 0, 'GMT': 0, 'Z': 0, 'WET': 0, 'WEST': 1, 'BST': 1, 'CET': 1, 'CEST': 2, 'EET': 2, 'EEST': 3,
+              'NST': -3.5, 'NDT': -2.5, 'AST': -4, 'ADT': -3, 'EST': -5, 'EDT': -4, 'CST': -6, 'CDT': -5, 'MST': -7,
+              'MDT': -6, 'PST': -8, 'PDT': -7, 'AKST': -9, 'AKDT': -8, 'HST': -10}
+
+
+class RawPacketAnalyzer(analyzer_compressed.CompressedAnalyzer):
+    """
+    Analyzer for raw TNC2-format packet logs, as saved by igates and TNCs. Unlike aprs.fi exports, these also keep the
+    packets marked [Invalid compressed packet]; those are used as long as their comment is intact.
+    """
+
+    has_header = False
+    drops_missing = True
+
+    def __init__(self, filename, timestep, stats=None, time_interpolation=False, deduplicate=True, cache=None):
+        super().__init__(filename, timestep, stats, time_interpolation, deduplicate, cache)
+
+    def read_packets(self) -> List[Dict[str, Union[float, bytes]]]:
+        """
+        :return: one dictionary per usable packet, oldest first, with the decoded 'lat', 'long' and 'alt' of the
+                 position (NaN when missing), the unescaped 'comment', 'source', 'received' and 'timestamp' bytes, and
+                 the 'time' it was received (see received_time)
+        """
+        # Unescaping is done while matching, so it is timed as part of the read stage
+        with self.stats.stage('read') as stage, open(self.filename, 'rb') as input_file:
+            try:
+                buffer = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty file
+                return []
+            with buffer:
+                packets = RawPacketAnalyzer.parse_packets(PACKET_PATTERN.finditer(buffer))
+                stage.add(rows_out=len(packets), bytes_read=len(buffer))
+        return packets
+
+    def parse_lines(self, header: bytes, data: bytes) -> List[Dict[str, Union[float, bytes]]]:
+        return RawPacketAnalyzer.parse_packets(PACKET_PATTERN.finditer(data))
+
+    @staticmethod
+    def parse_packets(matches) -> List[Dict[str, Union[float, bytes]]]:
+        """
+        :param matches: matches of PACKET_PATTERN (or of any pattern with the groups of PAYLOAD_PATTERN)
+        :return: see read_packets
+        """
+        comment_length = 8 * (config.GPS_POINTS_DESIRED - 1) + 3 * (config.SENS_POINTS_DESIRED - 1) + 1
+
+        packets = []
+        positions = []
+        for match in matches:
+            comment = RawPacketAnalyzer.unescape(match['comment'])
+            invalid = 'invalid' in match.re.groupindex and match['invalid'] is not None
+            # An invalid packet is only salvaged if its comment is intact; a valid one may have extra characters
+            if len(comment) < comment_length or (invalid and len(comment) != comment_length):
+                continue
+            received = match['received'] if 'received' in match.re.groupindex else None
+            packets.append({'comment': comment,
+                            'source': match['source'] if 'source' in match.re.groupindex else None,
+                            'received': received,
+                            'timestamp': match['timestamp'],
+                            'time': RawPacketAnalyzer.received_time(received)})
+            positions.append(RawPacketAnalyzer.unescape(match['position']))
+
+        lats, longs, alts = RawPacketAnalyzer.decode_positions(positions)
+        for packet, lat, long, alt in zip(packets, lats.tolist(), longs.tolist(), alts.tolist()):
+            packet['lat'] = lat
+            packet['long'] = long
+            packet['alt'] = alt
+        return packets
+
+    @staticmethod
+    def received_time(received: Optional[bytes]) -> Optional[float]:
+        """
+        :param received: date and time an igate logged a packet at, with its time zone, e.g. b"2021-11-11 09:08:17 PST"
+        :return: that time in seconds since the epoch, or None without a time zone of TIME_ZONES (the time couldn't be
+                 compared with those of other logs)
+        """
+        if received is None:
+            return None
+        text = received.decode('ascii')
+        offset = TIME_ZONES.get(text[19:].strip().upper())
+        if offset is None:
+            return None
+        return analyzer_compressed.CompressedAnalyzer.parse_time(text[:19]) - 3600 * offset
+
+    @staticmethod
+    def decode_positions(positions: List[bytes]):
+        """
+        Decodes a batch of 13-byte compressed positions.
+
+        :param positions: compressed positions (symbol table, 4-byte lat, 4-byte long, symbol, cs, compression type)
+        :return: (latitudes, longitudes, altitudes) arrays, in decimal degrees and meters. Positions without a GPS fix
+                 are NaN, as are altitudes when the cs bytes don't hold one. Out-of-range altitude bytes give 0.12345,
+                 like in the comments.
+        """
+        if not positions:
+            return np.empty(0), np.empty(0), np.empty(0)
+
+        buffer = np.frombuffer(b"".join(positions), dtype=np.uint8).reshape(len(positions), 13)
+        codes = buffer[:, 1:9].astype(np.int64) - 33
+        lat_codes = ((codes[:, 0] * 91 + codes[:, 1]) * 91 + codes[:, 2]) * 91 + codes[:, 3]
+        long_codes = ((codes[:, 4] * 91 + codes[:, 5]) * 91 + codes[:, 6]) * 91 + codes[:, 7]
+
+        no_fix = np.array([position[1:9] == NO_FIX_POSITION for position in positions], dtype=bool)
+        lats = np.where(no_fix, np.nan, 90.0 - lat_codes / 380926.0)
+        longs = np.where(no_fix, np.nan, -180.0 + long_codes / 190463.0)
+
+        # The cs bytes hold the altitude when the GGA bits of the compression type are set
+        has_altitude = ((buffer[:, 12].astype(np.int64) - 33) & 0x18) == 0x10
+        alts = np.where(has_altitude, analyzer_compressed.ALTITUDE_TABLE[buffer[:, 10], buffer[:, 11]], np.nan)
+        return lats, longs, alts
+
+    @staticmethod
+    def unescape(raw: bytes) -> bytes:
+        """
+        :param raw: bytes from a TNC2 log
+        :return: the bytes with every <0xNN> replaced by the byte it stands for
+        """
+        if b"<0x" not in raw:
+            return raw
+        return ESCAPE_PATTERN.sub(lambda match: bytes([int(match[1], 16)]), raw)
@@ -1,40 +1,229 @@
-from typing import List
+"""
+Analyzer for the CSV logs written to the payload's SD card.
+
+Logs can be long and sampled much faster than the wind needs, so the file is parsed in blocks of chunk_rows rows,
+keeping only the columns used. Blocks can be resampled to one data point every timestep seconds using the Time column,
+and iter_vectors / write_outputs go through a flight block by block so that memory use doesn't grow with its length.
+"""
+from typing import Iterator, Tuple
 import csv
+import itertools
+
+import numpy as np
 
+import binary_output
 from analyzer import Analyzer
+from datapoints import DataPointTable
+
+# Rows parsed at once
+CHUNK_ROWS = 65536
+
+RESAMPLE_METHODS = ('linear', 'decimate')
+
+SECONDS_PER_DAY = 86400
+
+
+class Resampler:
+    """
+    Resamples data points onto times timestep seconds apart, starting at the time of the first data point. Data points
+    are given block by block; the last data point of a block is kept to resample the next one.
+
+    'linear' interpolates each column between the data points around each time, 'decimate' takes the latest data point
+    at or before it. Data points without a time, or not later than the data points before them, are dropped. With
+    max_gap, no data point is made up inside a gap of more than max_gap seconds between two data points of the log.
+    """
+
+    def __init__(self, timestep, method='linear', max_gap=None):
+        """
+        :param timestep: # of seconds between two resampled data points
+        :param method: one of RESAMPLE_METHODS
+        :param max_gap: optional longest time between two data points of the log to resample between, in seconds
+        """
+        if method not in RESAMPLE_METHODS:
+            raise ValueError(f"Unknown resampling method {method!r}, expected one of {RESAMPLE_METHODS}")
+        self.timestep = timestep
+        self.method = method
+        self.max_gap = max_gap
+        self.start = None
+        self.emitted = 0
+        self._previous = None
+
+    def feed(self, block: DataPointTable) -> DataPointTable:
+        """
+        :param block: next data points, with their times
+        :return: resampled data points up to the last time of the block
+        """
+        columns = np.vstack((block.lats, block.longs, block.alts, block.wind_speeds, block.times))
+        columns = columns[:, ~np.isnan(columns[4])]
+        if self._previous is not None:
+            columns = np.concatenate((self._previous[:, None], columns), axis=1)
+        if columns.shape[1] == 0:
+            return DataPointTable()
+
+        latest = np.maximum.accumulate(columns[4])
+        columns = columns[:, np.concatenate(([True], columns[4, 1:] > latest[:-1]))]
+        times = columns[4]
+        self._previous = columns[:, -1]
+        if self.start is None:
+            self.start = times[0]
+
+        end = int(np.floor((times[-1] - self.start) / self.timestep)) + 1
+        grid = self.start + self.timestep * np.arange(self.emitted, max(end, self.emitted))
+        self.emitted += len(grid)
+        if self.max_gap is not None:
+            before = np.searchsorted(times, grid, side='right') - 1
+            after = np.minimum(before + 1, len(times) - 1)
+            grid = grid[(grid == times[before]) | (times[after] - times[before] <= self.max_gap)]
+        if self.method == 'linear':
+            values = [np.interp(grid, times, column) for column in columns[:4]]
+        else:
+            values = columns[:4, np.searchsorted(times, grid, side='right') - 1]
+        return DataPointTable.from_columns(*values, times=grid)
 
 
 class SDAnalyzer(Analyzer):
+    # Columns read from the log; the others are skipped
+    COLUMNS = ('Time', 'Latitude', 'Longitude', 'GPS Alt', 'Windspeed')
 
-    def __init__(self, filename, timestep):
-        super().__init__(filename, timestep)
+    def __init__(self, filename, timestep, stats=None, resample=None, chunk_rows=CHUNK_ROWS):
+        """
+        :param resample: None to keep every row of the log, or one of RESAMPLE_METHODS to resample it to one data point
+                         every timestep seconds (see Resampler)
+        :param chunk_rows: # of rows parsed at once
+        """
+        super().__init__(filename, timestep, stats)
+        if resample is not None and resample not in RESAMPLE_METHODS:
+            raise ValueError(f"Unknown resampling method {resample!r}, expected None or one of {RESAMPLE_METHODS}")
+        self.resample = resample
+        self.chunk_rows = chunk_rows
 
-    @property
-    def data_points(self) -> List[List[float]]:
+    def data_point_settings(self):
+        return super().data_point_settings() + (self.resample,)
+
+    def read_data_points(self) -> DataPointTable:
         """
             Uses the following CSV format from SD card:
                 time, lat, long, gps alt (ft), sens alt (ft), pressure (Pa), temperature, wind  (kn)
             :return:
             """
+        blocks = list(self.data_point_blocks())
+        data_points = DataPointTable(sum(len(block) for block in blocks))
+        for block in blocks:
+            data_points.extend(block)
+        return data_points
+
+    def read_blocks(self) -> Iterator[DataPointTable]:
+        """
+        Parses the log chunk_rows rows at a time.
+
+        :return: a table for each block of rows. Times are in seconds from the midnight before the first row (the
+                 Time column is hhmmss), counting on past the next midnight.
+        """
         with open(self.filename, 'r', newline="") as input_file:
-            reader = csv.DictReader(input_file)
-            split_rows = [{'time': x['Time'],
-                           'lat': x['Latitude'],
-                           'long': x['Longitude'],
-                           'GPS Alt': x['GPS Alt'],
-                           'Sens Alt': x['Sens Alt'],
-                           'Pressure': x['Pressure'],
-                           'Temp': x['Sens Temp'],
-                           'Wind': x['Windspeed']
-                           } for x in reader]
-
-        output = []
-        for row in split_rows:
-            output.append(
-                [float(row['lat']),
-                 float(row['long']),
-                 Analyzer.feet_to_meters(float(row['GPS Alt'])),
-                 Analyzer.knots_to_meters_per_sec(float(row['Wind']))
-                 ])
-
-        return output
+            header_line = input_file.readline()
+            header = next(csv.reader([header_line]), [])
+            indices = [header.index(column) for column in SDAnalyzer.COLUMNS]
+            # The log is ASCII, so each character is a byte; the header is counted with the first block
+            size = len(header_line)
+            day = 0.0
+            previous = None
+
+            while True:
+                with self.stats.stage('read') as stage:
+                    lines = list(itertools.islice(input_file, self.chunk_rows))
+                    if not lines:
+                        break
+                    columns = np.array([[row[i] for i in indices] for row in csv.reader(lines) if row],
+                                       dtype=float).reshape(-1, 5)
+
+                    clock = columns[:, 0]
+                    clock = clock // 10000 * 3600 + clock // 100 % 100 * 60 + clock % 100
+                    steps = np.diff(clock, prepend=clock[:1] if previous is None else previous)
+                    days = day + SECONDS_PER_DAY * np.cumsum(steps < -SECONDS_PER_DAY / 2)
+                    if len(clock):
+                        day, previous = days[-1], clock[-1:]
+
+                    block = DataPointTable.from_columns(columns[:, 1], columns[:, 2],
+                                                        Analyzer.feet_to_meters(columns[:, 3]),
+                                                        Analyzer.knots_to_meters_per_sec(columns[:, 4]),
+                                                        clock + days)
+                    stage.add(rows_out=len(block), bytes_read=size + sum(len(line) for line in lines))
+                    size = 0
+                yield block
+
+    def data_point_blocks(self) -> Iterator[DataPointTable]:
+        """
+        :return: the data points block by block, resampled unless resample is None
+        """
+        if self.resample is None:
+            yield from self.read_blocks()
+            return
+
+        resampler = Resampler(self.timestep, self.resample, self.max_gap)
+        for block in self.read_blocks():
+            with self.stats.stage('resample') as stage:
+                resampled = resampler.feed(block)
+                stage.add(rows_in=len(block), rows_out=len(resampled))
+            yield resampled
+
+    def iter_vectors(self) -> Iterator[Tuple[DataPointTable, np.ndarray]]:
+        """
+        Goes through the flight block by block, without keeping it in memory.
+
+        :return: (data points, vectors) for each block. The vectors of a block start with the one from the last data
+                 point of the previous block, so together they are the same as vectors.
+        """
+        previous = None
+        for block in self.data_point_blocks():
+            with self.stats.stage('vectors') as stage:
+                columns = [block.lats, block.longs, block.alts, block.wind_speeds, block.times]
+                if previous is not None:
+                    columns = [np.concatenate((last, column)) for last, column in zip(previous, columns)]
+                if len(columns[0]) < 2:
+                    vectors = np.empty((0, 3))
+                else:
+                    vectors = Analyzer.calculate_segment_vectors(DataPointTable.from_columns(*columns), self.timestep,
+                                                                 self.max_gap, self.stats, self.earth_model)
+                if len(columns[0]):
+                    previous = [column[-1:] for column in columns]
+                stage.add(rows_in=len(block), rows_out=len(vectors))
+            yield block, vectors
+
+    def write_outputs(self, vectors_filename=None, datapoints_filename=None):
+        """
+        Writes the same files as output_vectors and save_datapoints in one pass over the log, a block at a time.
+
+        :param vectors_filename: CSV file to write the vectors to, or None
+        :param datapoints_filename: CSV file to write the data points to, or None
+        """
+        for filename in (vectors_filename, datapoints_filename):
+            if filename is not None and binary_output.is_binary(filename):
+                raise ValueError(f"{filename}: only CSV can be written block by block, use output_vectors or "
+                                 "save_datapoints for the binary format")
+
+        files = []
+        try:
+            vectors_writer = datapoints_writer = None
+            if vectors_filename is not None:
+                files.append(open(vectors_filename, 'w', newline=""))
+                files[-1].write("Altitude,WindY,WindX\n")
+                vectors_writer = csv.writer(files[-1])
+            if datapoints_filename is not None:
+                files.append(open(datapoints_filename, 'w', newline=""))
+                files[-1].write("Lat, Long, Alt, Wind\n")
+                datapoints_writer = csv.writer(files[-1])
+
+            written = 0
+            for block, vectors in self.iter_vectors():
+                with self.stats.stage('write') as stage:
+                    if vectors_writer is not None:
+                        vectors_writer.writerows(vectors.tolist())
+                    if datapoints_writer is not None:
+                        datapoints_writer.writerows(block.tolist())
+                    if self.stats.enabled:
+                        total = sum(file.tell() for file in files)
+                        stage.add(rows_in=len(block), rows_out=len(vectors), bytes_written=total - written)
+                        written = total
+        finally:
+            for file in files:
+                file.close()
@@ -0,0 +1,279 @@
+"""
+Batch decoding of many flights at once. Every input file (or every file in the given directories, or every file listed
+in a manifest) is matched to the right analyzer from its first line, and each (input, timestep) job is run in a pool of
+worker processes. Jobs whose outputs are newer than their input, and were written with the same settings, are skipped.
+
+Usage: python batch.py INPUT [INPUT ...] -o OUTPUT_DIR [-t TIMESTEP ...] [-m MANIFEST] [-j WORKERS] [--force] [--binary]
+                       [--stats] [--cache] [--earth-model {sphere,wgs84}] [--max-gap SECONDS]
+"""
+from typing import List, Dict, Optional, NamedTuple
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import csv
+import json
+import os
+import time
+
+import analyzer_aprsfi
+import analyzer_direwolf
+import analyzer_raw
+import analyzer_sd
+import geodesy
+import instrumentation
+
+ANALYZERS = {'sd': analyzer_sd.SDAnalyzer,
+             'direwolf': analyzer_direwolf.DirewolfAnalyzer,
+             'aprsfi': analyzer_aprsfi.AprsFiAnalyzer,
+             'raw': analyzer_raw.RawPacketAnalyzer}
+
+# Formats that can keep their decoded packets in a decode_cache.DecodeCache
+CACHEABLE = {'direwolf', 'aprsfi', 'raw'}
+
+# Decode cache file, in the output directory
+CACHE_FILENAME = "decode_cache.sqlite"
+
+# Columns that identify each CSV format
+HEADERS = {'sd': {'Time', 'Latitude', 'Longitude', 'GPS Alt', 'Windspeed'},
+           'direwolf': {'utime', 'latitude', 'longitude', 'altitude', 'comment'},
+           'aprsfi': {'time', 'lat', 'lng', 'altitude', 'comment'}}
+
+SUMMARY_COLUMNS = ['input', 'format', 'timestep', 'status', 'datapoints', 'vectors', 'seconds', 'error']
+
+
+class Job(NamedTuple):
+    input: str
+    format: str
+    timestep: float
+    vectors: str
+    datapoints: str
+    map_line: str
+    stats: Optional[str] = None
+    cache: Optional[str] = None
+    earth_model: str = geodesy.SPHERE
+    max_gap: Optional[float] = None
+    settings: Optional[str] = None
+
+
+def detect_format(filename) -> Optional[str]:
+    """
+    :param filename: input file
+    :return: key of ANALYZERS that can read the file, or None if it isn't a known format
+    """
+    try:
+        with open(filename, 'rb') as input_file:
+            lines = input_file.read(4096).splitlines()
+    except OSError:
+        return None
+    if not lines:
+        return None
+
+    columns = set(next(csv.reader([lines[0].decode('latin-1')]), []))
+    for name, header in HEADERS.items():
+        if header <= columns:
+            return name
+    if any(analyzer_raw.PACKET_PATTERN.match(line) for line in lines[:-1] or lines):
+        return 'raw'
+    return None
+
+
+def find_inputs(paths: List[str], manifest=None) -> Dict[str, str]:
+    """
+    :param paths: input files and directories (searched recursively)
+    :param manifest: optional text file listing one input path per line, relative to the manifest; # starts a comment
+    :return: dictionary of input file -> name used for its outputs (its path relative to the directory it was found in)
+    """
+    paths = list(paths)
+    if manifest is not None:
+        with open(manifest, 'r') as manifest_file:
+            for line in manifest_file:
+                line = line.split('#', 1)[0].strip()
+                if line:
+                    paths.append(os.path.join(os.path.dirname(manifest), line))
+
+    inputs = {}
+    for path in paths:
+        if not os.path.isdir(path):
+            inputs[path] = os.path.splitext(os.path.basename(path))[0]
+            continue
+        for directory, subdirectories, filenames in os.walk(path):
+            subdirectories[:] = sorted(d for d in subdirectories if not d.startswith('.'))
+            for filename in sorted(filenames):
+                if filename.startswith('.'):
+                    continue
+                full_path = os.path.join(directory, filename)
+                inputs[full_path] = os.path.splitext(os.path.relpath(full_path, path))[0]
+
+    # Inputs that only differ by extension (e.g. flight.csv and flight.log) keep it in their output names
+    names = list(inputs.values())
+    for input_file, name in inputs.items():
+        if names.count(name) > 1:
+            inputs[input_file] = name + os.path.splitext(input_file)[1].replace('.', '_')
+    return inputs
+
+
+def plan_jobs(inputs: Dict[str, str], output_dir, timesteps, binary=False, stats=False, cache=False,
+              earth_model=geodesy.SPHERE, max_gap=None) -> List[Job]:
+    """
+    :param inputs: as returned by find_inputs
+    :param output_dir: directory for the output files
+    :param timesteps: # of seconds between two datapoints, one job is made per timestep
+    :param binary: write vectors and datapoints as .npy files instead of CSV
+    :param stats: also write the stage timings and glitch counts of each job to a JSON file
+    :param cache: keep the decoded packets of the packet logs in CACHE_FILENAME, so that only new packets are decoded
+                  the next time
+    :param earth_model: Earth model used to compute the vectors, one of geodesy.MODELS
+    :param max_gap: split flights at gaps of more than max_gap seconds and use the actual time between data points
+                    (see Analyzer.max_gap)
+    :return: one job per recognized input and timestep, biggest inputs first so that the pool stays busy
+    """
+    extension = ".npy" if binary else ".csv"
+    jobs = []
+    for input_file, name in inputs.items():
+        input_format = detect_format(input_file)
+        if input_format is None:
+            continue
+        for timestep in timesteps:
+            prefix = os.path.join(output_dir, f"{name}_{timestep:g}s")
+            jobs.append(Job(input_file, input_format, timestep,
+                            prefix + "_vec" + extension, prefix + "_dp" + extension, prefix + "_map.csv",
+                            prefix + "_stats.json" if stats else None,
+                            os.path.join(output_dir, CACHE_FILENAME) if cache and input_format in CACHEABLE else None,
+                            earth_model, max_gap, prefix + "_settings.json"))
+    jobs.sort(key=lambda job: os.path.getsize(job.input), reverse=True)
+    return jobs
+
+
+def job_settings(job: Job) -> Dict:
+    """
+    :return: the settings of the job that change its outputs besides the timestep (which is in their names). They are
+             saved next to the outputs, so that changing them makes the outputs out of date.
+    """
+    return {'earth_model': job.earth_model, 'max_gap': job.max_gap}
+
+
+def is_up_to_date(job: Job) -> bool:
+    """
+    :return: True if every output of the job exists and is newer than its input, and its settings file holds the
+             job's settings
+    """
+    try:
+        input_time = os.path.getmtime(job.input)
+        outputs = [job.vectors, job.datapoints, job.map_line] + ([job.stats] if job.stats else [])
+        if not all(os.path.getmtime(output) >= input_time for output in outputs):
+            return False
+        if job.settings is None:
+            return True
+        with open(job.settings, 'r') as settings_file:
+            return json.load(settings_file) == job_settings(job)
+    except (OSError, ValueError):
+        return False
+
+
+def run_job(job: Job) -> Dict:
+    """
+    Decodes one input and writes its vectors, datapoints and map line. Runs in a worker process.
+
+    :return: summary row for the job
+    """
+    summary = {'input': job.input, 'format': job.format, 'timestep': job.timestep, 'status': 'done',
+               'datapoints': '', 'vectors': '', 'seconds': '', 'error': ''}
+    start = time.perf_counter()
+    try:
+        os.makedirs(os.path.dirname(job.vectors) or '.', exist_ok=True)
+        stats = instrumentation.PipelineStats() if job.stats else None
+        if job.cache:
+            t = ANALYZERS[job.format](job.input, job.timestep, stats, cache=job.cache)
+        else:
+            t = ANALYZERS[job.format](job.input, job.timestep, stats)
+        t.earth_model = job.earth_model
+        t.max_gap = job.max_gap
+        t.output_vectors(job.vectors)
+        t.save_datapoints(job.datapoints)
+        t.output_map_line(job.map_line)
+        if job.settings:
+            with open(job.settings, 'w') as settings_file:
+                json.dump(job_settings(job), settings_file)
+        summary['datapoints'] = len(t.data_points)
+        summary['vectors'] = len(t.vectors)
+        if job.stats:
+            t.stats.dump(job.stats)
+    except Exception as e:
+        summary['status'] = 'failed'
+        summary['error'] = f"{type(e).__name__}: {e}"
+    summary['seconds'] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+def run_batch(paths: List[str], output_dir, timesteps, workers=None, force=False, manifest=None,
+              binary=False, stats=False, cache=False, earth_model=geodesy.SPHERE, max_gap=None) -> List[Dict]:
+    """
+    :param paths: input files and directories
+    :param output_dir: directory for the output files and summary.csv
+    :param timesteps: # of seconds between two datapoints; every input is decoded once per timestep
+    :param workers: # of worker processes (default: one per core; 1 runs everything in this process)
+    :param force: re-run jobs even if their outputs are up to date
+    :param manifest: optional manifest file of inputs, see find_inputs
+    :param binary: write vectors and datapoints as .npy files instead of CSV
+    :param stats: write the stage timings and glitch counts of each job next to its outputs, see instrumentation
+    :param cache: keep the decoded packets in a decode cache in output_dir, see decode_cache
+    :param earth_model: Earth model used to compute the vectors, one of geodesy.MODELS
+    :param max_gap: see plan_jobs
+    :return: summary rows, one per job
+    """
+    jobs = plan_jobs(find_inputs(paths, manifest), output_dir, timesteps, binary, stats, cache, earth_model,
+                     max_gap)
+    if cache:
+        os.makedirs(output_dir, exist_ok=True)
+
+    summaries = []
+    pending = []
+    for job in jobs:
+        if not force and is_up_to_date(job):
+            summaries.append({'input': job.input, 'format': job.format, 'timestep': job.timestep,
+                              'status': 'skipped', 'datapoints': '', 'vectors': '', 'seconds': '', 'error': ''})
+        else:
+            pending.append(job)
+
+    if workers == 1:
+        summaries.extend(run_job(job) for job in pending)
+    elif pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            summaries.extend(executor.map(run_job, pending))
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "summary.csv"), 'w', newline="") as summary_file:
+        writer = csv.DictWriter(summary_file, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(summaries)
+    return summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode every flight log in a directory or manifest.")
+    parser.add_argument('inputs', nargs='*', help="input files or directories")
+    parser.add_argument('-o', '--output-dir', default="outputs")
+    parser.add_argument('-t', '--timestep', type=float, nargs='+', default=[15],
+                        help="# of seconds between two datapoints (several values run several jobs)")
+    parser.add_argument('-m', '--manifest', help="text file listing one input per line")
+    parser.add_argument('-j', '--workers', type=int, help="# of worker processes (default: # of cores)")
+    parser.add_argument('--force', action='store_true', help="re-run jobs whose outputs are up to date")
+    parser.add_argument('--binary', action='store_true', help="write vectors and datapoints as .npy files")
+    parser.add_argument('--stats', action='store_true', help="write the stage timings of each job as JSON")
+    parser.add_argument('--cache', action='store_true',
+                        help=f"keep decoded packets in OUTPUT_DIR/{CACHE_FILENAME} to only decode new packets "
+                             "next time")
+    parser.add_argument('--earth-model', choices=geodesy.MODELS, default=geodesy.SPHERE,
+                        help="shape of the Earth used to turn positions into wind vectors")
+    parser.add_argument('--max-gap', type=float,
+                        help="split flights where no data arrived for more than MAX_GAP seconds, and compute vectors "
+                             "from the actual time between data points")
+    args = parser.parse_args()
+
+    summaries = run_batch(args.inputs, args.output_dir, args.timestep, args.workers, args.force, args.manifest,
+                          args.binary, args.stats, args.cache, args.earth_model, args.max_gap)
+    for status in ('done', 'skipped', 'failed'):
+        print(f"{status}: {sum(summary['status'] == status for summary in summaries)}")
+
+
+if __name__ == '__main__':
+    main()
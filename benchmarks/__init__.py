@@ -0,0 +1,5 @@
+"""
+Benchmarks for the analyzers, run on synthetic flights whose winds are known exactly.
+
+Usage: python -m benchmarks [--sizes 100 10000 1000000] [--formats sd direwolf aprsfi raw] [--json results.json]
+"""
@@ -0,0 +1,171 @@
+"""
+Times every stage of every analyzer on synthetic flights of increasing length, and checks the vectors they produce
+against the flight's true winds.
+"""
+from typing import Dict, List
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import analyzer_aprsfi
+import analyzer_compressed
+import analyzer_direwolf
+import analyzer_raw
+import analyzer_sd
+import config
+from benchmarks.synthetic import SyntheticFlight
+
+# Analyzer, SyntheticFlight writer and file extension for each input format
+FORMATS = {'sd': (analyzer_sd.SDAnalyzer, SyntheticFlight.write_sd, ".csv"),
+           'direwolf': (analyzer_direwolf.DirewolfAnalyzer, SyntheticFlight.write_direwolf, ".csv"),
+           'aprsfi': (analyzer_aprsfi.AprsFiAnalyzer, SyntheticFlight.write_aprsfi, ".csv"),
+           'raw': (analyzer_raw.RawPacketAnalyzer, SyntheticFlight.write_tnc2, ".txt")}
+
+STAGES = ['parse', 'decode', 'interpolate', 'vectors', 'write']
+
+
+@contextlib.contextmanager
+def timed(timings: Dict[str, float], stage):
+    start = time.perf_counter()
+    yield
+    timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def run_case(input_format, packets, workdir, measure_memory=True, **flight_options) -> Dict:
+    """
+    Generates a flight, writes it in the given format and decodes it.
+
+    :param input_format: key of FORMATS
+    :param packets: # of packets in the flight
+    :param workdir: directory for the input and output files
+    :param measure_memory: also decode the flight once more under tracemalloc to find the peak memory
+    :param flight_options: passed on to SyntheticFlight
+    :return: dictionary of results: seconds per stage, total seconds, packets per second, peak memory and the error of
+             the vectors against the true winds
+    """
+    analyzer_class, writer, extension = FORMATS[input_format]
+    flight = SyntheticFlight(packets, **flight_options)
+    filename = os.path.join(workdir, f"{input_format}_{packets}{extension}")
+    writer(flight, filename)
+    vectors_filename = os.path.join(workdir, f"{input_format}_{packets}_vec.csv")
+    datapoints_filename = os.path.join(workdir, f"{input_format}_{packets}_dp.csv")
+
+    # Each stage on its own
+    t = analyzer_class(filename, flight.timestep)
+    timings = {}
+    if issubclass(analyzer_class, analyzer_compressed.CompressedAnalyzer):
+        with timed(timings, 'parse'):
+            raw = t.read_packets()
+        with timed(timings, 'decode'):
+            unpacked = t.unpack_packets(raw)
+        with timed(timings, 'interpolate'):
+            data_points = t.packets_to_data_points(*unpacked)
+        first_sample = config.SENS_POINTS_DESIRED
+    else:
+        with timed(timings, 'parse'):
+            data_points = t.read_data_points()
+        first_sample = 0
+    with timed(timings, 'vectors'):
+        vectors = t.calculate_components_batch(data_points.lats, data_points.longs, data_points.alts,
+                                               data_points.wind_speeds, flight.timestep)
+
+    # The whole pipeline, as a user would run it
+    t = analyzer_class(filename, flight.timestep)
+    start = time.perf_counter()
+    t.vectors
+    with timed(timings, 'write'):
+        t.output_vectors(vectors_filename)
+        t.save_datapoints(datapoints_filename)
+    total = time.perf_counter() - start
+
+    peak_memory = None
+    if measure_memory:
+        tracemalloc.start()
+        t = analyzer_class(filename, flight.timestep)
+        t.output_vectors(vectors_filename)
+        t.save_datapoints(datapoints_filename)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    true_y = flight.true_wind_y[first_sample:first_sample + len(vectors)]
+    true_x = flight.true_wind_x[first_sample:first_sample + len(vectors)]
+    errors = np.hypot(vectors[:, 1] - true_y, vectors[:, 2] - true_x)
+
+    return {'format': input_format,
+            'packets': packets,
+            'data_points': len(data_points),
+            'vectors': len(vectors),
+            'input_bytes': os.path.getsize(filename),
+            'seconds': {stage: round(timings.get(stage, 0.0), 6) for stage in STAGES},
+            'total_seconds': round(total, 6),
+            'packets_per_second': round(packets / total, 1) if total > 0 else None,
+            'peak_memory_bytes': peak_memory,
+            'rms_error': float(np.sqrt(np.mean(errors ** 2))) if len(errors) else None,
+            'max_error': float(errors.max()) if len(errors) else None,
+            # Changes whenever an optimization changes the results
+            'vectors_digest': hashlib.sha1(np.round(vectors, 6).tobytes()).hexdigest()[:12]}
+
+
+def run(sizes: List[int], formats: List[str], workdir=None, measure_memory=True, **flight_options) -> List[Dict]:
+    """
+    :param sizes: flight lengths, in packets
+    :param formats: keys of FORMATS
+    :param workdir: directory for the generated files (default: a temporary directory, deleted afterwards)
+    :return: one result per (size, format), see run_case
+    """
+    own_workdir = workdir is None
+    if own_workdir:
+        workdir = tempfile.mkdtemp(prefix="wb_benchmark_")
+    try:
+        results = []
+        for packets in sizes:
+            for input_format in formats:
+                result = run_case(input_format, packets, workdir, measure_memory, **flight_options)
+                print_result(result)
+                results.append(result)
+        return results
+    finally:
+        if own_workdir:
+            shutil.rmtree(workdir)
+
+
+def print_result(result: Dict):
+    stages = "  ".join(f"{stage} {result['seconds'][stage]:8.4f}" for stage in STAGES)
+    memory = "" if result['peak_memory_bytes'] is None else f"  peak {result['peak_memory_bytes'] / 2 ** 20:8.1f} MiB"
+    error = "" if result['rms_error'] is None else f"  rms error {result['rms_error']:.3f} m/s"
+    print(f"{result['format']:>8} {result['packets']:>8}  {stages}  total {result['total_seconds']:8.4f} s  "
+          f"{result['packets_per_second']:>10} packets/s{memory}{error}  [{result['vectors_digest']}]", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the analyzers on synthetic flights.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 10000, 1000000], help="# of packets per flight")
+    parser.add_argument('--formats', nargs='+', choices=list(FORMATS), default=list(FORMATS))
+    parser.add_argument('--timestep', type=float, default=15, help="# of seconds between two samples")
+    parser.add_argument('--ascent-rate', type=float, default=5.0, help="m/s")
+    parser.add_argument('--wind-speed', type=float, default=5.0, help="wind speed at launch, m/s")
+    parser.add_argument('--wind-shear', type=float, default=2.0, help="change in wind speed per km, m/s")
+    parser.add_argument('--workdir', help="keep the generated files in this directory")
+    parser.add_argument('--no-memory', action='store_true', help="skip the (slower) peak memory measurement")
+    parser.add_argument('--json', help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+    results = run(args.sizes, args.formats, args.workdir, not args.no_memory, timestep=args.timestep,
+                  ascent_rate=args.ascent_rate, wind_speed=args.wind_speed, wind_shear=args.wind_shear)
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
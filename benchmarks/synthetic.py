@@ -0,0 +1,253 @@
+"""
+Synthetic flights, and encoders that write them in every input format the analyzers read.
+
+The balloon is carried by a wind that varies linearly with altitude (wind shear) while it rises and falls between the
+launch altitude and a ceiling. The wind turns around while the balloon descends, so every climb and descent ends back
+over the launch site and a flight can be made as long as needed without leaving the encodable range of positions.
+Every sample's position is known exactly, so the wind the analyzers should find between two samples is known too.
+"""
+import math
+import time
+
+import numpy as np
+
+import config
+import geodesy
+
+# Of latitude, on the sphere of the default Earth model
+METERS_PER_DEGREE = math.pi / 180 * geodesy.EARTH_RADIUS
+
+# 2021-11-11 17:00:00 UTC, the first launch
+DEFAULT_START_TIME = 1636650000
+
+
+class SyntheticFlight:
+    """
+    A flight of whole APRS packets. Each packet holds SENS_POINTS_DESIRED samples taken timestep seconds apart and
+    GPS_POINTS_DESIRED positions spread evenly over the same interval, the latest of each at the packet's time.
+    """
+
+    def __init__(self, packets, timestep=15, ascent_rate=5.0, wind_speed=5.0, wind_direction=60.0, wind_shear=2.0,
+                 launch=(49.0, -123.0, 100.0), ceiling=30000.0, sensor_slip=0.0, start_time=DEFAULT_START_TIME):
+        """
+        :param packets: # of packets in the flight
+        :param timestep: # of seconds between two samples
+        :param ascent_rate: vertical speed, in m/s (the balloon descends at the same rate after reaching the ceiling)
+        :param wind_speed: wind speed at the launch altitude, in m/s
+        :param wind_direction: direction the wind blows towards, in degrees clockwise from north
+        :param wind_shear: change in wind speed per km of altitude, in m/s
+        :param launch: (latitude, longitude, altitude) of the launch site
+        :param ceiling: altitude at which the balloon starts descending, in meters
+        :param sensor_slip: horizontal speed of the air relative to the balloon, in m/s (0: it drifts with the wind)
+        :param start_time: time of the first sample, in seconds since the epoch
+        """
+        self.packets = packets
+        self.timestep = timestep
+        self.ascent_rate = ascent_rate
+        self.wind_speed = wind_speed
+        self.wind_direction = wind_direction
+        self.wind_shear = wind_shear
+        self.launch = launch
+        self.ceiling = ceiling
+        self.sensor_slip = sensor_slip
+        self.start_time = start_time
+
+        samples = config.SENS_POINTS_DESIRED
+        gps = config.GPS_POINTS_DESIRED
+        # Samples of packet k are at (k * samples + j + 1) * timestep, its positions at k * samples * timestep +
+        # (g + 1) * samples * timestep / gps. Work on a grid fine enough to hold both.
+        grid_step = samples * timestep / math.lcm(samples, gps)
+        steps_per_sample = round(timestep / grid_step)
+        steps_per_gps = round(samples * timestep / gps / grid_step)
+        grid_times = np.arange(packets * samples * steps_per_sample + 1) * grid_step
+
+        grid_alts = self.altitude_at(grid_times)
+        mid_times = (grid_times[1:] + grid_times[:-1]) / 2
+        wind_y, wind_x = self.wind_at(self.altitude_at(mid_times), self.descending(mid_times))
+        north = np.concatenate(([0.0], np.cumsum(wind_y * grid_step)))
+        lats = launch[0] + north / METERS_PER_DEGREE
+        east_degrees = wind_x * grid_step / (METERS_PER_DEGREE * np.cos(np.radians(lats[:-1])))
+        longs = launch[1] + np.concatenate(([0.0], np.cumsum(east_degrees)))
+
+        sample_index = np.arange(1, packets * samples + 1) * steps_per_sample
+        self.times = start_time + grid_times[sample_index]
+        self.lats = lats[sample_index]
+        self.longs = longs[sample_index]
+        self.alts = grid_alts[sample_index]
+        vertical_speed = np.abs(np.gradient(grid_alts, grid_step))[sample_index]
+        self.wind_speeds = np.sqrt(vertical_speed ** 2 + sensor_slip ** 2)
+
+        gps_index = (np.arange(packets)[:, None] * samples * steps_per_sample
+                     + np.arange(1, gps + 1)[None, :] * steps_per_gps)
+        self.gps_lats = lats[gps_index]
+        self.gps_longs = longs[gps_index]
+
+        # Average wind between consecutive samples, i.e. what a perfect decoder would report
+        north_samples = north[sample_index]
+        east_samples = np.concatenate(([0.0], np.cumsum(wind_x * grid_step)))[sample_index]
+        self.true_wind_y = np.diff(north_samples) / timestep
+        self.true_wind_x = np.diff(east_samples) / timestep
+
+    def altitude_at(self, seconds):
+        """
+        :param seconds: time since the first sample
+        :return: altitude, rising from the launch altitude to the ceiling and back down, repeatedly
+        """
+        span = self.ceiling - self.launch[2]
+        travelled = np.mod(np.asarray(seconds) * self.ascent_rate, 2 * span)
+        return self.launch[2] + np.where(travelled <= span, travelled, 2 * span - travelled)
+
+    def descending(self, seconds):
+        """
+        :param seconds: time since the first sample
+        :return: True where the balloon is descending
+        """
+        span = self.ceiling - self.launch[2]
+        return np.mod(np.asarray(seconds) * self.ascent_rate, 2 * span) > span
+
+    def wind_at(self, alts, descending=False):
+        """
+        :param alts: altitudes, in meters
+        :param descending: True where the balloon is descending, and the wind blows the other way
+        :return: (northward, eastward) wind components, in m/s
+        """
+        speed = self.wind_speed + self.wind_shear * np.asarray(alts) / 1000
+        speed = np.where(descending, -speed, speed)
+        direction = math.radians(self.wind_direction)
+        return speed * math.cos(direction), speed * math.sin(direction)
+
+    @property
+    def samples(self):
+        return len(self.times)
+
+    """
+    Encoders
+    """
+
+    def comments(self):
+        """
+        :return: the base91 compressed comment of every packet, as bytes
+        """
+        samples = config.SENS_POINTS_DESIRED
+        gps = config.GPS_POINTS_DESIRED
+        lats = encode_latitudes(self.gps_lats[:, :-1])
+        longs = encode_longitudes(self.gps_longs[:, :-1])
+        alts = encode_altitudes(self.alts.reshape(-1, samples)[:, :-1])
+        winds = encode_wind_speeds(self.wind_speeds.reshape(-1, samples))
+
+        gps_part = np.concatenate((lats, longs), axis=2).reshape(self.packets, 8 * (gps - 1))
+        sens_part = np.concatenate((alts, winds[:, :-1, None]), axis=2).reshape(self.packets, 3 * (samples - 1))
+        buffer = np.ascontiguousarray(np.concatenate((gps_part, sens_part, winds[:, -1:]), axis=1))
+        width = buffer.shape[1]
+        raw = buffer.tobytes()
+        return [raw[i * width:(i + 1) * width] for i in range(self.packets)]
+
+    def packet_times(self):
+        """
+        :return: time of every packet, i.e. of its latest sample
+        """
+        return self.times[config.SENS_POINTS_DESIRED - 1::config.SENS_POINTS_DESIRED]
+
+    def latest(self):
+        """
+        :return: (latitude, longitude, altitude) sent in the position of every packet
+        """
+        return (self.gps_lats[:, -1], self.gps_longs[:, -1],
+                self.alts[config.SENS_POINTS_DESIRED - 1::config.SENS_POINTS_DESIRED])
+
+    def write_sd(self, filename):
+        """
+        SD card CSV: one row per sample, altitudes in feet and wind speed in knots. Times are hhmmss, with milliseconds
+        when timestep isn't a whole number of seconds.
+        """
+        with open(filename, 'w', newline="") as file:
+            file.write("Time,Latitude,Longitude,GPS Alt,Sens Alt,Pressure,Sens Temp,Windspeed\n")
+            alts_ft = self.alts * 3.2808399
+            knots = self.wind_speeds / 0.5144439999984337
+            for t, lat, long, alt, wind in zip(self.times.tolist(), self.lats.tolist(), self.longs.tolist(),
+                                               alts_ft.tolist(), knots.tolist()):
+                clock = time.gmtime(t)
+                seconds = clock.tm_sec + round(t % 1, 3)
+                seconds = f"{seconds:02.0f}" if seconds == int(seconds) else f"{seconds:06.3f}"
+                file.write(f"{clock.tm_hour:02d}{clock.tm_min:02d}{seconds},{lat:.7f},{long:.7f},"
+                           f"{alt:.2f},{alt:.2f},101325.0,15.0,{wind:.4f}\n")
+
+    def write_direwolf(self, filename, source="VE7BVU-1"):
+        """
+        Direwolf CSV log: one row per packet, position rounded like Direwolf does.
+        """
+        lats, longs, alts = self.latest()
+        with open(filename, 'w', newline="", encoding='latin-1') as file:
+            file.write("chan,utime,isotime,source,heard,level,error,dti,name,symbol,latitude,longitude,speed,course,"
+                       "altitude,frequency,offset,tone,system,status,telemetry,comment\n")
+            for t, lat, long, alt, comment in zip(self.packet_times().tolist(), lats.tolist(), longs.tolist(),
+                                                  alts.tolist(), self.comments()):
+                utime = int(t)
+                isotime = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(utime))
+                file.write(f"0,{utime},{isotime},{source},{source},50(10/10),0,/,{source},/O,{lat:.6f},{long:.6f},,,"
+                           f"{alt:.1f},,,,,,,{csv_field(comment.decode('latin-1'))}\n")
+
+    def write_aprsfi(self, filename):
+        """
+        aprs.fi export: quotes and backslashes in the comment are escaped with a backslash.
+        """
+        lats, longs, alts = self.latest()
+        with open(filename, 'w', newline="") as file:
+            file.write("time,lasttime,lat,lng,speed,course,altitude,comment\n")
+            for t, lat, long, alt, comment in zip(self.packet_times().tolist(), lats.tolist(), longs.tolist(),
+                                                  alts.tolist(), self.comments()):
+                stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(t))
+                escaped = comment.decode('latin-1').replace("\\", "\\\\").replace('"', '\\"')
+                file.write(f'{stamp},{stamp},{lat:.5f},{long:.5f},,,{alt:.2f},"{escaped}"\n')
+
+    def write_tnc2(self, filename, source="VE7BVU-1"):
+        """
+        Raw TNC2 packet log, as saved by an igate.
+        """
+        lats, longs, alts = self.latest()
+        positions = np.concatenate((encode_latitudes(lats), encode_longitudes(longs)), axis=1)
+        cs = encode_altitudes(alts)
+        with open(filename, 'wb') as file:
+            for i, (t, comment) in enumerate(zip(self.packet_times().tolist(), self.comments())):
+                clock = time.gmtime(t)
+                file.write(time.strftime("%Y-%m-%d %H:%M:%S UTC: ", clock).encode() + source.encode()
+                           + b">APRS,WIDE2-1,qAR,VE7XXX-10:/" + time.strftime("%H%M%Sh", clock).encode()
+                           + b"/" + positions[i].tobytes() + b"O" + cs[i].tobytes() + b"S" + comment + b"\n")
+
+
+def csv_field(value: str) -> str:
+    """
+    :return: value quoted for a CSV file if it needs to be
+    """
+    if any(character in value for character in ',"\r\n'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def base91_digits(codes, width):
+    """
+    :param codes: array of non-negative integers
+    :param width: # of base91 characters per code
+    :return: uint8 array of ASCII characters, with a trailing axis of length width
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    powers = 91 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+    return ((codes[..., None] // powers) % 91 + 33).astype(np.uint8)
+
+
+def encode_latitudes(lats):
+    return base91_digits(np.rint((90.0 - np.asarray(lats)) * 380926.0), 4)
+
+
+def encode_longitudes(longs):
+    return base91_digits(np.rint((180.0 + np.asarray(longs)) * 190463.0), 4)
+
+
+def encode_altitudes(alts):
+    feet = np.maximum(np.asarray(alts) * 3.2808399, 1.0)
+    return base91_digits(np.clip(np.rint(np.log(feet) / math.log(1.002)), 0, 91 * 91 - 1), 2)
+
+
+def encode_wind_speeds(wind_speeds):
+    knots = np.asarray(wind_speeds) / 0.5144439999984337
+    return base91_digits(np.clip(np.rint(np.log(knots + 1.0) / math.log(1.08)), 0, 90), 1)[..., 0]
@@ -0,0 +1,73 @@
+"""
+Binary output for vectors and data points, as .npy files of fixed-width float64 records. Unlike the CSV outputs, these
+can be memory-mapped by a consumer (np.load(filename, mmap_mode='r')) without any parsing.
+"""
+from typing import Iterable
+import os
+
+import numpy as np
+
+from datapoints import DataPointTable
+
+# One record per vector / data point. The field names are the columns of the matching CSV file.
+VECTOR_DTYPE = np.dtype([('Altitude', '<f8'), ('WindY', '<f8'), ('WindX', '<f8')])
+DATAPOINT_DTYPE = np.dtype([('Lat', '<f8'), ('Long', '<f8'), ('Alt', '<f8'), ('Wind', '<f8'), ('Time', '<f8')])
+
+
+def is_binary(filename) -> bool:
+    """
+    :return: True if filename should be written/read in the binary format, i.e. it ends in .npy
+    """
+    return os.path.splitext(filename)[1].lower() == ".npy"
+
+
+def write_vectors(filename, vectors: Iterable[Iterable[float]]):
+    """
+    :param filename: .npy file to write
+    :param vectors: [Altitude, Y_component, X_component] rows
+    """
+    rows = np.asarray(vectors, dtype='<f8').reshape(-1, len(VECTOR_DTYPE.names))
+    np.save(filename, np.ascontiguousarray(rows).view(VECTOR_DTYPE).reshape(-1), allow_pickle=False)
+
+
+def write_datapoints(filename, data_points: DataPointTable):
+    """
+    :param filename: .npy file to write
+    :param data_points: table of data points; the Time field is NaN where the time isn't known
+    """
+    records = np.empty(len(data_points), dtype=DATAPOINT_DTYPE)
+    for field, column in zip(DATAPOINT_DTYPE.names, DataPointTable.COLUMNS):
+        records[field] = getattr(data_points, column)
+    np.save(filename, records, allow_pickle=False)
+
+
+def load_vectors(filename, mmap=True) -> np.ndarray:
+    """
+    :param filename: vectors written by Analyzer.output_vectors, as .npy or CSV
+    :param mmap: memory-map .npy files instead of reading them into memory
+    :return: array of VECTOR_DTYPE records
+    """
+    return _load(filename, VECTOR_DTYPE, mmap)
+
+
+def load_datapoints(filename, mmap=True) -> np.ndarray:
+    """
+    :param filename: data points written by Analyzer.save_datapoints, as .npy or CSV
+    :param mmap: memory-map .npy files instead of reading them into memory
+    :return: array of DATAPOINT_DTYPE records (Time is NaN when it wasn't saved)
+    """
+    return _load(filename, DATAPOINT_DTYPE, mmap)
+
+
+def _load(filename, dtype, mmap) -> np.ndarray:
+    if is_binary(filename):
+        records = np.load(filename, mmap_mode='r' if mmap else None, allow_pickle=False)
+        if records.dtype != dtype:
+            raise ValueError(f"{filename} holds {records.dtype} records, expected {dtype}")
+        return records
+
+    rows = np.loadtxt(filename, delimiter=",", skiprows=1, ndmin=2)
+    records = np.full(len(rows), np.nan, dtype=dtype)
+    for i, field in enumerate(dtype.names[:rows.shape[1]]):
+        records[field] = rows[:, i]
+    return records
@@ -0,0 +1,90 @@
+"""
+Checkpoints of incremental decoding (see CompressedAnalyzer.update_outputs), so that the outputs of a log can be brought
+up to date after it grew, or after the decoder crashed, in a time proportional to the new data.
+
+A checkpoint is a small JSON file holding how far into the input the outputs go, the state of the decoder and of the
+deduplicator at that point, and the size of each output. It is replaced atomically once the outputs have been written
+and flushed to disk, so that rows written after the last checkpoint (e.g. before a crash) can be told apart and are
+cut off when resuming.
+"""
+from typing import Dict, Optional
+import json
+import os
+
+import decode_cache
+
+CHECKPOINT_VERSION = 2
+
+
+def write_atomic(filename, text):
+    """
+    Writes a file so that it either keeps its previous contents or has the new ones, even after a crash.
+    """
+    temporary = f"{filename}.tmp"
+    with open(temporary, 'w') as output_file:
+        output_file.write(text)
+        output_file.flush()
+        os.fsync(output_file.fileno())
+    os.replace(temporary, filename)
+
+
+class Checkpoint:
+    """
+    State of the incremental decoding of one input into a set of outputs.
+    """
+
+    def __init__(self, settings: Dict, offset=0, identity=("", ""), decoder=None, deduplicator=None, outputs=None):
+        """
+        :param settings: what the outputs depend on besides the input (analyzer, timestep, output files, ...)
+        :param offset: # of bytes of the input that went into the outputs
+        :param identity: hashes of the input up to offset, as hex strings (see decode_cache.DecodeCache.identity)
+        :param decoder: IncrementalDecoder.to_state() at offset
+        :param deduplicator: PacketDeduplicator.to_state() at offset, if packets are deduplicated
+        :param outputs: size of each output file, by filename
+        """
+        self.settings = settings
+        self.offset = offset
+        self.identity = tuple(identity)
+        self.decoder = decoder
+        self.deduplicator = deduplicator
+        self.outputs = outputs or {}
+
+    @staticmethod
+    def load(filename) -> Optional['Checkpoint']:
+        """
+        :return: the checkpoint saved in filename, or None if there isn't one (or it can't be read)
+        """
+        try:
+            with open(filename, 'r') as input_file:
+                state = json.load(input_file)
+        except (OSError, ValueError):
+            return None
+        if state.get('version') != CHECKPOINT_VERSION:
+            return None
+        return Checkpoint(state['settings'], state['offset'], state['identity'], state['decoder'],
+                          state['deduplicator'], state['outputs'])
+
+    def save(self, filename):
+        write_atomic(filename, json.dumps({'version': CHECKPOINT_VERSION, 'settings': self.settings,
+                                           'offset': self.offset, 'identity': list(self.identity),
+                                           'decoder': self.decoder, 'deduplicator': self.deduplicator,
+                                           'outputs': self.outputs}))
+
+    def resumable(self, input_filename, settings: Dict) -> bool:
+        """
+        :return: True if the outputs can be carried on from this checkpoint: same settings, the input only grew since,
+                 and every output is still at least as long as when the checkpoint was saved
+        """
+        if settings != self.settings or Checkpoint.input_identity(input_filename, self.offset) != self.identity:
+            return False
+        for filename, size in self.outputs.items():
+            try:
+                if os.path.getsize(filename) < size:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    @staticmethod
+    def input_identity(filename, offset):
+        return tuple(digest.hex() for digest in decode_cache.DecodeCache.identity(filename, offset))
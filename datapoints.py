@@ -0,0 +1,177 @@
+"""
+Compact storage for data points
+"""
+from typing import Iterable, Iterator, List, Tuple
+import math
+
+import numpy as np
+
+
+class DataPointTable:
+    """
+    Data points stored as contiguous float64 columns: latitude, longitude, altitude, sensor wind speed and time (in
+    seconds, NaN when unknown). Iterating or indexing gives rows in the usual [Lat, Long, Altitude, sensor wind speed]
+    format, so a table can be used wherever a list of data points was.
+    """
+    COLUMNS = ('lats', 'longs', 'alts', 'wind_speeds', 'times')
+
+    def __init__(self, capacity=16):
+        """
+        :param capacity: # of data points that can be appended before the columns are reallocated
+        """
+        self._data = np.empty((len(DataPointTable.COLUMNS), max(capacity, 1)))
+        self._length = 0
+
+    @classmethod
+    def from_columns(cls, lats, longs, alts, wind_speeds, times=None) -> 'DataPointTable':
+        """
+        :param lats: latitudes, in decimal degrees
+        :param longs: longitudes, in decimal degrees
+        :param alts: altitudes, in meters
+        :param wind_speeds: velocities measured by sensor
+        :param times: optional times, in seconds
+        :return: table holding a copy of the columns
+        """
+        lats = np.asarray(lats, dtype=float).ravel()
+        table = cls(len(lats))
+        table._data[0, :len(lats)] = lats
+        table._data[1, :len(lats)] = np.asarray(longs, dtype=float).ravel()
+        table._data[2, :len(lats)] = np.asarray(alts, dtype=float).ravel()
+        table._data[3, :len(lats)] = np.asarray(wind_speeds, dtype=float).ravel()
+        table._data[4, :len(lats)] = np.nan if times is None else np.asarray(times, dtype=float).ravel()
+        table._length = len(lats)
+        return table
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Iterable[float]]) -> 'DataPointTable':
+        """
+        :param rows: data points as [Lat, Long, Altitude, sensor wind speed] or [..., time] rows
+        """
+        rows = [list(row) for row in rows]
+        table = cls(len(rows))
+        for row in rows:
+            table.append(*row)
+        return table
+
+    @classmethod
+    def _view(cls, data) -> 'DataPointTable':
+        # Shares data; its capacity is its length so that appending to it reallocates instead of overwriting
+        table = cls.__new__(cls)
+        table._data = data
+        table._length = data.shape[1]
+        return table
+
+    """
+    Columns, as zero-copy views
+    """
+
+    @property
+    def lats(self) -> np.ndarray:
+        return self._data[0, :self._length]
+
+    @property
+    def longs(self) -> np.ndarray:
+        return self._data[1, :self._length]
+
+    @property
+    def alts(self) -> np.ndarray:
+        return self._data[2, :self._length]
+
+    @property
+    def wind_speeds(self) -> np.ndarray:
+        return self._data[3, :self._length]
+
+    @property
+    def times(self) -> np.ndarray:
+        return self._data[4, :self._length]
+
+    @property
+    def has_times(self) -> bool:
+        """
+        True if every data point has a known time
+        """
+        return not np.isnan(self.times).any()
+
+    def segments(self, max_gap=None, breaks=None) -> List[Tuple[int, int]]:
+        """
+        Splits the table into runs of data points whose times increase by at most max_gap seconds from one to the next.
+        A data point whose time doesn't increase, or that comes more than max_gap seconds after the previous one (e.g.
+        after packets were lost), starts a new segment.
+
+        :param max_gap: longest time between two consecutive data points of a segment, in seconds (None to ignore the
+                        times)
+        :param breaks: optional boolean for each pair of consecutive data points, True where the second one starts a
+                       new segment (e.g. samples were dropped between them)
+        :return: (start, end) indices of each segment, in order, so that table[start:end] is the segment
+        """
+        split = np.zeros(max(self._length - 1, 0), dtype=bool) if breaks is None else np.array(breaks, dtype=bool)
+        if max_gap is not None:
+            steps = np.diff(self.times)
+            split |= ~((steps > 0) & (steps <= max_gap))
+        breaks = np.flatnonzero(split) + 1
+        bounds = np.concatenate(([0], breaks, [self._length])).tolist()
+        return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+    """
+    Adding data points
+    """
+
+    def append(self, lat, long, alt, wind_speed, time=math.nan):
+        self._reserve(self._length + 1)
+        self._data[:, self._length] = (lat, long, alt, wind_speed, time)
+        self._length += 1
+
+    def extend(self, other):
+        """
+        :param other: a DataPointTable, or data point rows
+        """
+        if not isinstance(other, DataPointTable):
+            other = DataPointTable.from_rows(other)
+        self._reserve(self._length + len(other))
+        self._data[:, self._length:self._length + len(other)] = other._data[:, :len(other)]
+        self._length += len(other)
+
+    def _reserve(self, capacity):
+        if capacity > self._data.shape[1]:
+            data = np.empty((len(DataPointTable.COLUMNS), max(capacity, 2 * self._data.shape[1])))
+            data[:, :self._length] = self._data[:, :self._length]
+            self._data = data
+
+    """
+    List-like behaviour
+    """
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self) -> Iterator[List[float]]:
+        return iter(self.tolist())
+
+    def __getitem__(self, index):
+        """
+        An integer gives a [Lat, Long, Altitude, sensor wind speed] row, a slice gives a table sharing this table's
+        memory, and a boolean mask or array of indices gives a new table.
+        """
+        if isinstance(index, slice):
+            return DataPointTable._view(self._data[:, :self._length][:, index])
+        if isinstance(index, (int, np.integer)):
+            if not -self._length <= index < self._length:
+                raise IndexError("data point index out of range")
+            return self._data[:4, index % self._length].tolist()
+        return DataPointTable._view(self._data[:, :self._length][:, np.asarray(index)])
+
+    def __eq__(self, other):
+        try:
+            return self.tolist() == [list(row) for row in other]
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return f"DataPointTable({self.tolist()!r})"
+
+    def tolist(self, with_times=False) -> List[List[float]]:
+        """
+        :param with_times: add the time as a fifth value to each row
+        :return: data points as a list of rows
+        """
+        return self._data[:5 if with_times else 4, :self._length].T.tolist()
@@ -0,0 +1,169 @@
+"""
+On-disk cache of decoded packets, so that decoding a log again after it has grown (during a flight, or while it is
+being downloaded) only reads and decodes the lines added since the last run.
+
+The cache is a SQLite file. Each log is remembered by its analyzer and path, along with how far into the file it was
+decoded and a hash of the start of the file and of the bytes just before that point: if the log was replaced or
+rewritten instead of appended to, its entries are dropped and it is decoded from the start. The whole cache is cleared
+when the decoding parameters in config.py change.
+"""
+from typing import Dict, List, Tuple
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+import config
+
+# Bump when a change to the decoder changes the decoded values, to invalidate existing caches
+CACHE_VERSION = 2
+
+# # of bytes hashed at the start of a log and before the end of the decoded part
+IDENTITY_BYTES = 4096
+
+
+def config_fingerprint() -> str:
+    """
+    :return: hash of the decoding parameters in config.py and of CACHE_VERSION
+    """
+    parameters = {name: repr(getattr(config, name)) for name in dir(config) if name.isupper()}
+    parameters['CACHE_VERSION'] = CACHE_VERSION
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode()).hexdigest()
+
+
+class DecodeCache:
+    """
+    Decoded packets of any number of logs, stored in a SQLite file. A connection is only opened for each load or
+    store, so the cache can be shared by worker processes.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: SQLite file, created if it doesn't exist
+        """
+        self.path = path
+
+    def load(self, key, filename) -> Tuple[List[Dict], int]:
+        """
+        :param key: name of the log in the cache (see CompressedAnalyzer.cache_key)
+        :param filename: the log
+        :return: (packets decoded from the log so far, each with its 'decoded' values, offset of the first byte not
+                 decoded yet). Nothing is returned if the log changed other than by growing.
+        """
+        with self._connect() as connection:
+            row = connection.execute("SELECT head, tail, end FROM files WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return [], 0
+            head, tail, end = row
+            if DecodeCache.identity(filename, end) != (head, tail):
+                connection.execute("DELETE FROM chunks WHERE key = ?", (key,))
+                connection.execute("DELETE FROM files WHERE key = ?", (key,))
+                return [], 0
+            chunks = connection.execute("SELECT packets, decoded, widths FROM chunks WHERE key = ? ORDER BY start",
+                                        (key,)).fetchall()
+
+        packets = []
+        for packet_json, decoded, widths in chunks:
+            packets.extend(DecodeCache.decode_chunk(packet_json, decoded, json.loads(widths)))
+        return packets, end
+
+    def store(self, key, filename, start, end, packets: List[Dict]):
+        """
+        Adds the packets decoded from bytes start to end of the log. Nothing is stored unless start is where the cached
+        packets of the log end, e.g. when another process got there first.
+
+        :param packets: packets with their 'decoded' values, as (latitudes, longitudes, altitudes, wind speeds)
+        """
+        head, tail = DecodeCache.identity(filename, end)
+        with self._connect() as connection:
+            row = connection.execute("SELECT end FROM files WHERE key = ?", (key,)).fetchone()
+            if (0 if row is None else row[0]) != start or end <= start:
+                return
+            if packets:
+                packet_json, decoded, widths = DecodeCache.encode_chunk(packets)
+                connection.execute("INSERT INTO chunks (key, start, packets, decoded, widths) VALUES (?, ?, ?, ?, ?)",
+                                   (key, start, packet_json, decoded, json.dumps(widths)))
+            connection.execute("INSERT OR REPLACE INTO files (key, head, tail, end) VALUES (?, ?, ?, ?)",
+                               (key, head, tail, end))
+
+    def clear(self):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM chunks")
+            connection.execute("DELETE FROM files")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        Opens the cache in a transaction, creating its tables or clearing it if config.py changed.
+        """
+        with contextlib.closing(sqlite3.connect(self.path, timeout=30, isolation_level=None)) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+                connection.execute("CREATE TABLE IF NOT EXISTS files "
+                                   "(key TEXT PRIMARY KEY, head BLOB, tail BLOB, end INTEGER)")
+                connection.execute("CREATE TABLE IF NOT EXISTS chunks "
+                                   "(key TEXT, start INTEGER, packets TEXT, decoded BLOB, widths TEXT, "
+                                   "PRIMARY KEY (key, start))")
+                fingerprint = config_fingerprint()
+                row = connection.execute("SELECT value FROM meta WHERE name = 'config'").fetchone()
+                if row is None or row[0] != fingerprint:
+                    connection.execute("DELETE FROM chunks")
+                    connection.execute("DELETE FROM files")
+                    connection.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('config', ?)",
+                                       (fingerprint,))
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    @staticmethod
+    def identity(filename, end) -> Tuple[bytes, bytes]:
+        """
+        :return: hashes of the first bytes of the file and of the bytes before end (empty if the file is shorter)
+        """
+        try:
+            with open(filename, 'rb') as input_file:
+                if os.fstat(input_file.fileno()).st_size < end:
+                    return b"", b""
+                head = input_file.read(min(IDENTITY_BYTES, end))
+                input_file.seek(max(end - IDENTITY_BYTES, 0))
+                tail = input_file.read(end - input_file.tell())
+        except OSError:
+            return b"", b""
+        return hashlib.sha256(head).digest(), hashlib.sha256(tail).digest()
+
+    """
+    Serialization of packets. Packet values are numbers, strings, bytes or None; bytes are stored as ["b", latin-1].
+    """
+
+    @staticmethod
+    def encode_chunk(packets: List[Dict]) -> Tuple[str, bytes, List[int]]:
+        """
+        :return: (packets without their decoded values as JSON, decoded values as float64 bytes, # of values of each
+                 decoded column)
+        """
+        values = [{name: ["b", value.decode('latin-1')] if isinstance(value, bytes) else value
+                   for name, value in packet.items() if name != 'decoded'}
+                  for packet in packets]
+        columns = [np.array([packet['decoded'][i] for packet in packets], dtype=float) for i in range(4)]
+        decoded = np.concatenate([column.reshape(len(packets), -1) for column in columns], axis=1)
+        return json.dumps(values), decoded.tobytes(), [column.shape[1] for column in columns]
+
+    @staticmethod
+    def decode_chunk(packet_json, decoded, widths) -> List[Dict]:
+        """
+        :return: the packets given to encode_chunk
+        """
+        packets = [{name: value[1].encode('latin-1') if isinstance(value, list) else value
+                    for name, value in packet.items()}
+                   for packet in json.loads(packet_json)]
+        decoded = np.frombuffer(decoded, dtype=float).reshape(len(packets), sum(widths))
+        columns = np.split(decoded, np.cumsum(widths)[:-1], axis=1)
+        for i, packet in enumerate(packets):
+            packet['decoded'] = tuple(column[i] for column in columns)
+        return packets
@@ -0,0 +1,134 @@
+"""
+Suppression of duplicate packets: copies of one transmission repeated by digipeaters, or heard by several ground
+stations whose logs are merged. Each copy would otherwise be decoded as one more packet of data.
+
+Copies have the same comment, and are heard within a few seconds of each other. They also have the same source and
+compressed timestamp, but only when both copies have them: aprs.fi exports keep neither, and the same packet must be
+recognized in an aprs.fi export and in a raw igate log. A tracker that isn't moving can send the same comment in
+consecutive packets, so without a compressed timestamp, packets are only duplicates when heard within the window.
+That takes a 'time' for each packet (every reader sets one when the log has it; raw packet logs use the time the igate
+received the packet). Packets without a time can't be placed in the window: they are remembered until max_entries
+newer packets were seen, so a repeated comment is dropped even if it was sent again minutes later.
+"""
+from typing import Dict, Iterable, List, Tuple
+import collections
+import hashlib
+import heapq
+
+import analyzer_compressed
+
+# Seconds within which copies of a packet are heard; less than the time between two packets
+DEFAULT_WINDOW = 5.0
+
+
+class PacketDeduplicator:
+    """
+    Remembers the packets of the last window seconds (and at most max_entries of them) and drops any packet seen again.
+    Packets without a 'time' are remembered until max_entries packets were seen after them. Packets must be given in
+    the order they were heard.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, max_entries=4096):
+        """
+        :param window: # of seconds a packet is remembered for, when packets have a 'time'
+        :param max_entries: # of packets remembered at most
+        """
+        self.window = window
+        self.max_entries = max_entries
+        self.dropped = 0
+        self._seen = collections.OrderedDict()
+
+    @staticmethod
+    def key(packet: Dict) -> int:
+        """
+        :param packet: packet dictionary, with its 'comment'
+        :return: hash of the comment, the same for every copy of the packet. It is the same in every process, so that
+                 it can be saved in a checkpoint.
+        """
+        digest = hashlib.blake2b(analyzer_compressed.CompressedAnalyzer.comment_bytes(packet['comment']),
+                                 digest_size=8).digest()
+        return int.from_bytes(digest, 'little')
+
+    @staticmethod
+    def origin(packet: Dict) -> Tuple[str, str]:
+        """
+        :param packet: packet dictionary, with its 'source' and compressed 'timestamp' when known
+        :return: (source, timestamp), "" when unknown
+        """
+        values = []
+        for name in ('source', 'timestamp'):
+            value = packet.get(name) or ""
+            if isinstance(value, bytes):
+                value = value.decode('latin-1')
+            values.append(value)
+        return values[0], values[1]
+
+    def is_duplicate(self, packet: Dict) -> bool:
+        """
+        :param packet: packet dictionary (see key and origin), with its 'time' if known
+        :return: True if the packet was seen within the window, or was seen at all when either copy has no 'time';
+                 otherwise it is remembered. Packets with the same comment are copies unless both have a source, or
+                 both have a timestamp, and those differ.
+        """
+        now = analyzer_compressed.CompressedAnalyzer.parse_time(packet.get('time'))
+        if now is not None:
+            # Oldest first; packets without a time are only forgotten once there are too many
+            while self._seen:
+                oldest = next(iter(self._seen.values()))[0]
+                if oldest is None or oldest >= now - self.window:
+                    break
+                self._seen.popitem(last=False)
+
+        key = PacketDeduplicator.key(packet)
+        source, timestamp = PacketDeduplicator.origin(packet)
+        if key in self._seen:
+            seen, seen_source, seen_timestamp = self._seen[key]
+            same_origin = (not (source and seen_source) or source == seen_source) and \
+                          (not (timestamp and seen_timestamp) or timestamp == seen_timestamp)
+            if same_origin and (now is None or seen is None or now - seen <= self.window):
+                # Later copies may tell the source and timestamp that the first one didn't have
+                self._seen[key] = (seen, seen_source or source, seen_timestamp or timestamp)
+                self.dropped += 1
+                return True
+            del self._seen[key]
+
+        self._seen[key] = (now, source, timestamp)
+        if len(self._seen) > self.max_entries:
+            self._seen.popitem(last=False)
+        return False
+
+    def to_state(self) -> Dict:
+        """
+        :return: what the deduplicator remembers, as a JSON-serializable dictionary (see load_state)
+        """
+        return {'dropped': self.dropped, 'seen': [[key, *seen] for key, seen in self._seen.items()]}
+
+    def load_state(self, state: Dict):
+        """
+        :param state: dictionary returned by to_state, to carry on where that deduplicator stopped
+        """
+        self.dropped = state['dropped']
+        self._seen = collections.OrderedDict((key, (seen, source, timestamp))
+                                             for key, seen, source, timestamp in state['seen'])
+
+    def filter(self, packets: Iterable[Dict]) -> List[Dict]:
+        """
+        :return: the packets that aren't duplicates, in the same order
+        """
+        return [packet for packet in packets if not self.is_duplicate(packet)]
+
+
+def merge_packets(packet_lists: List[List[Dict]]) -> List[Dict]:
+    """
+    :param packet_lists: packets read from several logs, each oldest first
+    :return: all the packets in the order they were heard. Duplicates are kept; see PacketDeduplicator.
+    :raises ValueError: if packets of more than one log don't all have a 'time' (logs can't be interleaved without
+                        knowing when each packet was heard)
+    """
+    timed = [[(analyzer_compressed.CompressedAnalyzer.parse_time(packet.get('time')), packet) for packet in packets]
+             for packets in packet_lists]
+    if any(time is None for packets in timed for time, packet in packets):
+        if sum(1 for packets in packet_lists if packets) > 1:
+            raise ValueError("Can't merge logs whose packets don't all have a time")
+        return [packet for packets in packet_lists for packet in packets]
+    return [packet for time, packet in heapq.merge(*timed, key=lambda entry: entry[0])]
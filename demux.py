@@ -0,0 +1,206 @@
+"""
+Demultiplexing of packet logs that hold several flights. A Direwolf or raw packet log records every station heard on
+the frequency, so on a launch day with several payloads, the whole log is read once with the analyzer's read_packets,
+its packets are then split by source callsign in one pass (dropping the packets that don't hold a compressed comment),
+and each flight is decoded in its own worker process. Only the packets kept are deduplicated and decoded.
+
+Usage: python demux.py INPUT -o OUTPUT_DIR [-t TIMESTEP] [-c CALLSIGN ...] [--no-ssid] [-j WORKERS] [--binary]
+                       [--earth-model {sphere,wgs84}] [--max-gap SECONDS]
+"""
+from typing import Dict, List, NamedTuple, Optional
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import os
+import re
+
+import analyzer_compressed
+import batch
+import config
+import geodesy
+import instrumentation
+
+
+class FlightJob(NamedTuple):
+    callsign: str
+    packets: List[Dict]
+    timestep: float
+    time_interpolation: bool
+    deduplicate: bool
+    drops_missing: bool
+    vectors: str
+    datapoints: str
+    map_line: str
+    earth_model: str = geodesy.SPHERE
+    max_gap: Optional[float] = None
+
+
+class CallsignAnalyzer(analyzer_compressed.CompressedAnalyzer):
+    """
+    Decodes the packets of one callsign, already read from a log by another analyzer.
+    """
+
+    def __init__(self, packets: List[Dict], callsign, timestep, stats=None, time_interpolation=False,
+                 deduplicate=True, drops_missing=False):
+        """
+        :param packets: the callsign's packets, as returned by read_packets, oldest first
+        :param drops_missing: drop data points without a position (see CompressedAnalyzer.drop_missing), as the
+                              analyzer of raw logs does
+        """
+        super().__init__(callsign, timestep, stats, time_interpolation, deduplicate)
+        self.packets = packets
+        self.drops_missing = drops_missing
+
+    def source_stamp(self):
+        return len(self.packets)
+
+    def read_packets(self) -> List[Dict]:
+        return self.packets
+
+
+def callsign_of(packet: Dict, ssid=True) -> Optional[str]:
+    """
+    :param ssid: keep the SSID (VE7BVU-1 and VE7BVU-2 are different flights); otherwise it is dropped
+    :return: the packet's source callsign in upper case, or None if it has none
+    """
+    source = packet.get('source')
+    if isinstance(source, bytes):
+        source = source.decode('latin-1')
+    if not source:
+        return None
+    source = source.strip().upper()
+    return source if ssid else source.split('-', 1)[0]
+
+
+def is_compressed(packet: Dict) -> bool:
+    """
+    :return: True if the packet's comment can be a compressed comment: long enough, without spaces or control
+             characters in the part that gets decoded
+    """
+    comment = packet.get('comment')
+    if comment is None:
+        return False
+    comment = analyzer_compressed.CompressedAnalyzer.comment_bytes(comment)
+    body_length = 8 * (config.GPS_POINTS_DESIRED - 1) + 3 * (config.SENS_POINTS_DESIRED - 1)
+    if len(comment) < body_length + 1:
+        return False
+    return min(comment[:body_length] + comment[-1:]) > 32
+
+
+def demux_packets(packets: List[Dict], ssid=True, callsigns=None,
+                  stats=instrumentation.NULL_STATS) -> Dict[str, List[Dict]]:
+    """
+    :param packets: packets of a log, as returned by read_packets
+    :param ssid: see callsign_of
+    :param callsigns: optional callsigns to keep (others are dropped)
+    :param stats: PipelineStats to record the 'demux' stage and the number of dropped packets in
+    :return: packets of each callsign, in the order of the log. Packets without a source or a compressed comment,
+             or from another callsign, are dropped.
+    """
+    wanted = None if callsigns is None else {callsign.strip().upper() for callsign in callsigns}
+    flights = {}
+    with stats.stage('demux') as stage:
+        for packet in packets:
+            callsign = callsign_of(packet, ssid)
+            if callsign is None or (wanted is not None and callsign not in wanted) or not is_compressed(packet):
+                continue
+            flights.setdefault(callsign, []).append(packet)
+        kept = sum(len(flight) for flight in flights.values())
+        stage.add(rows_in=len(packets), rows_out=kept)
+    stats.count(instrumentation.FOREIGN_PACKETS, len(packets) - kept)
+    return flights
+
+
+def plan_flights(t: analyzer_compressed.CompressedAnalyzer, output_dir, ssid=True, callsigns=None,
+                 binary=False) -> List[FlightJob]:
+    """
+    Reads every packet of the log of t once, then splits them by callsign (see demux_packets).
+
+    :param t: analyzer of the log, whose timestep and settings are used for every flight
+    :param output_dir: directory for the output files, named after the log and the callsign
+    :return: one job per callsign, biggest flights first
+    """
+    flights = demux_packets(t.read_packets(), ssid, callsigns, t.stats)
+    name = os.path.splitext(os.path.basename(t.filename))[0]
+    extension = ".npy" if binary else ".csv"
+    jobs = []
+    for callsign, packets in flights.items():
+        prefix = os.path.join(output_dir, f"{name}_{re.sub(r'[^A-Za-z0-9-]', '_', callsign)}_{t.timestep:g}s")
+        jobs.append(FlightJob(callsign, packets, t.timestep, t.time_interpolation, t.deduplicate, t.drops_missing,
+                              prefix + "_vec" + extension, prefix + "_dp" + extension, prefix + "_map.csv",
+                              t.earth_model, t.max_gap))
+    jobs.sort(key=lambda job: len(job.packets), reverse=True)
+    return jobs
+
+
+def run_flight(job: FlightJob) -> Dict:
+    """
+    Decodes one flight and writes its vectors, datapoints and map line. Runs in a worker process.
+
+    :return: summary row for the flight
+    """
+    summary = {'callsign': job.callsign, 'packets': len(job.packets), 'status': 'done', 'datapoints': '',
+               'vectors': '', 'error': ''}
+    try:
+        t = CallsignAnalyzer(job.packets, job.callsign, job.timestep, time_interpolation=job.time_interpolation,
+                             deduplicate=job.deduplicate, drops_missing=job.drops_missing)
+        t.earth_model = job.earth_model
+        t.max_gap = job.max_gap
+        t.output_vectors(job.vectors)
+        t.save_datapoints(job.datapoints)
+        t.output_map_line(job.map_line)
+        summary['datapoints'] = len(t.data_points)
+        summary['vectors'] = len(t.vectors)
+    except Exception as e:
+        summary['status'] = 'failed'
+        summary['error'] = f"{type(e).__name__}: {e}"
+    return summary
+
+
+def decode_flights(t: analyzer_compressed.CompressedAnalyzer, output_dir, ssid=True, callsigns=None, workers=None,
+                   binary=False) -> List[Dict]:
+    """
+    :param t: analyzer of a log holding several flights
+    :param output_dir: directory for the output files
+    :param ssid: see callsign_of
+    :param callsigns: optional callsigns to decode (default: every callsign with compressed packets)
+    :param workers: # of worker processes (default: one per core; 1 decodes everything in this process)
+    :param binary: write vectors and datapoints as .npy files instead of CSV
+    :return: summary rows, one per callsign
+    """
+    jobs = plan_flights(t, output_dir, ssid, callsigns, binary)
+    os.makedirs(output_dir, exist_ok=True)
+    if workers == 1 or len(jobs) < 2:
+        return [run_flight(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run_flight, jobs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode every flight of a packet log holding several callsigns.")
+    parser.add_argument('input', help="Direwolf or raw packet log")
+    parser.add_argument('-o', '--output-dir', default="outputs")
+    parser.add_argument('-t', '--timestep', type=float, default=15, help="# of seconds between two datapoints")
+    parser.add_argument('-c', '--callsign', nargs='+', help="only decode these callsigns")
+    parser.add_argument('--no-ssid', action='store_true', help="group callsigns that only differ by SSID")
+    parser.add_argument('-j', '--workers', type=int, help="# of worker processes (default: # of cores)")
+    parser.add_argument('--binary', action='store_true', help="write vectors and datapoints as .npy files")
+    parser.add_argument('--earth-model', choices=geodesy.MODELS, default=geodesy.SPHERE,
+                        help="shape of the Earth used to turn positions into wind vectors")
+    parser.add_argument('--max-gap', type=float,
+                        help="split flights where no data arrived for more than MAX_GAP seconds, and compute vectors "
+                             "from the actual time between data points")
+    args = parser.parse_args()
+
+    input_format = batch.detect_format(args.input)
+    if input_format not in ('direwolf', 'raw'):
+        parser.error(f"{args.input} isn't a Direwolf or raw packet log")
+    t = batch.ANALYZERS[input_format](args.input, args.timestep)
+    t.earth_model = args.earth_model
+    t.max_gap = args.max_gap
+    for summary in decode_flights(t, args.output_dir, not args.no_ssid, args.callsign, args.workers, args.binary):
+        print(f"{summary['callsign']}: {summary['status']}, {summary['packets']} packets, "
+              f"{summary['vectors']} vectors {summary['error']}")
+
+
+if __name__ == '__main__':
+    main()
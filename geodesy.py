@@ -0,0 +1,77 @@
+"""
+Earth models used to turn changes in latitude and longitude into displacements in meters.
+
+'sphere' is the model described in the README: a sphere of radius 6378137 m, with the longitude scaled by the cosine of
+the latitude at the start of each step. 'wgs84' uses the WGS84 ellipsoid: the meridional radius of curvature for
+latitude and the prime-vertical radius of curvature for longitude, taken at the middle of each step. Its factors are
+looked up in a table of latitudes LATITUDE_STEP degrees apart and interpolated, so that it costs about the same as the
+sphere.
+"""
+from typing import Tuple
+import functools
+import math
+
+import numpy as np
+
+SPHERE = 'sphere'
+WGS84 = 'wgs84'
+MODELS = (SPHERE, WGS84)
+
+# Radius of the sphere, and semi-major axis and flattening of the WGS84 ellipsoid, in meters
+EARTH_RADIUS = 6378137
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+
+# Spacing of the latitudes of the WGS84 table, in degrees. Interpolating between them is accurate to about 1e-9.
+LATITUDE_STEP = 0.01
+
+
+def radii_of_curvature(lats) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :param lats: latitudes, in decimal degrees
+    :return: (meridional, prime-vertical) radii of curvature of the WGS84 ellipsoid, in meters
+    """
+    w = np.sqrt(1 - WGS84_E2 * np.sin(np.radians(lats)) ** 2)
+    return WGS84_A * (1 - WGS84_E2) / w ** 3, WGS84_A / w
+
+
+@functools.lru_cache(maxsize=None)
+def wgs84_table(step=LATITUDE_STEP) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :return: (meters per degree of latitude, meters per degree of longitude) at -90, -90 + step, ... 90 degrees
+    """
+    lats = np.linspace(-90.0, 90.0, int(round(180 / step)) + 1)
+    meridional, prime_vertical = radii_of_curvature(lats)
+    return math.pi / 180 * meridional, math.pi / 180 * prime_vertical * np.cos(np.radians(lats))
+
+
+def wgs84_factors(lats, step=LATITUDE_STEP) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :param lats: latitudes, in decimal degrees
+    :return: (meters per degree of latitude, meters per degree of longitude) at each latitude, from wgs84_table
+    """
+    north, east = wgs84_table(step)
+    position = (np.asarray(lats, dtype=float) + 90.0) / step
+    index = np.clip(np.floor(position).astype(np.intp), 0, len(north) - 2)
+    fraction = position - index
+    return (north[index] + fraction * (north[index + 1] - north[index]),
+            east[index] + fraction * (east[index + 1] - east[index]))
+
+
+def displacements(lats, longs, model=SPHERE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :param lats: latitudes of consecutive points, in decimal degrees
+    :param longs: longitudes of the points, in decimal degrees
+    :param model: one of MODELS
+    :return: (northward, eastward) displacement between each pair of consecutive points, in meters
+    """
+    lats = np.asarray(lats, dtype=float)
+    longs = np.asarray(longs, dtype=float)
+    if model == SPHERE:
+        return ((math.pi / 180 * EARTH_RADIUS) * np.diff(lats),
+                (math.pi / 180 * EARTH_RADIUS * np.cos(np.radians(lats[:-1]))) * np.diff(longs))
+    if model == WGS84:
+        north, east = wgs84_factors((lats[1:] + lats[:-1]) / 2)
+        return north * np.diff(lats), east * np.diff(longs)
+    raise ValueError(f"Unknown Earth model {model!r}, expected one of {MODELS}")
@@ -0,0 +1,166 @@
+"""
+Optional instrumentation of the analyzer pipeline: wall time, calls, rows in/out and bytes for each stage, plus counters
+for data-quality problems such as glitch sentinels.
+
+Analyzers use NULL_STATS unless given a PipelineStats, so that instrumentation costs next to nothing when it is off:
+    t = AprsFiAnalyzer(filename, 15, stats=PipelineStats())
+    t.output_vectors("vec.csv")
+    t.stats.dump("stats.json")
+"""
+from typing import Dict
+import json
+import time
+
+# Stages of the pipeline, in the order the data goes through them
+STAGES = ('read', 'unescape', 'resample', 'demux', 'dedup', 'base91', 'interpolate', 'vectors', 'write')
+
+# Counters kept by the pipeline
+ALTITUDE_GLITCHES = 'altitude_glitches'  # altitudes decoded as the 0.12345 sentinel
+BEARING_GLITCHES = 'bearing_glitches'  # bearings set to the 0.123456 sentinel (no horizontal movement)
+SKIPPED_PACKETS = 'skipped_packets'  # packets dropped while streaming because they couldn't be decoded
+DUPLICATE_PACKETS = 'duplicate_packets'  # repeated copies of a packet (digipeated, or heard by several stations)
+FOREIGN_PACKETS = 'foreign_packets'  # packets of other stations, or without a compressed comment, dropped by demux
+
+
+class StageStats:
+    """
+    Totals for one stage, over every time it ran.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.rows_in = 0
+        self.rows_out = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def add(self, rows_in=0, rows_out=0, bytes_read=0, bytes_written=0):
+        self.rows_in += rows_in
+        self.rows_out += rows_out
+        self.bytes_read += bytes_read
+        self.bytes_written += bytes_written
+
+    def to_dict(self) -> Dict:
+        return {'calls': self.calls, 'seconds': self.seconds, 'rows_in': self.rows_in, 'rows_out': self.rows_out,
+                'bytes_read': self.bytes_read, 'bytes_written': self.bytes_written}
+
+
+class _StageTimer:
+    """
+    Context manager timing one run of a stage; gives the stage's StageStats to the with block.
+    """
+
+    def __init__(self, stage: StageStats):
+        self.stage = stage
+        self.start = 0.0
+
+    def __enter__(self) -> StageStats:
+        self.start = time.perf_counter()
+        return self.stage
+
+    def __exit__(self, *exc_info):
+        self.stage.seconds += time.perf_counter() - self.start
+        self.stage.calls += 1
+        return False
+
+
+class PipelineStats:
+    """
+    Stage timings and counters collected while an analyzer runs. Stages should not be nested, so that their times add
+    up to the time of the whole run.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.stages: Dict[str, StageStats] = {}
+        self.counters: Dict[str, int] = {}
+
+    def stage(self, name):
+        """
+        :param name: stage name, normally one of STAGES
+        :return: context manager timing the stage; it gives the StageStats to add rows and bytes to
+        """
+        if name not in self.stages:
+            self.stages[name] = StageStats()
+        return _StageTimer(self.stages[name])
+
+    def count(self, name, amount=1):
+        """
+        :param name: counter name, e.g. ALTITUDE_GLITCHES
+        :param amount: amount to add to the counter
+        """
+        self.counters[name] = self.counters.get(name, 0) + int(amount)
+
+    def reset(self):
+        self.stages.clear()
+        self.counters.clear()
+
+    def to_dict(self) -> Dict:
+        """
+        :return: {'stages': {name: totals}, 'counters': {name: count}, 'total_seconds': ...}, stages in pipeline order
+        """
+        order = sorted(self.stages, key=lambda name: STAGES.index(name) if name in STAGES else len(STAGES))
+        return {'stages': {name: self.stages[name].to_dict() for name in order},
+                'counters': dict(self.counters),
+                'total_seconds': sum(stage.seconds for stage in self.stages.values())}
+
+    def to_json(self, indent=2) -> str:
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def dump(self, filename):
+        """
+        :param filename: JSON file to write the stats to
+        """
+        with open(filename, 'w') as output_file:
+            output_file.write(self.to_json())
+            output_file.write("\n")
+
+
+class _NullStage:
+    """
+    Stands in for both the timer and the StageStats when instrumentation is off.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add(self, rows_in=0, rows_out=0, bytes_read=0, bytes_written=0):
+        pass
+
+
+class NullStats:
+    """
+    Does nothing; used when instrumentation is off. Check enabled before computing anything only needed for stats.
+    """
+    enabled = False
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def count(self, name, amount=1):
+        pass
+
+    def reset(self):
+        pass
+
+    def to_dict(self) -> Dict:
+        return {'stages': {}, 'counters': {}, 'total_seconds': 0.0}
+
+    def to_json(self, indent=2) -> str:
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def dump(self, filename):
+        """
+        Writes empty stats, so that callers don't need to know whether instrumentation was on.
+        """
+        with open(filename, 'w') as output_file:
+            output_file.write(self.to_json())
+            output_file.write("\n")
+
+
+NULL_STATS = NullStats()
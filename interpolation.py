@@ -0,0 +1,87 @@
+"""
+Interpolation of the positions of a packet's sensor samples from the GPS positions sent with it.
+
+A packet holds G GPS positions and S sensor samples, spread evenly over the time since the previous packet: in packet
+intervals, GPS position g (from 0) was taken at (g + 1) / G and sample j at (j + 1) / S, so the latest of each is at
+the time of the packet, and the latest position of the previous packet is at 0. The bracketing positions and the
+weight of every sample only depend on (G, S), so they are worked out once and applied to every packet at once.
+"""
+import functools
+
+import numpy as np
+
+
+class InterpolationPlan:
+    """
+    Source positions and weights for each sample of a packet. Positions are numbered in the "known" row of a packet:
+    0 is the latest position of the previous packet, g + 1 is GPS position g of the packet.
+    """
+
+    def __init__(self, gps_points, sensor_points):
+        """
+        :param gps_points: # of GPS positions per packet (G)
+        :param sensor_points: # of sensor samples per packet (S)
+        """
+        if gps_points < 1 or sensor_points < 1:
+            raise ValueError(f"A packet needs at least one GPS position and one sample, got {gps_points} and "
+                             f"{sensor_points}")
+        self.gps_points = gps_points
+        self.sensor_points = sensor_points
+
+        # Sample j is at (j + 1) * G / S GPS periods: between known positions lower and lower + 1
+        periods = np.arange(1, sensor_points + 1) * gps_points
+        self.lower = periods // sensor_points
+        remainders = periods % sensor_points
+        # Samples taken at the same time as a GPS position use that position alone
+        self.upper = self.lower + (remainders > 0)
+        self.weights = remainders / sensor_points
+
+    def apply(self, lats, longs, times=None, timestep=None):
+        """
+        Positions of the samples of every packet but the first.
+
+        :param lats: latitudes, one row of G GPS positions per packet, oldest packet first
+        :param longs: longitudes, same shape as lats
+        :param times: optional time of each packet, in seconds. The samples are then taken to be timestep seconds
+                      apart and the GPS positions S * timestep / G seconds apart, ending at the packet's time, so that
+                      samples of a packet sent late are placed between the previous packet and the packet's first GPS
+                      position according to the actual time between them.
+        :param timestep: # of seconds between two samples, needed with times
+        :return: (latitudes, longitudes) arrays with one row of S samples for every packet but the first
+        """
+        lats = np.asarray(lats, dtype=float)
+        longs = np.asarray(longs, dtype=float)
+        weights = self.weights if times is None else self.weights_for_intervals(np.diff(times), timestep)
+        return (self._interpolate(lats, weights), self._interpolate(longs, weights))
+
+    def weights_for_intervals(self, intervals, timestep):
+        """
+        :param intervals: # of seconds between each packet and the previous one
+        :param timestep: # of seconds between two samples
+        :return: weights with one row per packet. Only samples taken before the packet's first GPS position depend on
+                 the interval; the others keep the weights of the plan.
+        """
+        intervals = np.asarray(intervals, dtype=float)[:, None]
+        gps_period = self.sensor_points * timestep / self.gps_points
+        # Times relative to the packet
+        sample_times = -(self.sensor_points - 1 - np.arange(self.sensor_points)) * timestep
+        first_gps_time = -(self.gps_points - 1) * gps_period
+
+        span = first_gps_time + intervals
+        with np.errstate(divide='ignore', invalid='ignore'):
+            timed = np.where(span > 0, np.clip((sample_times + intervals) / span, 0.0, 1.0), 1.0)
+        return np.where(self.lower == 0, timed, self.weights)
+
+    def _interpolate(self, values, weights):
+        # Known row of each packet: latest position of the previous packet, then the packet's own positions
+        known = np.concatenate((values[:-1, -1:], values[1:]), axis=1)
+        lower = known[:, self.lower]
+        return lower + weights * (known[:, self.upper] - lower)
+
+
+@functools.lru_cache(maxsize=None)
+def plan_for(gps_points, sensor_points) -> InterpolationPlan:
+    """
+    :return: the (shared) plan for packets of gps_points GPS positions and sensor_points samples
+    """
+    return InterpolationPlan(gps_points, sensor_points)
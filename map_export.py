@@ -0,0 +1,233 @@
+"""
+Map files of a flight: the track of the data points as a line, and the wind vectors as points along it, in GeoJSON or
+KML/KMZ (like the track exported by aprs.fi). Files are written a block of points at a time.
+
+Long high-rate tracks can be simplified first with the Douglas-Peucker algorithm: points that are within a tolerance
+(in meters, altitude included) of the line through the points kept around them are dropped.
+"""
+from typing import Optional
+from xml.sax.saxutils import escape
+import contextlib
+import io
+import json
+import math
+import os
+import zipfile
+
+import numpy as np
+
+import geodesy
+from datapoints import DataPointTable
+
+# Points formatted and written at once
+BLOCK_POINTS = 4096
+
+GEOJSON_EXTENSIONS = (".geojson", ".json")
+KML_EXTENSIONS = (".kml", ".kmz")
+
+
+def local_meters(lats, longs, alts) -> np.ndarray:
+    """
+    :return: (n, 3) array of east, north and up positions in meters, relative to the first point (equirectangular
+             projection, fine for the extent of a flight)
+    """
+    lats = np.asarray(lats, dtype=float)
+    longs = np.asarray(longs, dtype=float)
+    if not len(lats):
+        return np.empty((0, 3))
+    meters_per_degree = math.pi / 180 * geodesy.EARTH_RADIUS
+    east = (longs - longs[0]) * meters_per_degree * math.cos(math.radians(lats[0]))
+    north = (lats - lats[0]) * meters_per_degree
+    return np.column_stack((east, north, np.asarray(alts, dtype=float)))
+
+
+def simplify(lats, longs, alts, tolerance) -> np.ndarray:
+    """
+    Douglas-Peucker simplification. All the segments of a level of the recursion are handled at once: the distance of
+    every point to the chord of its segment is computed in one pass, and every segment whose farthest point is more
+    than tolerance meters away is split at that point.
+
+    :param tolerance: largest distance allowed between a dropped point and the simplified track, in meters
+    :return: boolean mask of the points kept; the first and last points are always kept
+    """
+    points = local_meters(lats, longs, alts)
+    keep = np.zeros(len(points), dtype=bool)
+    if len(points) < 3:
+        keep[:] = True
+        return keep
+    keep[[0, -1]] = True
+
+    starts = np.array([0])
+    ends = np.array([len(points) - 1])
+    while len(starts):
+        interior = ends - starts - 1
+        starts, ends, interior = starts[interior > 0], ends[interior > 0], interior[interior > 0]
+        if not len(starts):
+            break
+
+        # Every interior point of every segment, with the index of its segment
+        segment = np.repeat(np.arange(len(starts)), interior)
+        first = np.cumsum(interior) - interior
+        index = np.repeat(starts + 1 - first, interior) + np.arange(len(segment))
+
+        a = points[starts][segment]
+        chord = points[ends][segment] - a
+        offset = points[index] - a
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.clip(np.einsum('ij,ij->i', offset, chord) / np.einsum('ij,ij->i', chord, chord), 0.0, 1.0)
+        distance = np.linalg.norm(offset - np.nan_to_num(t)[:, None] * chord, axis=1)
+
+        farthest = np.maximum.reduceat(distance, first)
+        # First point of each segment at the largest distance
+        is_farthest = np.flatnonzero(distance == farthest[segment])
+        split_at = index[is_farthest[np.unique(segment[is_farthest], return_index=True)[1]]]
+
+        split = farthest > tolerance
+        keep[split_at[split]] = True
+        starts, ends = (np.concatenate((starts[split], split_at[split])),
+                        np.concatenate((split_at[split], ends[split])))
+    return keep
+
+
+def wind_properties(vectors) -> np.ndarray:
+    """
+    :param vectors: [Altitude, WindY, WindX] rows
+    :return: [Altitude, WindY, WindX, speed, heading] rows, heading being the direction the wind blows towards in
+             degrees clockwise from north
+    """
+    vectors = np.asarray(vectors, dtype=float).reshape(-1, 3)
+    speed = np.hypot(vectors[:, 1], vectors[:, 2])
+    heading = np.degrees(np.arctan2(vectors[:, 2], vectors[:, 1])) % 360
+    return np.column_stack((vectors, speed, heading))
+
+
+def track_points(data_points: DataPointTable, vectors=None, tolerance=None, starts=None):
+    """
+    :param vectors: optional [Altitude, WindY, WindX] rows, vector i going from data point i to data point i + 1
+    :param tolerance: optional simplification tolerance, in meters (see simplify)
+    :param starts: index of the first data point of each vector, when they don't follow each other (see
+                   Analyzer.vector_starts)
+    :return: ([Long, Lat, Alt] rows of the track, [Long, Lat, Alt, Altitude, WindY, WindX, speed, heading] rows of
+             the vectors, each placed at its first data point). Simplifying keeps the vectors of the kept points.
+    """
+    track = np.column_stack((data_points.longs, data_points.lats, data_points.alts))
+    winds = wind_properties([] if vectors is None else vectors)
+    starts = np.arange(len(winds)) if starts is None else np.asarray(starts, dtype=int)
+    winds = np.column_stack((track[starts], winds))
+    if tolerance is not None and len(track):
+        keep = simplify(data_points.lats, data_points.longs, data_points.alts, tolerance)
+        track = track[keep]
+        winds = winds[keep[starts]]
+    return track, winds
+
+
+def write_map(filename, data_points: DataPointTable, vectors=None, tolerance=None, name=None, starts=None):
+    """
+    :param filename: .geojson or .json for GeoJSON, .kml or .kmz (zipped KML) for Google Earth
+    :param data_points: the track
+    :param vectors: optional [Altitude, WindY, WindX] rows, see track_points
+    :param tolerance: optional simplification tolerance, in meters (see simplify)
+    :param name: name of the document (default: the file name)
+    :param starts: see track_points
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in GEOJSON_EXTENSIONS + KML_EXTENSIONS:
+        raise ValueError(f"{filename}: map files must end in one of {GEOJSON_EXTENSIONS + KML_EXTENSIONS}")
+    if name is None:
+        name = os.path.splitext(os.path.basename(filename))[0]
+    track, winds = track_points(data_points, vectors, tolerance, starts)
+
+    with contextlib.ExitStack() as stack:
+        if extension == ".kmz":
+            archive = stack.enter_context(zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED))
+            output_file = stack.enter_context(io.TextIOWrapper(archive.open("doc.kml", 'w'), encoding='utf-8'))
+        else:
+            output_file = stack.enter_context(open(filename, 'w', encoding='utf-8', newline="\n"))
+        if extension in GEOJSON_EXTENSIONS:
+            write_geojson(output_file, track, winds, name)
+        else:
+            write_kml(output_file, track, winds, name)
+
+
+def json_number(value, digits) -> str:
+    """
+    :return: value with digits decimals, or null if it isn't finite (NaN and Infinity aren't valid JSON)
+    """
+    return f"{value:.{digits}f}" if math.isfinite(value) else "null"
+
+
+def geojson_position(long, lat, alt) -> Optional[str]:
+    """
+    :return: the GeoJSON position, without its altitude if that is unknown, or None without a latitude and longitude
+    """
+    if not (math.isfinite(long) and math.isfinite(lat)):
+        return None
+    if not math.isfinite(alt):
+        return f"[{long:.6f},{lat:.6f}]"
+    return f"[{long:.6f},{lat:.6f},{alt:.1f}]"
+
+
+def write_geojson(output_file, track, winds, name: Optional[str] = None):
+    """
+    :param output_file: open text file
+    :param track: [Long, Lat, Alt] rows, see track_points. Points without a latitude and longitude are skipped.
+    :param winds: [Long, Lat, Alt, Altitude, WindY, WindX, speed, heading] rows, see track_points. Vectors without a
+                  latitude and longitude are skipped; other unknown values are written as null.
+    """
+    output_file.write('{"type": "FeatureCollection",')
+    if name is not None:
+        output_file.write(f' "name": {json.dumps(name)},')
+    output_file.write('\n"features": [\n{"type": "Feature", "properties": {"name": "Track"}, '
+                      '"geometry": {"type": "LineString", "coordinates": [')
+    separator = ""
+    for start in range(0, len(track), BLOCK_POINTS):
+        positions = [position for position in (geojson_position(*row)
+                                               for row in track[start:start + BLOCK_POINTS].tolist())
+                     if position is not None]
+        if positions:
+            output_file.write(separator + ",".join("\n" + position for position in positions))
+            separator = ","
+    output_file.write("]}}")
+
+    for start in range(0, len(winds), BLOCK_POINTS):
+        output_file.write("".join(
+            f',\n{{"type": "Feature", "properties": {{"altitude": {json_number(altitude, 1)}, '
+            f'"wind_y": {json_number(wind_y, 3)}, "wind_x": {json_number(wind_x, 3)}, '
+            f'"speed": {json_number(speed, 3)}, "heading": {json_number(heading, 1)}}}, '
+            f'"geometry": {{"type": "Point", "coordinates": {position}}}}}'
+            for position, (long, lat, alt, altitude, wind_y, wind_x, speed, heading) in
+            ((geojson_position(*row[:3]), row) for row in winds[start:start + BLOCK_POINTS].tolist())
+            if position is not None))
+    output_file.write("\n]}\n")
+
+
+def write_kml(output_file, track, winds, name: Optional[str] = None):
+    """
+    :param output_file: open text file
+    :param track: [Long, Lat, Alt] rows, see track_points
+    :param winds: [Long, Lat, Alt, Altitude, WindY, WindX, speed, heading] rows, see track_points
+    """
+    output_file.write('<?xml version="1.0" encoding="UTF-8"?>\n<kml xmlns="http://www.opengis.net/kml/2.2">\n'
+                      '<Document>\n')
+    if name is not None:
+        output_file.write(f"<name>{escape(name)}</name>\n")
+    output_file.write("<Placemark><name>Track</name><LineString><altitudeMode>absolute</altitudeMode>"
+                      "<coordinates>\n")
+    for start in range(0, len(track), BLOCK_POINTS):
+        output_file.write("".join(f"{long:.6f},{lat:.6f},{alt:.1f}\n"
+                                  for long, lat, alt in track[start:start + BLOCK_POINTS].tolist()))
+    output_file.write("</coordinates></LineString></Placemark>\n")
+
+    if len(winds):
+        output_file.write("<Folder><name>Wind vectors</name>\n")
+        for start in range(0, len(winds), BLOCK_POINTS):
+            output_file.write("".join(
+                f"<Placemark><name>{altitude:.0f} m</name><description>{speed:.1f} m/s towards {heading:.0f}°"
+                f"</description><ExtendedData><Data name=\"wind_y\"><value>{wind_y:.3f}</value></Data>"
+                f"<Data name=\"wind_x\"><value>{wind_x:.3f}</value></Data></ExtendedData><Point>"
+                f"<altitudeMode>absolute</altitudeMode><coordinates>{long:.6f},{lat:.6f},{alt:.1f}</coordinates>"
+                f"</Point></Placemark>\n"
+                for long, lat, alt, altitude, wind_y, wind_x, speed, heading in
+                winds[start:start + BLOCK_POINTS].tolist()))
+        output_file.write("</Folder>\n")
+    output_file.write("</Document>\n</kml>\n")
@@ -0,0 +1,391 @@
+"""
+Live decoding straight from a TNC, without waiting for Direwolf or aprs.fi to write a CSV file. Connects to the KISS
+over TCP port (Direwolf: 8001) or the AGWPE port (Direwolf: 8000) of one or more TNCs, deframes the AX.25 UI frames
+they receive and feeds the compressed positions and comments to an IncrementalDecoder. Lost connections are retried
+with an exponential backoff.
+
+Usage: python tnc_receiver.py ENDPOINT [ENDPOINT ...] [-t TIMESTEP] [--callsign CALL] [--vectors FILE]
+                              [--datapoints FILE] [--time-interpolation] [--earth-model {sphere,wgs84}]
+                              [--max-gap SECONDS]
+where each ENDPOINT is kiss://host:port, agw://host:port or host:port (KISS).
+"""
+from typing import List, Dict, Optional, NamedTuple, Tuple
+import argparse
+import asyncio
+import csv
+import re
+import struct
+import time
+
+import numpy as np
+
+import analyzer_compressed
+import analyzer_raw
+import dedup
+import geodesy
+import instrumentation
+
+"""
+KISS framing
+"""
+
+FEND = 0xC0
+FESC = 0xDB
+TFEND = 0xDC
+TFESC = 0xDD
+
+
+class KissDeframer:
+    """
+    Splits a KISS byte stream into frames. Data may arrive in chunks of any size; incomplete frames are kept until the
+    rest arrives.
+    """
+
+    def __init__(self):
+        self.pending = b""
+
+    def feed(self, data: bytes) -> List[Tuple[int, bytes]]:
+        """
+        :param data: bytes read from the TNC
+        :return: (TNC port, AX.25 frame) of every data frame completed by these bytes
+        """
+        *complete, self.pending = (self.pending + data).split(bytes([FEND]))
+        frames = []
+        for raw in complete:
+            if not raw:
+                continue
+            raw = raw.replace(bytes([FESC, TFEND]), bytes([FEND])).replace(bytes([FESC, TFESC]), bytes([FESC]))
+            # The low nibble of the command byte is 0 for data frames, the high nibble is the TNC port
+            if raw[0] & 0x0F == 0 and len(raw) > 1:
+                frames.append((raw[0] >> 4, raw[1:]))
+        return frames
+
+
+def kiss_frame(frame: bytes, port=0) -> bytes:
+    """
+    :param frame: AX.25 frame
+    :param port: TNC port
+    :return: the frame as a KISS data frame, e.g. to send to a TNC or replay from a fake one
+    """
+    escaped = frame.replace(bytes([FESC]), bytes([FESC, TFESC])).replace(bytes([FEND]), bytes([FESC, TFEND]))
+    return bytes([FEND, port << 4 & 0xF0]) + escaped + bytes([FEND])
+
+
+"""
+AGWPE framing
+"""
+
+# Port, data kind, PID, call from, call to, data length and user fields of the 36-byte AGWPE header
+AGW_HEADER = struct.Struct('<B3xcxBx10s10sII')
+
+
+def agw_frame(kind: bytes, data=b"", port=0) -> bytes:
+    """
+    :param kind: AGWPE data kind, e.g. b'k' to ask for raw frames or b'K' for a raw frame
+    :param data: frame data
+    :param port: TNC port
+    """
+    return AGW_HEADER.pack(port, kind, 0, b"", b"", len(data), 0) + data
+
+
+"""
+AX.25
+"""
+
+
+def decode_ax25(frame: bytes) -> Optional[Tuple[str, str, List[str], bytes]]:
+    """
+    :param frame: AX.25 frame, without flags or FCS
+    :return: (source, destination, digipeater path, information field) of a UI frame, or None for any other frame.
+             Digipeaters that have repeated the frame are marked with a '*', as in TNC2 format.
+    """
+    addresses = []
+    i = 0
+    while True:
+        if i + 7 > len(frame):
+            return None
+        field = frame[i:i + 7]
+        callsign = bytes(byte >> 1 for byte in field[:6]).decode('ascii', 'replace').strip()
+        ssid = (field[6] >> 1) & 0x0F
+        addresses.append((callsign + (f"-{ssid}" if ssid else ""), bool(field[6] & 0x80)))
+        i += 7
+        if field[6] & 0x01:
+            break
+
+    # Control field of a UI frame (poll/final bit ignored), and no layer 3 protocol
+    if len(addresses) < 2 or len(frame) < i + 2 or frame[i] & 0xEF != 0x03 or frame[i + 1] != 0xF0:
+        return None
+    path = [name + ("*" if repeated else "") for name, repeated in addresses[2:]]
+    return addresses[1][0], addresses[0][0], path, frame[i + 2:]
+
+
+def encode_ax25(source: str, destination: str, path: List[str], info: bytes) -> bytes:
+    """
+    :param source: source callsign, e.g. VE7BVU-1
+    :param destination: destination callsign, e.g. APRS
+    :param path: digipeaters, e.g. ['WIDE2-1']; a trailing '*' marks a digipeater that has repeated the frame
+    :param info: information field
+    :return: the AX.25 UI frame, without flags or FCS
+    """
+    names = [destination, source] + list(path)
+    frame = b""
+    for i, name in enumerate(names):
+        repeated = i >= 2 and name.endswith("*")
+        callsign, _, ssid = name.rstrip("*").partition("-")
+        last = 0x01 if i == len(names) - 1 else 0x00
+        frame += bytes(ord(x) << 1 for x in callsign.upper().ljust(6)[:6])
+        frame += bytes([0x60 | (int(ssid or 0) & 0x0F) << 1 | (0x80 if repeated else 0x00) | last])
+    return frame + bytes([0x03, 0xF0]) + info
+
+
+"""
+Decoding
+"""
+
+# Information field of a compressed position report
+INFO_PATTERN = re.compile(analyzer_raw.PAYLOAD_PATTERN + rb'\r?\n?\Z')
+
+
+def parse_info(info: bytes) -> Optional[Dict]:
+    """
+    :param info: AX.25 information field
+    :return: packet dictionary as returned by RawPacketAnalyzer.read_packets, or None if the field isn't a complete
+             compressed position report
+    """
+    match = INFO_PATTERN.match(info)
+    if match is None:
+        return None
+    packets = analyzer_raw.RawPacketAnalyzer.parse_packets([match])
+    return packets[0] if packets else None
+
+
+class Endpoint(NamedTuple):
+    host: str
+    port: int
+    protocol: str = 'kiss'
+
+
+def parse_endpoint(text) -> Endpoint:
+    """
+    :param text: kiss://host:port, agw://host:port or host:port (KISS)
+    """
+    protocol, _, address = text.rpartition("://")
+    host, _, port = address.rpartition(":")
+    protocol = protocol.lower() or 'kiss'
+    if protocol not in ('kiss', 'agw') or not host or not port.isdigit():
+        raise ValueError(f"Invalid TNC endpoint {text!r}, expected kiss://host:port or agw://host:port")
+    return Endpoint(host, int(port), protocol)
+
+
+class TncReceiver:
+    """
+    Decodes one flight from the frames heard by one or more TNCs. A packet heard by several TNCs (or repeated by a
+    digipeater) is only decoded once.
+    """
+
+    def __init__(self, endpoints: List[Endpoint], timestep, callsign=None, stats=None, reconnect=True,
+                 reconnect_delay=1.0, max_reconnect_delay=60.0, dedup_window=dedup.DEFAULT_WINDOW,
+                 time_interpolation=False, earth_model=geodesy.SPHERE, max_gap=None):
+        """
+        :param endpoints: TNCs to connect to
+        :param timestep: # of seconds between two datapoints
+        :param callsign: only decode packets from this source (default: every compressed position report)
+        :param stats: optional instrumentation.PipelineStats
+        :param reconnect: reconnect when a connection fails or ends; otherwise updates() ends once every connection has
+        :param reconnect_delay: # of seconds before the first reconnection attempt
+        :param max_reconnect_delay: the delay doubles after each failed attempt, up to this many seconds
+        :param dedup_window: # of seconds within which a packet heard again is a duplicate
+        :param time_interpolation: place samples using the time between packets (the time each one was heard)
+        :param earth_model: one of geodesy.MODELS, used to compute the vectors
+        :param max_gap: start a new segment when no packet was heard for more than max_gap seconds (see
+                        analyzer_compressed.IncrementalDecoder)
+        """
+        self.endpoints = list(endpoints)
+        self.timestep = timestep
+        self.callsign = callsign
+        self.stats = stats if stats is not None else instrumentation.NULL_STATS
+        self.reconnect = reconnect
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.decoder = analyzer_compressed.IncrementalDecoder(timestep, self.stats, time_interpolation,
+                                                              earth_model=earth_model, max_gap=max_gap)
+        self.deduplicator = dedup.PacketDeduplicator(dedup_window)
+
+    async def updates(self):
+        """
+        :return: async iterator of (new data points, new vectors) for each packet that produced data points
+        """
+        queue = asyncio.Queue()
+        tasks = [asyncio.ensure_future(self._receive(endpoint, queue)) for endpoint in self.endpoints]
+        running = len(tasks)
+        try:
+            while running:
+                frame = await queue.get()
+                if frame is None:
+                    running -= 1
+                    continue
+                update = self.feed_frame(frame)
+                if update is not None:
+                    yield update
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def feed_frame(self, frame: bytes):
+        """
+        :param frame: AX.25 frame
+        :return: (new data points, new vectors), or None if the frame didn't produce any data points
+        """
+        decoded = decode_ax25(frame)
+        if decoded is None:
+            return None
+        source, destination, path, info = decoded
+        if self.callsign is not None and source != self.callsign:
+            return None
+
+        packet = parse_info(info)
+        if packet is None:
+            self.stats.count(instrumentation.SKIPPED_PACKETS)
+            return None
+        packet['source'] = source.encode()
+        packet['time'] = time.time()
+        if self.deduplicator.is_duplicate(packet):
+            self.stats.count(instrumentation.DUPLICATE_PACKETS)
+            return None
+        if np.isnan([packet['lat'], packet['long'], packet['alt']]).any():
+            # Sent without a GPS fix
+            self.stats.count(instrumentation.SKIPPED_PACKETS)
+            return None
+
+        try:
+            data_points, vectors = self.decoder.feed(packet)
+        except ValueError:
+            self.stats.count(instrumentation.SKIPPED_PACKETS)
+            return None
+        if not data_points:
+            return None
+        return data_points, vectors
+
+    async def _receive(self, endpoint: Endpoint, queue: asyncio.Queue):
+        """
+        Puts the frames heard on one endpoint in the queue, reconnecting as needed. Puts None once it stops.
+        """
+        delay = self.reconnect_delay
+        try:
+            while True:
+                try:
+                    reader, writer = await asyncio.open_connection(endpoint.host, endpoint.port)
+                except OSError:
+                    if not self.reconnect:
+                        return
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.max_reconnect_delay)
+                    continue
+
+                delay = self.reconnect_delay
+                try:
+                    if endpoint.protocol == 'agw':
+                        await TncReceiver._read_agw(reader, writer, queue, self.stats)
+                    else:
+                        await TncReceiver._read_kiss(reader, queue, self.stats)
+                except (OSError, asyncio.IncompleteReadError):
+                    pass
+                finally:
+                    writer.close()
+                    try:
+                        await writer.wait_closed()
+                    except OSError:
+                        pass
+
+                if not self.reconnect:
+                    return
+                await asyncio.sleep(delay)
+        finally:
+            queue.put_nowait(None)
+
+    @staticmethod
+    async def _read_kiss(reader: asyncio.StreamReader, queue: asyncio.Queue, stats):
+        deframer = KissDeframer()
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                return
+            with stats.stage('read') as stage:
+                frames = deframer.feed(data)
+                stage.add(rows_out=len(frames), bytes_read=len(data))
+            for port, frame in frames:
+                queue.put_nowait(frame)
+
+    @staticmethod
+    async def _read_agw(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, queue: asyncio.Queue, stats):
+        # Ask for every frame heard, in raw form
+        writer.write(agw_frame(b'k'))
+        await writer.drain()
+        while True:
+            try:
+                header = await reader.readexactly(AGW_HEADER.size)
+            except asyncio.IncompleteReadError as e:
+                if e.partial:
+                    raise
+                return
+            port, kind, pid, call_from, call_to, length, user = AGW_HEADER.unpack(header)
+            data = await reader.readexactly(length)
+            with stats.stage('read') as stage:
+                stage.add(rows_out=1 if kind == b'K' else 0, bytes_read=len(header) + length)
+            # Raw frames start with the KISS command byte
+            if kind == b'K' and length > 1:
+                queue.put_nowait(data[1:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode a flight live from one or more TNCs.")
+    parser.add_argument('endpoints', nargs='+', type=parse_endpoint,
+                        help="kiss://host:port, agw://host:port or host:port (KISS)")
+    parser.add_argument('-t', '--timestep', type=float, default=15, help="# of seconds between two datapoints")
+    parser.add_argument('--callsign', help="only decode packets from this callsign")
+    parser.add_argument('--vectors', help="CSV file to append the vectors to")
+    parser.add_argument('--datapoints', help="CSV file to append the data points to")
+    parser.add_argument('--time-interpolation', action='store_true',
+                        help="place samples using the time between packets")
+    parser.add_argument('--earth-model', choices=geodesy.MODELS, default=geodesy.SPHERE,
+                        help="shape of the Earth used to turn positions into wind vectors")
+    parser.add_argument('--max-gap', type=float,
+                        help="start a new segment when no packet was heard for more than MAX_GAP seconds, and compute "
+                             "vectors from the actual time between data points")
+    args = parser.parse_args()
+
+    async def run():
+        outputs = []
+        for filename, header in ((args.datapoints, "Lat, Long, Alt, Wind\n"), (args.vectors, "Altitude,WindY,WindX\n")):
+            output_file = None
+            if filename is not None:
+                output_file = open(filename, 'w', newline="")
+                output_file.write(header)
+                output_file.flush()
+            outputs.append(output_file)
+
+        try:
+            receiver = TncReceiver(args.endpoints, args.timestep, args.callsign,
+                                   time_interpolation=args.time_interpolation, earth_model=args.earth_model,
+                                   max_gap=args.max_gap)
+            async for data_points, vectors in receiver.updates():
+                for output_file, rows in zip(outputs, (data_points, vectors)):
+                    if output_file is not None:
+                        csv.writer(output_file).writerows(rows)
+                        output_file.flush()
+                for vector in vectors:
+                    print(f"{vector[0]:8.1f} m  WindY {vector[1]:7.2f} m/s  WindX {vector[2]:7.2f} m/s", flush=True)
+        finally:
+            for output_file in outputs:
+                if output_file is not None:
+                    output_file.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,45 @@
 """
 Unit tests for analyzer classes.
 """
+import analyzer
+import analyzer_aprsfi
+import analyzer_compressed
+import analyzer_direwolf
+import analyzer_merged
+import analyzer_raw
 import analyzer_sd
+import altitude_index
+import batch
+import binary_output
+import checkpoint
+import datapoints
+import decode_cache
+import geodesy
+import demux
+import dedup
+import instrumentation
+import interpolation
+import map_export
+import tnc_receiver
+import wind_server
+from benchmarks import run as benchmark_run
+from benchmarks.synthetic import SyntheticFlight
 
 import unittest
 import csv
+import os
+import shutil
+import tempfile
+import threading
+import json
+import asyncio
+import contextlib
+import tracemalloc
+import zipfile
+from xml.etree import ElementTree
+from unittest import mock
+
+import numpy
 
 
 class TestSDMethods(unittest.TestCase):
@@ -52,3 +87,1180 @@ class TestSDMethods(unittest.TestCase):
         self.assertTrue(abs(split_rows[0]["Y"] - expected_dy) < 0.5)
 
 
+class TestChunkedSD(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "sd.csv")
+        # 4 Hz log
+        SyntheticFlight(150, timestep=0.25).write_sd(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_blocks_match_whole_file(self):
+        whole = analyzer_sd.SDAnalyzer(self.filename, 0.25)
+        stats = instrumentation.PipelineStats()
+        chunked = analyzer_sd.SDAnalyzer(self.filename, 0.25, stats=stats, chunk_rows=7)
+        self.assertEqual(chunked.data_points.tolist(with_times=True), whole.data_points.tolist(with_times=True))
+        # Each block records the bytes it read
+        self.assertEqual(stats.stages['read'].bytes_read, os.path.getsize(self.filename))
+
+        vectors = numpy.concatenate([block_vectors for block, block_vectors in chunked.iter_vectors()])
+        self.assertEqual(vectors.tolist(), whole.vectors)
+
+        whole.output_vectors(os.path.join(self.tempdir, "vectors.csv"))
+        whole.save_datapoints(os.path.join(self.tempdir, "datapoints.csv"))
+        chunked.write_outputs(os.path.join(self.tempdir, "chunked_vectors.csv"),
+                              os.path.join(self.tempdir, "chunked_datapoints.csv"))
+        for name in ("vectors.csv", "datapoints.csv"):
+            with open(os.path.join(self.tempdir, name)) as expected, \
+                    open(os.path.join(self.tempdir, "chunked_" + name)) as written:
+                self.assertEqual(written.read(), expected.read())
+
+    def test_times_from_time_column(self):
+        times = analyzer_sd.SDAnalyzer("resources/sdTestFile1Seymour.csv", 15).data_points.times
+        self.assertEqual(times[0], 18 * 3600 + 54 * 60 + 41)
+        self.assertTrue((numpy.diff(times) > 0).all())
+
+    def test_resampled_to_timestep(self):
+        every_row = analyzer_sd.SDAnalyzer(self.filename, 0.25).data_points
+        for method in analyzer_sd.RESAMPLE_METHODS:
+            t = analyzer_sd.SDAnalyzer(self.filename, 15, resample=method, chunk_rows=7)
+            points = t.data_points
+            # Samples are 60 rows apart, so both methods land on rows of the log
+            self.assertEqual(len(points), 10)
+            self.assertTrue((numpy.diff(points.times) == 15).all())
+            self.assertEqual(points.tolist(), every_row[::60].tolist())
+            self.assertEqual(len(t.vectors), 9)
+
+        with self.assertRaises(ValueError):
+            analyzer_sd.SDAnalyzer(self.filename, 15, resample='cubic')
+
+    def test_linear_resampling_between_rows(self):
+        resampler = analyzer_sd.Resampler(15)
+        first = resampler.feed(datapoints.DataPointTable.from_columns([49.0, 49.1], [-123.0, -123.0], [0.0, 100.0],
+                                                                      [2.0, 4.0], times=[0.0, 10.0]))
+        second = resampler.feed(datapoints.DataPointTable.from_columns([49.2, 49.3], [-123.0, -123.0], [200.0, 300.0],
+                                                                       [6.0, 8.0], times=[20.0, 30.0]))
+        self.assertEqual(first.tolist(), [[49.0, -123.0, 0.0, 2.0]])
+        self.assertEqual(len(second), 2)
+        self.assertEqual(second.times.tolist(), [15.0, 30.0])
+        self.assertAlmostEqual(second[0][2], 150.0)
+
+    def test_memory_does_not_grow_with_flight(self):
+        peaks = []
+        for packets in (500, 2000):
+            SyntheticFlight(packets, timestep=0.25).write_sd(self.filename)
+            t = analyzer_sd.SDAnalyzer(self.filename, 15, resample='linear', chunk_rows=500)
+            tracemalloc.start()
+            t.write_outputs(os.path.join(self.tempdir, "vectors.csv"))
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        self.assertLess(peaks[1], 1.5 * peaks[0])
+
+
+class TestDataPointCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "sd.csv")
+        shutil.copy("resources/sdTestFile1Seymour.csv", self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_data_points_parsed_once(self):
+        t = analyzer_sd.SDAnalyzer(self.filename, 15)
+        first = t.data_points
+        self.assertIs(first, t.data_points)
+        self.assertIs(t.vectors, t.vectors)
+
+        t.reload()
+        self.assertIsNot(first, t.data_points)
+        self.assertEqual(first, t.data_points)
+
+    def test_cache_invalidated_when_file_changes(self):
+        t = analyzer_sd.SDAnalyzer(self.filename, 15)
+        length = len(t.data_points)
+
+        with open(self.filename, "a") as file:
+            file.write("210841,49.3143,-122.9691,314,-278,102357.0625,91.6667,0\n")
+
+        self.assertEqual(len(t.data_points), length + 1)
+        self.assertEqual(len(t.vectors), length)
+
+    def test_cache_invalidated_when_settings_change(self):
+        t = analyzer_sd.SDAnalyzer(self.filename, 15, resample='decimate')
+        resampled = len(t.data_points)
+        t.timestep = 30
+        self.assertLess(len(t.data_points), resampled)
+        t.resample = None
+        self.assertEqual(len(t.data_points), len(analyzer_sd.SDAnalyzer(self.filename, 15).data_points))
+
+        # Every packet heard twice
+        filename = os.path.join(self.tempdir, "direwolf.csv")
+        with open("resources/direwolfTestFile1July16.csv") as file:
+            header, *rows = file.readlines()
+        with open(filename, "w") as file:
+            file.writelines([header] + [row for row in rows for _ in range(2)])
+        t = analyzer_direwolf.DirewolfAnalyzer(filename, 15)
+        length = len(t.data_points)
+        t.deduplicate = False
+        self.assertGreater(len(t.data_points), length)
+        t.time_interpolation = True
+        self.assertEqual(t.data_points.times.tolist(),
+                         analyzer_direwolf.DirewolfAnalyzer(filename, 15, time_interpolation=True,
+                                                            deduplicate=False).data_points.times.tolist())
+
+
+class TestVectorEngine(unittest.TestCase):
+
+    def test_bearing_matches_scalar(self):
+        deltas = [(0.0, 0.0), (1.0, 0.0), (-1.0, 0.0), (0.0, 1.0), (0.0, -1.0),
+                  (1.0, 2.0), (-1.0, 2.0), (-1.0, -2.0), (1.0, -2.0)]
+        batch = analyzer.Analyzer.calculate_bearing_batch([d[0] for d in deltas], [d[1] for d in deltas])
+        for (delta_lat, delta_long), bearing in zip(deltas, batch):
+            self.assertAlmostEqual(bearing, analyzer.Analyzer.calculate_bearing(delta_lat, delta_long), places=9)
+
+    def test_components_match_scalar(self):
+        points = analyzer_sd.SDAnalyzer("resources/sdTestFile1Seymour.csv", 15).data_points
+        batch = analyzer.Analyzer.calculate_components_batch([p[0] for p in points], [p[1] for p in points],
+                                                             [p[2] for p in points], [p[3] for p in points], 15)
+        self.assertEqual(len(batch), len(points) - 1)
+        for i, row in enumerate(batch):
+            (y_wind, x_wind) = analyzer.Analyzer.calculate_components_dd(points[i + 1][1], points[i][1],
+                                                                         points[i + 1][0], points[i][0],
+                                                                         points[i + 1][2], points[i][2],
+                                                                         (points[i + 1][3] + points[i][3]) / 2, 15)
+            self.assertEqual(row[0], points[i][2])
+            self.assertAlmostEqual(row[1], y_wind, places=9)
+            self.assertAlmostEqual(row[2], x_wind, places=9)
+
+
+class TestCompressedDecoding(unittest.TestCase):
+
+    def test_bulk_decoder_matches_unpack_functions(self):
+        comments = ["5_Pu/H*&5_N\"/H+%5_K4/H-&P&>P4/PD*!", "5_&t/HQx5_#8/HT)5^{\"/HWgQ\\!Qd!Qk*!"]
+        lats, longs, alts, wind_speeds = analyzer_compressed.CompressedAnalyzer.decode_comments(comments)
+        unpacker = analyzer_compressed.CompressedAnalyzer
+
+        for row, comment in enumerate(comments):
+            for i in range(3):
+                self.assertEqual(lats[row][i], unpacker.unpack_latitude(comment[8 * i:8 * i + 4]))
+                self.assertEqual(longs[row][i], unpacker.unpack_longitude(comment[8 * i + 4:8 * i + 8]))
+                self.assertEqual(alts[row][i], unpacker.unpack_altitude(comment[24 + 3 * i:24 + 3 * i + 2]))
+                self.assertEqual(wind_speeds[row][i], unpacker.unpack_wind_speed(comment[24 + 3 * i + 2]))
+            self.assertEqual(wind_speeds[row][3], unpacker.unpack_wind_speed(comment[-1]))
+
+    def test_altitude_glitch_sentinel(self):
+        comment = b"NN!!NN!!NN!!NN!!NN!!NN!!\xa0\xfc!\xa0\xfc!\xa0\xfc!!"
+        alts = analyzer_compressed.CompressedAnalyzer.decode_comments([comment])[2]
+        self.assertEqual(alts.tolist(), [[0.12345, 0.12345, 0.12345]])
+
+
+class TestDirewolfStream(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "direwolf.log")
+        with open("resources/direwolfTestFile1July16.csv", "r", newline="") as file:
+            self.lines = file.readlines()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_stream_matches_batch(self):
+        t = analyzer_direwolf.DirewolfAnalyzer("resources/direwolfTestFile1July16.csv", 15)
+        data_points = []
+        vectors = []
+        for new_data_points, new_vectors in t.stream():
+            data_points.extend(new_data_points)
+            vectors.extend(new_vectors)
+
+        self.assertEqual(data_points, t.data_points)
+        self.assertEqual(len(vectors), len(t.vectors))
+        for row, expected in zip(vectors, t.vectors):
+            for value, expected_value in zip(row, expected):
+                self.assertAlmostEqual(value, expected_value, places=9)
+
+    def test_astream_does_not_block_event_loop(self):
+        t = analyzer_direwolf.DirewolfAnalyzer("resources/direwolfTestFile1July16.csv", 15)
+        release = threading.Event()
+        follow_rows = t.follow_rows
+
+        def slow_rows(follow=False):
+            # Nothing can be read until the event loop has run the other task
+            self.assertTrue(release.wait(timeout=5))
+            yield from follow_rows(follow)
+        t.follow_rows = slow_rows
+
+        async def run():
+            updates = []
+
+            async def consume():
+                async for update in t.astream():
+                    updates.append(update)
+            task = asyncio.create_task(consume())
+            await asyncio.sleep(0.01)
+            release.set()
+            await task
+            return updates
+
+        expected = list(analyzer_direwolf.DirewolfAnalyzer("resources/direwolfTestFile1July16.csv", 15).stream())
+        self.assertEqual(asyncio.run(run()), expected)
+
+    def test_follow_partial_line_and_rotation(self):
+        with open(self.filename, "w", newline="") as file:
+            file.writelines(self.lines[:3])
+            file.write(self.lines[3][:20])
+
+        t = analyzer_direwolf.DirewolfAnalyzer(self.filename, 15)
+        vectors_filename = os.path.join(self.tempdir, "vectors.csv")
+        stream = t.stream(follow=True, poll_interval=0.01, vectors_filename=vectors_filename)
+        self.assertEqual(len(next(stream)[0]), 4)
+
+        with open(self.filename, "a", newline="") as file:
+            file.write(self.lines[3][20:])
+        self.assertEqual(len(next(stream)[1]), 4)
+
+        rotated = os.path.join(self.tempdir, "direwolf.log.new")
+        with open(rotated, "w", newline="") as file:
+            file.writelines([self.lines[0], self.lines[4]])
+        os.replace(rotated, self.filename)
+        self.assertEqual(len(next(stream)[0]), 4)
+        stream.close()
+
+        with open(vectors_filename, "r", newline="") as file:
+            self.assertEqual(len(list(csv.DictReader(file))), 3 + 4 + 4)
+
+
+class TestAprsFiReader(unittest.TestCase):
+
+    def test_comment_repaired_in_memory(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tempdir, "aprsfi.csv")
+            shutil.copy("resources/launchData/launch_1_aprsFi.csv", filename)
+
+            t = analyzer_aprsfi.AprsFiAnalyzer(filename, 15)
+            self.assertEqual(len(t.data_points), 4 * 45)
+            self.assertEqual(os.listdir(tempdir), ["aprsfi.csv"])
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_read_rows(self):
+        lines = ['time,lat,comment\r\n', '2021-11-11 17:18:42,49.07755,"5_N\\"/H+%,P4\\\\"\r\n']
+        rows = list(analyzer_aprsfi.AprsFiAnalyzer.read_rows(lines))
+        self.assertEqual(rows, [{'time': '2021-11-11 17:18:42', 'lat': '49.07755', 'comment': '5_N\\"/H+%,P4\\\\'}])
+        self.assertEqual(analyzer_aprsfi.AprsFiAnalyzer.decode_comment_utf8(rows[0]['comment']), '5_N"/H+%,P4\\')
+
+    def test_cached_read_matches_full_read(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tempdir, "aprsfi.csv")
+            with open("resources/launchData/launch_1_aprsFi.csv", "rb") as file:
+                lines = file.read().splitlines(keepends=True)
+            # A comment with text after the compressed position, which aprs.fi exports as UTF-8
+            lines[1] = lines[1].replace(b'*!"', '*! 50° Météo"'.encode('utf-8'))
+            with open(filename, "wb") as file:
+                file.write(b"".join(lines))
+
+            t = analyzer_aprsfi.AprsFiAnalyzer(filename, 15)
+            packets, _, _ = t.read_packets_after(0)
+            self.assertEqual(packets, t.read_packets())
+            self.assertTrue(packets[0]['comment'].endswith("*! 50° Météo"))
+        finally:
+            shutil.rmtree(tempdir)
+
+
+class TestRawPacketLog(unittest.TestCase):
+    FILENAME = "resources/launchData/2021-11-11 Aerostat First Launch raw packets including failed ones.txt"
+
+    def test_packets_match_aprsfi(self):
+        packets = analyzer_raw.RawPacketAnalyzer(self.FILENAME, 15).read_packets()
+        self.assertEqual(len(packets), 64)
+
+        packet = [p for p in packets if p['received'] == b"2021-11-11 09:21:43 PST"][0]
+        self.assertEqual(packet['comment'], b'5_&t/HQx5_#8/HT)5^{"/HWgQ\\!Qd!Qk*!')
+        self.assertAlmostEqual(packet['lat'], 49.08796, places=5)
+        self.assertAlmostEqual(packet['long'], -122.88626, places=5)
+        self.assertAlmostEqual(packet['alt'], 2210.59, places=2)
+
+    def test_invalid_packets_salvaged(self):
+        t = analyzer_raw.RawPacketAnalyzer(self.FILENAME, 15)
+        first = t.read_packets()[0]
+        self.assertTrue(first['lat'] != first['lat'])  # No GPS fix: NaN
+
+        lats = [data_point[0] for data_point in t.data_points]
+        self.assertTrue(all(lat == lat for lat in lats))
+        # Comment positions of the second (invalid) packet are kept
+        self.assertAlmostEqual(lats[0], analyzer_compressed.CompressedAnalyzer.unpack_latitude("5`?g"))
+
+    def test_unescape(self):
+        self.assertEqual(analyzer_raw.RawPacketAnalyzer.unescape(b"b<0xa0><0xfc>S<"), b"b\xa0\xfcS<")
+
+    def test_no_vector_across_dropped_samples(self):
+        t = analyzer_raw.RawPacketAnalyzer(self.FILENAME, 15)
+        t.max_gap = 90
+        # 09:08:17 PST
+        self.assertEqual(t.read_packets()[0]['time'], 1636650497.0)
+        data_points = t.data_points
+        breaks = t.pair_breaks()
+        dropped = numpy.flatnonzero(breaks)
+        self.assertGreater(len(dropped), 0)
+
+        starts = analyzer.Analyzer.vector_starts(data_points, t.max_gap, breaks)
+        self.assertEqual(len(starts), len(t.vectors))
+        self.assertFalse(breaks[starts].any())
+        vectors = numpy.array(t.vectors)
+        speeds = numpy.hypot(vectors[:, 1], vectors[:, 2])
+        around = numpy.isin(starts, dropped - 1) | numpy.isin(starts, dropped + 1)
+        self.assertGreater(around.sum(), 0)
+        self.assertLess(speeds[around].max(), 100)
+
+        tempdir = tempfile.mkdtemp()
+        try:
+            names = [os.path.join(tempdir, name) for name in ("vec.csv", "dp.csv", "expected_vec.csv")]
+            streamed = analyzer_raw.RawPacketAnalyzer(self.FILENAME, 15)
+            streamed.max_gap = 90
+            streamed.update_outputs(names[0], names[1])
+            t.output_vectors(names[2])
+            with open(names[0]) as written, open(names[2]) as expected:
+                self.assertEqual(written.read(), expected.read())
+        finally:
+            shutil.rmtree(tempdir)
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_detect_format(self):
+        self.assertEqual(batch.detect_format("resources/sdTestFile1Seymour.csv"), "sd")
+        self.assertEqual(batch.detect_format("resources/2021-10-31.log"), "direwolf")
+        self.assertEqual(batch.detect_format("resources/launchData/launch_1_aprsFi.csv"), "aprsfi")
+        self.assertEqual(batch.detect_format(TestRawPacketLog.FILENAME), "raw")
+        self.assertIsNone(batch.detect_format("resources/interpolation.png"))
+
+    def test_run_batch(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            input_dir = os.path.join(tempdir, "inputs")
+            output_dir = os.path.join(tempdir, "outputs")
+            os.makedirs(os.path.join(input_dir, "receiver"))
+            shutil.copy("resources/sdTestFile1Seymour.csv", input_dir)
+            shutil.copy("resources/direwolfTestFile1July16.csv", os.path.join(input_dir, "receiver"))
+            shutil.copy("resources/interpolation.png", input_dir)
+
+            summaries = batch.run_batch([input_dir], output_dir, [15, 30], workers=2)
+            self.assertEqual(sorted(summary['status'] for summary in summaries), ["done"] * 4)
+            self.assertTrue(os.path.exists(os.path.join(output_dir, "receiver", "direwolfTestFile1July16_30s_vec.csv")))
+            self.assertTrue(os.path.exists(os.path.join(output_dir, "sdTestFile1Seymour_15s_map.csv")))
+
+            summaries = batch.run_batch([input_dir], output_dir, [15, 30], workers=1)
+            self.assertEqual([summary['status'] for summary in summaries], ["skipped"] * 4)
+            with open(os.path.join(output_dir, "summary.csv"), "r", newline="") as summary_file:
+                self.assertEqual(len(list(csv.DictReader(summary_file))), 4)
+
+            # Outputs written with another Earth model are out of date
+            summaries = batch.run_batch([input_dir], output_dir, [15], workers=1, earth_model=geodesy.WGS84)
+            self.assertEqual([summary['status'] for summary in summaries], ["done"] * 2)
+            summaries = batch.run_batch([input_dir], output_dir, [15], workers=1, earth_model=geodesy.WGS84)
+            self.assertEqual([summary['status'] for summary in summaries], ["skipped"] * 2)
+            # So are outputs written with another max_gap
+            summaries = batch.run_batch([input_dir], output_dir, [15], workers=1, earth_model=geodesy.WGS84,
+                                        max_gap=90)
+            self.assertEqual([summary['status'] for summary in summaries], ["done"] * 2)
+        finally:
+            shutil.rmtree(tempdir)
+
+
+class TestDataPointTable(unittest.TestCase):
+
+    def test_append_and_rows(self):
+        table = datapoints.DataPointTable(capacity=1)
+        for i in range(10):
+            table.append(49.0 + i, -123.0, 100.0 * i, 5.0)
+
+        self.assertEqual(len(table), 10)
+        self.assertEqual(table[3], [52.0, -123.0, 300.0, 5.0])
+        self.assertEqual(table[-1], list(table)[-1])
+        self.assertEqual(table, datapoints.DataPointTable.from_rows(table.tolist()))
+        self.assertFalse(table.has_times)
+
+    def test_slices_share_memory(self):
+        table = datapoints.DataPointTable.from_columns([1.0, 2.0, 3.0], [4.0, 5.0, 6.0], [7.0, 8.0, 9.0],
+                                                       [0.0, 0.0, 0.0], times=[10.0, 20.0, 30.0])
+        view = table[1:]
+        table.alts[2] = 90.0
+        self.assertEqual(view.alts.tolist(), [8.0, 90.0])
+        self.assertTrue(view.has_times)
+
+        # Appending to a slice must not overwrite the rest of the table
+        head = table[:1]
+        head.append(0.0, 0.0, 0.0, 0.0)
+        self.assertEqual(table[1], [2.0, 5.0, 8.0, 0.0])
+
+
+class TestBinaryOutput(unittest.TestCase):
+
+    def test_binary_matches_csv(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            t = analyzer_aprsfi.AprsFiAnalyzer("resources/launchData/launch_1_aprsFi.csv", 15)
+            for extension in (".npy", ".csv"):
+                t.output_vectors(os.path.join(tempdir, "vec" + extension))
+                t.save_datapoints(os.path.join(tempdir, "dp" + extension))
+
+            vectors = binary_output.load_vectors(os.path.join(tempdir, "vec.npy"))
+            self.assertIsInstance(vectors, numpy.memmap)
+            self.assertEqual(vectors.tolist(), [tuple(row) for row in t.vectors])
+            self.assertEqual(binary_output.load_vectors(os.path.join(tempdir, "vec.csv")).tolist(), vectors.tolist())
+
+            data_points = binary_output.load_datapoints(os.path.join(tempdir, "dp.npy"))
+            self.assertEqual(data_points['Alt'].tolist(), t.data_points.alts.tolist())
+            from_csv = binary_output.load_datapoints(os.path.join(tempdir, "dp.csv"))
+            self.assertEqual(from_csv['Wind'].tolist(), data_points['Wind'].tolist())
+        finally:
+            shutil.rmtree(tempdir)
+
+
+class TestSyntheticFlights(unittest.TestCase):
+
+    def test_every_format_decodes_to_true_winds(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            flight = SyntheticFlight(20)
+            for input_format in benchmark_run.FORMATS:
+                result = benchmark_run.run_case(input_format, 20, tempdir, measure_memory=False)
+                self.assertEqual(result['packets'], 20)
+                # The SD card has every sample; the compressed formats lose the first packet and are quantized
+                if input_format == 'sd':
+                    self.assertEqual(result['data_points'], flight.samples)
+                    self.assertLess(result['rms_error'], 0.5)
+                else:
+                    self.assertEqual(result['data_points'], flight.samples - 4)
+                    self.assertLess(result['rms_error'], 4.0)
+        finally:
+            shutil.rmtree(tempdir)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_stages_and_glitches_recorded(self):
+        t = analyzer_direwolf.DirewolfAnalyzer("resources/direwolfTestFile1July16.csv", 15,
+                                               stats=instrumentation.PipelineStats())
+        t.vectors
+        stats = t.stats.to_dict()
+        self.assertEqual(list(stats['stages']), ['read', 'dedup', 'base91', 'interpolate', 'vectors'])
+        self.assertEqual(stats['stages']['read']['bytes_read'], os.path.getsize(t.filename))
+        self.assertEqual(stats['stages']['interpolate']['rows_out'], len(t.data_points))
+        self.assertEqual(stats['stages']['vectors']['rows_out'], len(t.vectors))
+        # No horizontal movement between consecutive data points gives the 0.123456 bearing
+        dp = t.data_points
+        still = (numpy.diff(dp.lats) == 0) & (numpy.diff(dp.longs) == 0)
+        self.assertEqual(stats['counters']['bearing_glitches'], numpy.count_nonzero(still))
+
+        # Cached results aren't counted again
+        t.vectors
+        self.assertEqual(t.stats.stages['vectors'].calls, 1)
+
+    def test_disabled_by_default(self):
+        t = analyzer_sd.SDAnalyzer("resources/sdTestFile2Simple.csv", 15)
+        t.vectors
+        self.assertIs(t.stats, instrumentation.NULL_STATS)
+        self.assertEqual(t.stats.to_dict()['stages'], {})
+
+        tempdir = tempfile.mkdtemp()
+        try:
+            t.stats.dump(os.path.join(tempdir, "stats.json"))
+            with open(os.path.join(tempdir, "stats.json")) as file:
+                self.assertEqual(json.load(file), t.stats.to_dict())
+        finally:
+            shutil.rmtree(tempdir)
+
+
+class TestTncReceiver(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.log = os.path.join(self.tempdir, "flight.txt")
+        SyntheticFlight(12).write_tnc2(self.log)
+
+        # Recorded frames: the packets of the log as they were heard on RF
+        self.frames = []
+        with open(self.log, "rb") as file:
+            for match in analyzer_raw.PACKET_PATTERN.finditer(file.read()):
+                payload = analyzer_raw.RawPacketAnalyzer.unescape(
+                    match.string[match.end('path') + 1:match.end('comment')])
+                self.frames.append(tnc_receiver.encode_ax25(match['source'].decode(), "APRS", ["WIDE2-1*"], payload))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_kiss_and_ax25(self):
+        frame = tnc_receiver.encode_ax25("VE7BVU-1", "APRS", ["WIDE1-1*", "WIDE2-1"], b"/\xc0\xdb\xdc!")
+        self.assertEqual(tnc_receiver.decode_ax25(frame),
+                         ("VE7BVU-1", "APRS", ["WIDE1-1*", "WIDE2-1"], b"/\xc0\xdb\xdc!"))
+
+        stream = tnc_receiver.kiss_frame(frame, port=1) + tnc_receiver.kiss_frame(b"\x00" * 20)[:5]
+        deframer = tnc_receiver.KissDeframer()
+        self.assertEqual(deframer.feed(stream[:7]), [])
+        self.assertEqual(deframer.feed(stream[7:]), [(1, frame)])
+
+    async def test_replay_from_two_tncs(self):
+        connections = []
+
+        async def serve_kiss(reader, writer):
+            # The first connection drops halfway through the recording
+            connections.append(asyncio.current_task())
+            frames = self.frames[:6] if len(connections) == 1 else self.frames[6:]
+            data = b"".join(tnc_receiver.kiss_frame(frame) for frame in frames)
+            for i in range(0, len(data), 50):
+                writer.write(data[i:i + 50])
+                await writer.drain()
+            writer.close()
+
+        async def serve_agw(reader, writer):
+            connections.append(asyncio.current_task())
+            await reader.readexactly(tnc_receiver.AGW_HEADER.size)
+            for frame in self.frames:
+                writer.write(tnc_receiver.agw_frame(b'K', b"\x00" + frame))
+            await writer.drain()
+            writer.close()
+
+        kiss_server = await asyncio.start_server(serve_kiss, "127.0.0.1", 0)
+        agw_server = await asyncio.start_server(serve_agw, "127.0.0.1", 0)
+        endpoints = [tnc_receiver.Endpoint("127.0.0.1", kiss_server.sockets[0].getsockname()[1], 'kiss'),
+                     tnc_receiver.Endpoint("127.0.0.1", agw_server.sockets[0].getsockname()[1], 'agw')]
+
+        expected = analyzer_raw.RawPacketAnalyzer(self.log, 15)
+        stats = instrumentation.PipelineStats()
+        receiver = tnc_receiver.TncReceiver(endpoints, 15, callsign="VE7BVU-1", stats=stats, reconnect_delay=0.01)
+        data_points = datapoints.DataPointTable()
+        vectors = []
+
+        async def receive():
+            async with contextlib.aclosing(receiver.updates()) as updates:
+                async for new_data_points, new_vectors in updates:
+                    data_points.extend(new_data_points)
+                    vectors.extend(new_vectors)
+                    if len(data_points) == len(expected.data_points):
+                        return
+
+        try:
+            await asyncio.wait_for(receive(), 10)
+        finally:
+            kiss_server.close()
+            agw_server.close()
+            await asyncio.gather(*connections, return_exceptions=True)
+
+        self.assertEqual(data_points, expected.data_points)
+        self.assertEqual(len(vectors), len(expected.vectors))
+        for row, expected_row in zip(vectors, expected.vectors):
+            for value, expected_value in zip(row, expected_row):
+                self.assertAlmostEqual(value, expected_value, places=9)
+        self.assertGreater(stats.counters[instrumentation.DUPLICATE_PACKETS], 0)
+
+
+class TestInterpolationPlan(unittest.TestCase):
+
+    def test_matches_gps_positions_for_four_by_four(self):
+        plan = interpolation.plan_for(4, 4)
+        self.assertEqual(plan.lower.tolist(), [1, 2, 3, 4])
+        self.assertEqual(plan.weights.tolist(), [0.0, 0.0, 0.0, 0.0])
+
+        lats = numpy.array([[1.0, 2.0, 3.0, 4.0], [5.0, 6.0, 7.0, 8.0]])
+        sample_lats, sample_longs = plan.apply(lats, -lats)
+        self.assertEqual(sample_lats.tolist(), [[5.0, 6.0, 7.0, 8.0]])
+        self.assertEqual(sample_longs.tolist(), [[-5.0, -6.0, -7.0, -8.0]])
+
+    def test_other_layouts(self):
+        # Two GPS positions for four samples: every other sample is halfway between two positions
+        lats = numpy.array([[0.0, 4.0], [6.0, 8.0]])
+        self.assertEqual(interpolation.plan_for(2, 4).apply(lats, lats)[0].tolist(), [[5.0, 6.0, 7.0, 8.0]])
+
+        # One GPS position for eight samples, all interpolated from the previous packet's position
+        lats = numpy.array([[0.0], [8.0], [24.0]])
+        plan = interpolation.plan_for(1, 8)
+        self.assertEqual(plan.apply(lats, lats)[0].tolist(), [[1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0],
+                                                            [10.0, 12.0, 14.0, 16.0, 18.0, 20.0, 22.0, 24.0]])
+
+        # With packet times, the samples of the late packet (a packet was lost) are bunched up near its end
+        sample_lats = plan.apply(lats, lats, times=[0.0, 120.0, 360.0], timestep=15)[0]
+        self.assertEqual(sample_lats[0].tolist(), [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0])
+        self.assertEqual(sample_lats[1].tolist(), [17.0, 18.0, 19.0, 20.0, 21.0, 22.0, 23.0, 24.0])
+
+    def test_packets_with_other_layout(self):
+        lats = numpy.array([[0.0], [8.0]])
+        alts = numpy.arange(16.0).reshape(2, 8)
+        data_points = analyzer_compressed.CompressedAnalyzer.packets_to_data_points(lats, lats, alts, alts)
+        self.assertEqual(len(data_points), 8)
+        self.assertEqual(data_points.lats.tolist(), [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0])
+        self.assertEqual(data_points.alts.tolist(), alts[1].tolist())
+
+
+class TestAltitudeIndex(unittest.TestCase):
+
+    def setUp(self):
+        # Up to 1 km and back down, with a wind that depends on the altitude and the phase
+        alts = numpy.concatenate((numpy.arange(0.0, 1000.0, 37.0), numpy.arange(1000.0, 0.0, -41.0)))
+        self.ascending = numpy.arange(len(alts)) < 29
+        self.vectors = numpy.column_stack((alts, alts / 100, numpy.where(self.ascending, 1.0, -1.0)))
+        self.index = altitude_index.AltitudeIndex(self.vectors, hysteresis=0.0)
+
+    def test_queries_match_scan(self):
+        alts = self.vectors[:, 0]
+        selected = self.vectors[(alts >= 300) & (alts < 600)]
+        summary = self.index.summary(300, 600)
+        self.assertEqual(summary.count, len(selected))
+        self.assertAlmostEqual(summary.wind_y, selected[:, 1].mean())
+        self.assertEqual(self.index.between(300, 600).tolist(), sorted(selected.tolist()))
+
+        self.assertEqual(self.index.summary(300, 600, altitude_index.DESCENT).wind_x, -1.0)
+        empty = self.index.summary(2000, 3000)
+        self.assertEqual(empty.count, 0)
+        self.assertTrue(numpy.isnan(empty.wind_y))
+        self.assertEqual(self.index.nearest(500, altitude_index.ASCENT), [518.0, 5.18, 1.0])
+        self.assertEqual(self.index.nearest(500)[0], 508.0)
+
+        bins = self.index.bins(100.0)
+        self.assertEqual(bins[:, 0].tolist(), list(range(0, 1100, 100)))
+        self.assertEqual(int(bins[:, 1].sum()), len(self.vectors))
+        in_bin = self.vectors[(alts >= 300) & (alts < 400)]
+        self.assertAlmostEqual(bins[3, 2], in_bin[:, 1].mean())
+
+    def test_incremental_matches_bulk(self):
+        # The default hysteresis keeps the first vector below the top (959 m) in the ascent
+        self.assertEqual(len(altitude_index.AltitudeIndex(self.vectors).segments[altitude_index.ASCENT]), 30)
+
+        index = altitude_index.AltitudeIndex(hysteresis=0.0)
+        for i in range(0, len(self.vectors), 5):
+            index.extend(self.vectors[i:i + 5])
+            index.summary(0, 500)
+        self.assertEqual([len(index.segments[phase]) for phase in altitude_index.PHASES],
+                         [int(self.ascending.sum()), int((~self.ascending).sum())])
+        for phase in altitude_index.PHASES:
+            self.assertEqual(index.between(0, 1e6, phase).tolist(), self.index.between(0, 1e6, phase).tolist())
+        numpy.testing.assert_allclose(index.bins(250.0), self.index.bins(250.0))
+
+    def test_merges_match_fresh_build(self):
+        # Vectors landing below, between and above those already merged
+        vectors = numpy.random.default_rng(1).uniform(0, 1000, (200, 3))
+        index = altitude_index.AltitudeIndex(hysteresis=1e6)
+        for i in range(0, len(vectors), 23):
+            index.extend(vectors[i:i + 23])
+            fresh = altitude_index.AltitudeIndex(vectors[:i + 23], hysteresis=1e6)
+            for low, high in ((0, 1e6), (250, 600), (999, 1000)):
+                self.assertEqual(index.between(low, high).tolist(), fresh.between(low, high).tolist())
+                self.assertEqual(index.summary(low, high), fresh.summary(low, high))
+            segment = index.segments[altitude_index.ASCENT]
+            self.assertEqual(segment.prefix.tolist(), fresh.segments[altitude_index.ASCENT].prefix.tolist())
+
+
+class TestDuplicatePackets(unittest.TestCase):
+    FILENAME = "resources/direwolfTestFile1July16.csv"
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_window(self):
+        deduplicator = dedup.PacketDeduplicator(window=5.0)
+        packet = {'source': "VE7BVU-1", 'comment': "5YL//C_q5YL//C_q5YL//C_q<t*<t*<t**"}
+        # Copies heard within the window are dropped; the same comment sent again later is a new packet
+        self.assertEqual([deduplicator.is_duplicate(dict(packet, time=t)) for t in (100, 101, 104, 120, 121)],
+                         [False, True, True, False, True])
+        self.assertEqual(deduplicator.dropped, 3)
+        # A copy may have a compressed timestamp that the first one didn't; two different timestamps tell packets
+        # apart, as do two different sources
+        self.assertTrue(deduplicator.is_duplicate(dict(packet, time=122, timestamp=b"170815h")))
+        self.assertFalse(deduplicator.is_duplicate(dict(packet, time=123, timestamp=b"170835h")))
+        self.assertFalse(deduplicator.is_duplicate(dict(packet, time=124, timestamp=b"170835h", source="VE7BVU-2")))
+
+    def test_untimed_packets(self):
+        deduplicator = dedup.PacketDeduplicator(window=5.0, max_entries=3)
+        packets = [{'source': "VE7BVU-1", 'comment': f"5YL//C_q5YL//C_q5YL//C_q<t*<t*<t*{i}"} for i in range(4)]
+        # Without a time, a copy is dropped however late it comes, until max_entries newer packets were seen
+        self.assertEqual([deduplicator.is_duplicate(packets[i]) for i in (0, 1, 0, 2, 0, 3, 0)],
+                         [False, False, True, False, True, False, False])
+        # A timed copy of an untimed packet is dropped too
+        self.assertTrue(deduplicator.is_duplicate(dict(packets[3], time=1000)))
+        # Raw packet logs give each packet the time it was received
+        raw = analyzer_raw.RawPacketAnalyzer(TestRawPacketLog.FILENAME, 15).read_packets()
+        self.assertTrue(all(packet['time'] is not None for packet in raw))
+
+    def test_digipeated_copies_dropped(self):
+        with open(self.FILENAME, "r", newline="") as file:
+            lines = file.readlines()
+        # Every packet is heard again two seconds later through a digipeater
+        filename = os.path.join(self.tempdir, "digipeated.csv")
+        with open(filename, "w", newline="") as file:
+            file.write(lines[0])
+            for line in lines[1:]:
+                utime = line.split(",")[1]
+                file.write(line)
+                file.write(line.replace(utime, str(int(utime) + 2), 1))
+
+        expected = analyzer_direwolf.DirewolfAnalyzer(self.FILENAME, 15)
+        stats = instrumentation.PipelineStats()
+        t = analyzer_direwolf.DirewolfAnalyzer(filename, 15, stats=stats)
+        self.assertEqual(t.data_points, expected.data_points)
+        self.assertEqual(stats.counters[instrumentation.DUPLICATE_PACKETS], len(lines) - 1)
+
+        streamed = datapoints.DataPointTable()
+        for data_points, vectors in t.stream():
+            streamed.extend(data_points)
+        self.assertEqual(streamed, expected.data_points)
+
+        # Identical packets 20 s apart (the balloon wasn't moving) are not duplicates
+        self.assertEqual(len(analyzer_direwolf.DirewolfAnalyzer(filename, 15, deduplicate=False).data_points),
+                         2 * len(expected.data_points) + 4)
+
+    def test_merged_logs(self):
+        single = analyzer_direwolf.DirewolfAnalyzer(self.FILENAME, 15)
+        merged = analyzer_merged.MergedAnalyzer([analyzer_direwolf.DirewolfAnalyzer(self.FILENAME, 15),
+                                                 analyzer_direwolf.DirewolfAnalyzer(self.FILENAME, 15)], 15)
+        self.assertEqual(merged.data_points, single.data_points)
+        self.assertEqual(merged.vectors, single.vectors)
+
+    def test_merged_formats(self):
+        # aprs.fi export and raw igate log (timed in PST) of the same flight
+        aprsfi = analyzer_aprsfi.AprsFiAnalyzer("resources/launchData/launch_1_aprsFi.csv", 15)
+        raw = analyzer_raw.RawPacketAnalyzer(TestRawPacketLog.FILENAME, 15)
+        aprsfi_comments = [analyzer_compressed.CompressedAnalyzer.comment_bytes(p['comment'])
+                           for p in aprsfi.read_packets()]
+        raw_comments = {analyzer_compressed.CompressedAnalyzer.comment_bytes(p['comment']) for p in raw.read_packets()}
+        copies = sum(comment in raw_comments for comment in aprsfi_comments)
+        self.assertGreater(copies, 30)
+
+        stats = instrumentation.PipelineStats()
+        merged = analyzer_merged.MergedAnalyzer([aprsfi, raw], 15, stats=stats)
+        packets = merged.read_packets()
+        times = [analyzer_compressed.CompressedAnalyzer.parse_time(packet['time']) for packet in packets]
+        self.assertEqual(times, sorted(times))
+        # The raw log's packets sent without a GPS fix are dropped, as when it is decoded on its own
+        self.assertTrue(merged.drops_missing)
+        self.assertFalse(numpy.isnan(merged.data_points.tolist()).any())
+        self.assertEqual(stats.counters[instrumentation.DUPLICATE_PACKETS], copies)
+        self.assertFalse(numpy.isnan(merged.vectors).any())
+
+        # Without a time zone, the raw log's times can't be compared with aprs.fi's
+        filename = os.path.join(self.tempdir, "raw.txt")
+        with open(TestRawPacketLog.FILENAME, "rb") as source, open(filename, "wb") as file:
+            file.write(source.read().replace(b" PST:", b":"))
+        untimed = analyzer_merged.MergedAnalyzer([aprsfi, analyzer_raw.RawPacketAnalyzer(filename, 15)], 15)
+        with self.assertRaises(ValueError):
+            untimed.read_packets()
+
+
+class TestDecodeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = decode_cache.DecodeCache(os.path.join(self.tempdir, "cache.sqlite"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_growing_log(self):
+        for cls, source in ((analyzer_direwolf.DirewolfAnalyzer, "resources/direwolfTestFile1July16.csv"),
+                            (analyzer_aprsfi.AprsFiAnalyzer, "resources/launchData/launch_1_aprsFi.csv"),
+                            (analyzer_raw.RawPacketAnalyzer, TestRawPacketLog.FILENAME)):
+            with open(source, "rb") as file:
+                data = file.read()
+            filename = os.path.join(self.tempdir, os.path.basename(source))
+            complete = os.path.join(self.tempdir, "complete")
+            # The second write stops in the middle of a line, which is only cached once it is complete
+            for end in (len(data) // 2, len(data) - 10, len(data)):
+                with open(filename, "wb") as file:
+                    file.write(data[:end])
+                with open(complete, "wb") as file:
+                    file.write(data[:data.rfind(b"\n", 0, end) + 1])
+                try:
+                    expected = cls(filename, 15).vectors
+                except (AttributeError, KeyError, TypeError, ValueError):
+                    # Without a cache, a partial line can't be read at all
+                    expected = cls(complete, 15).vectors
+                stats = instrumentation.PipelineStats()
+                t = cls(filename, 15, stats=stats, cache=self.cache)
+                self.assertEqual(t.vectors, expected)
+            # Only the new lines were read
+            self.assertLess(stats.stages['read'].bytes_read, len(data) // 2)
+
+    def test_rewritten_log_and_new_config(self):
+        filename = os.path.join(self.tempdir, "log.csv")
+        shutil.copy("resources/direwolfTestFile1July16.csv", filename)
+        analyzer_direwolf.DirewolfAnalyzer(filename, 15, cache=self.cache).data_points
+        key = analyzer_direwolf.DirewolfAnalyzer(filename, 15).cache_key()
+        self.assertGreater(self.cache.load(key, filename)[1], 0)
+
+        # Same size, different contents
+        with open(filename, "r+b") as file:
+            file.seek(-20, os.SEEK_END)
+            file.write(b"x")
+        self.assertEqual(self.cache.load(key, filename), ([], 0))
+
+        shutil.copy("resources/direwolfTestFile1July16.csv", filename)
+        analyzer_direwolf.DirewolfAnalyzer(filename, 15, cache=self.cache).data_points
+        with mock.patch.object(analyzer_compressed.config, "SENS_POINTS_MEASURED", 5):
+            self.assertEqual(self.cache.load(key, filename), ([], 0))
+
+    def test_batch_cache(self):
+        output_dir = os.path.join(self.tempdir, "outputs")
+        summaries = batch.run_batch(["resources/direwolfTestFile1July16.csv", "resources/sdTestFile1Seymour.csv"],
+                                    output_dir, [15], workers=1, cache=True)
+        self.assertEqual([summary['status'] for summary in summaries], ["done"] * 2)
+        self.assertTrue(os.path.exists(os.path.join(output_dir, batch.CACHE_FILENAME)))
+
+
+class TestCheckpoint(unittest.TestCase):
+    FILENAME = "resources/launchData/launch_1_aprsFi.csv"
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "aprsfi.csv")
+        self.vectors = os.path.join(self.tempdir, "vec.csv")
+        self.datapoints = os.path.join(self.tempdir, "dp.csv")
+        with open(self.FILENAME, "rb") as file:
+            self.data = file.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write_input(self, data):
+        with open(self.filename, "wb") as file:
+            file.write(data)
+
+    def assertOutputsMatch(self, filename):
+        t = analyzer_aprsfi.AprsFiAnalyzer(filename, 15)
+        t.output_vectors(os.path.join(self.tempdir, "expected_vec.csv"))
+        t.save_datapoints(os.path.join(self.tempdir, "expected_dp.csv"))
+        for name, expected in ((self.vectors, "expected_vec.csv"), (self.datapoints, "expected_dp.csv")):
+            with open(name) as written, open(os.path.join(self.tempdir, expected)) as expected_file:
+                self.assertEqual(written.read(), expected_file.read())
+
+    def test_resume_growing_log(self):
+        for end in (len(self.data) // 3, 2 * len(self.data) // 3, len(self.data)):
+            self.write_input(self.data[:end])
+            stats = instrumentation.PipelineStats()
+            analyzer_aprsfi.AprsFiAnalyzer(self.filename, 15, stats=stats).update_outputs(self.vectors,
+                                                                                          self.datapoints)
+            # Rows written after the checkpoint, e.g. just before a crash
+            with open(self.vectors, "a") as file:
+                file.write("1.0,2.0,")
+        self.assertLess(stats.stages['read'].bytes_read, len(self.data) // 2)
+
+        self.assertEqual(analyzer_aprsfi.AprsFiAnalyzer(self.filename, 15).update_outputs(self.vectors,
+                                                                                          self.datapoints), (0, 0))
+        self.assertOutputsMatch(self.FILENAME)
+        state = checkpoint.Checkpoint.load(self.vectors + ".checkpoint")
+        self.assertEqual(state.offset, len(self.data))
+
+    def test_rewritten_log_starts_over(self):
+        self.write_input(self.data)
+        analyzer_aprsfi.AprsFiAnalyzer(self.filename, 15).update_outputs(self.vectors, self.datapoints)
+
+        lines = self.data.splitlines(keepends=True)
+        self.write_input(b"".join(lines[:1] + lines[40:]))
+        analyzer_aprsfi.AprsFiAnalyzer(self.filename, 15).update_outputs(self.vectors, self.datapoints)
+        self.assertOutputsMatch(self.filename)
+
+    def test_decoder_state_round_trip(self):
+        packets = analyzer_aprsfi.AprsFiAnalyzer(self.FILENAME, 15).read_packets()
+        decoder = analyzer_compressed.IncrementalDecoder(15, time_interpolation=True)
+        for packet in packets[:10]:
+            decoder.feed(packet)
+        resumed = analyzer_compressed.IncrementalDecoder(15, time_interpolation=True)
+        resumed.load_state(json.loads(json.dumps(decoder.to_state())))
+        self.assertEqual(resumed.feed(packets[10]), decoder.feed(packets[10]))
+
+
+class TestMapExport(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_simplify(self):
+        # Straight climb with 1 m of noise, then a turn to the east
+        alts = numpy.concatenate((numpy.linspace(0, 1000, 101), numpy.full(50, 1000.0)))
+        lats = 49.0 + numpy.where(numpy.arange(151) % 2, 1e-5, 0.0)
+        longs = -123.0 + numpy.concatenate((numpy.zeros(101), numpy.linspace(0.001, 0.05, 50)))
+        keep = map_export.simplify(lats, longs, alts, 5.0)
+        self.assertEqual(numpy.flatnonzero(keep).tolist(), [0, 100, 150])
+        # Below the noise, the zigzag is kept
+        self.assertGreater(numpy.count_nonzero(map_export.simplify(lats, longs, alts, 0.5)), 100)
+
+    def test_map_files(self):
+        t = analyzer_aprsfi.AprsFiAnalyzer("resources/launchData/launch_1_aprsFi.csv", 15)
+        filename = os.path.join(self.tempdir, "flight.geojson")
+        t.output_map(filename)
+        with open(filename) as file:
+            features = json.load(file)['features']
+        self.assertEqual(len(features[0]['geometry']['coordinates']), len(t.data_points))
+        self.assertEqual(len(features), len(t.vectors) + 1)
+        self.assertAlmostEqual(features[1]['properties']['wind_y'], t.vectors[0][1], places=3)
+
+        t.output_map(os.path.join(self.tempdir, "flight.kmz"), tolerance=20)
+        with zipfile.ZipFile(os.path.join(self.tempdir, "flight.kmz")) as archive:
+            root = ElementTree.fromstring(archive.read("doc.kml"))
+        namespace = {'kml': "http://www.opengis.net/kml/2.2"}
+        coordinates = root.find(".//kml:LineString/kml:coordinates", namespace).text.split()
+        self.assertLess(len(coordinates), len(t.data_points) / 2)
+        self.assertEqual(len(root.findall(".//kml:Point", namespace)), len(coordinates) - 1)
+
+        with self.assertRaises(ValueError):
+            t.output_map(os.path.join(self.tempdir, "flight.csv"))
+
+    def test_geojson_without_nan(self):
+        nan = float('nan')
+        data_points = datapoints.DataPointTable.from_columns([49.0, nan, 49.2, 49.3], [-123.0, nan, -123.2, -123.3],
+                                                             [100.0, 200.0, nan, 400.0], [0.0] * 4)
+        vectors = [[100.0, 1.0, 2.0], [nan, nan, nan], [nan, 3.0, nan]]
+        filename = os.path.join(self.tempdir, "flight.geojson")
+        map_export.write_map(filename, data_points, vectors)
+        with open(filename) as file:
+            # Strict JSON: NaN or Infinity raise
+            features = json.load(file, parse_constant=lambda constant: self.fail(constant))['features']
+        self.assertEqual(features[0]['geometry']['coordinates'],
+                         [[-123.0, 49.0, 100.0], [-123.2, 49.2], [-123.3, 49.3, 400.0]])
+        # The vector placed at the data point without a position is skipped
+        self.assertEqual(len(features), 3)
+        self.assertEqual(features[2]['properties']['altitude'], None)
+        self.assertEqual(features[2]['properties']['wind_y'], 3.0)
+        self.assertEqual(features[2]['geometry']['coordinates'], [-123.2, 49.2])
+
+
+class TestDemux(unittest.TestCase):
+    FILENAME = "resources/direwolfTestFile1July16.csv"
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "shared.csv")
+        with open(self.FILENAME, "r", newline="") as file:
+            lines = file.readlines()
+        # Two balloons and a weather station on the same frequency
+        with open(self.filename, "w", newline="") as file:
+            file.write(lines[0])
+            for line in lines[1:]:
+                file.write(line)
+                file.write(line.replace("VE7BVU-1", "VA7XYZ-11"))
+                file.write(line.replace("VE7BVU-1", "VE7WX").rsplit(",", 1)[0] + ",Temp 12C sunny\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_partition(self):
+        stats = instrumentation.PipelineStats()
+        packets = analyzer_direwolf.DirewolfAnalyzer(self.filename, 15).read_packets()
+        flights = demux.demux_packets(packets, stats=stats)
+        self.assertEqual(sorted(flights), ["VA7XYZ-11", "VE7BVU-1"])
+        self.assertEqual(stats.counters[instrumentation.FOREIGN_PACKETS], len(packets) // 3)
+        self.assertEqual(list(demux.demux_packets(packets, ssid=False, callsigns=["va7xyz"])), ["VA7XYZ"])
+
+    def test_decode_flights(self):
+        expected = analyzer_direwolf.DirewolfAnalyzer(self.FILENAME, 15)
+        expected.output_vectors(os.path.join(self.tempdir, "expected_vec.csv"))
+        with open(os.path.join(self.tempdir, "expected_vec.csv")) as file:
+            expected_vectors = file.read()
+
+        output_dir = os.path.join(self.tempdir, "outputs")
+        summaries = demux.decode_flights(analyzer_direwolf.DirewolfAnalyzer(self.filename, 15), output_dir,
+                                         workers=2)
+        self.assertEqual([summary['status'] for summary in summaries], ["done"] * 2)
+        for callsign in ("VE7BVU-1", "VA7XYZ-11"):
+            with open(os.path.join(output_dir, f"shared_{callsign}_15s_vec.csv")) as file:
+                self.assertEqual(file.read(), expected_vectors)
+
+
+class TestGeodesy(unittest.TestCase):
+
+    def test_sphere_is_default(self):
+        lats, longs = [49.0, 49.01, 49.03], [-123.0, -122.98, -122.97]
+        north, east = geodesy.displacements(lats, longs)
+        for i in range(2):
+            y, x = analyzer.Analyzer.calculate_components_dd(longs[i + 1], longs[i], lats[i + 1], lats[i], 0, 0, 0, 1)
+            self.assertEqual((north[i], east[i]), (y, x))
+        with self.assertRaises(ValueError):
+            geodesy.displacements(lats, longs, "flat")
+
+    def test_wgs84_factors(self):
+        # Length of a degree of latitude and of longitude at 45 degrees
+        north, east = geodesy.wgs84_factors([45.0])
+        self.assertAlmostEqual(north[0], 111131.78, places=2)
+        self.assertAlmostEqual(east[0], 78846.84, places=2)
+
+        lats = numpy.linspace(-89.999, 89.999, 10001)
+        meridional, prime_vertical = geodesy.radii_of_curvature(lats)
+        north, east = geodesy.wgs84_factors(lats)
+        numpy.testing.assert_allclose(north, numpy.pi / 180 * meridional, rtol=1e-9)
+        numpy.testing.assert_allclose(east, numpy.pi / 180 * prime_vertical * numpy.cos(numpy.radians(lats)),
+                                      rtol=1e-8)
+
+    def test_analyzer_earth_model(self):
+        t = analyzer_sd.SDAnalyzer("resources/sdTestFile1Seymour.csv", 15)
+        sphere = numpy.array(t.vectors)
+        t.earth_model = geodesy.WGS84
+        wgs84 = numpy.array(t.vectors)
+        self.assertEqual(sphere.shape, wgs84.shape)
+        self.assertFalse(numpy.array_equal(sphere, wgs84))
+        numpy.testing.assert_allclose(wgs84, sphere, rtol=0.01, atol=0.05)
+
+
+class TestWindServer(unittest.IsolatedAsyncioTestCase):
+    FILENAME = "resources/direwolfTestFile1July16.csv"
+
+    async def asyncSetUp(self):
+        self.updates = list(analyzer_direwolf.DirewolfAnalyzer(self.FILENAME, 15).stream())
+        self.state = wind_server.FlightState()
+        self.server = wind_server.WindServer(self.state, port=0)
+        await self.server.start()
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    @staticmethod
+    async def request(reader, writer, path, headers=""):
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n{headers}\r\n".encode())
+        await writer.drain()
+        head = (await reader.readuntil(b"\r\n\r\n")).decode()
+        fields = dict(line.split(": ", 1) for line in head.split("\r\n")[1:] if line)
+        return int(head.split(" ")[1]), fields, await reader.readexactly(int(fields['Content-Length']))
+
+    async def test_http(self):
+        for update in self.updates:
+            self.state.add(*update)
+        expected = analyzer_direwolf.DirewolfAnalyzer(self.FILENAME, 15)
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.server.port)
+        try:
+            status, fields, body = await self.request(reader, writer, "/vectors")
+            self.assertEqual(status, 200)
+            self.assertEqual(json.loads(body)['rows'], expected.vectors)
+
+            # Same connection, nothing changed since
+            status, _, body = await self.request(reader, writer, "/vectors", f"If-None-Match: {fields['ETag']}\r\n")
+            self.assertEqual((status, body), (304, b""))
+
+            status, _, body = await self.request(reader, writer, "/datapoints.csv")
+            output = os.path.join(tempfile.mkdtemp(), "dp.csv")
+            expected.save_datapoints(output)
+            with open(output, "rb") as file:
+                self.assertEqual(body, file.read())
+            shutil.rmtree(os.path.dirname(output))
+
+            status, _, body = await self.request(reader, writer, "/profile?step=1000&phase=ascent")
+            rows = json.loads(body)['rows']
+            self.assertEqual(sum(row[1] for row in rows), len(expected.altitude_index().between(0, 1e9, 'ascent')))
+            self.assertEqual((await self.request(reader, writer, "/profile?step=0"))[0], 400)
+            # Infinite altitudes, or so many bins that they wouldn't fit in memory, are rejected
+            for query in ("high=inf", "low=nan", "step=1e-9", "low=0&high=1e9", "low=-1e308&high=1e308&step=1e-300",
+                          "low=500&high=100"):
+                self.assertEqual((await self.request(reader, writer, "/profile?" + query))[0], 400, query)
+            self.assertEqual((await self.request(reader, writer, "/profile?low=0&high=1e6"))[0], 200)
+            self.assertEqual((await self.request(reader, writer, "/missing"))[0], 404)
+        finally:
+            writer.close()
+
+    async def test_websocket_deltas(self):
+        half = len(self.updates) // 2
+        for update in self.updates[:half]:
+            self.state.add(*update)
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.server.port)
+        try:
+            writer.write(b"GET /ws HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                         b"Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\nSec-WebSocket-Version: 13\r\n\r\n")
+            head = await reader.readuntil(b"\r\n\r\n")
+            self.assertIn(b"101 Switching Protocols", head)
+            self.assertIn(b"Sec-WebSocket-Accept: s3pPLMBiTxaQ9kYGzzhZRbK+xOo=", head)
+
+            vectors = []
+
+            async def receive():
+                while len(vectors) < len(self.state.vectors):
+                    opcode, payload = await wind_server.read_websocket_frame(reader)
+                    message = json.loads(payload)
+                    self.assertEqual(message['start'], len(vectors))
+                    vectors.extend(message['rows'])
+
+            await asyncio.wait_for(receive(), 10)
+            self.assertEqual(len(vectors), len(self.state.vectors))
+            for update in self.updates[half:]:
+                self.state.add(*update)
+            await asyncio.wait_for(receive(), 10)
+            self.assertEqual(vectors, analyzer_direwolf.DirewolfAnalyzer(self.FILENAME, 15).vectors)
+
+            # Masked close frame from the client
+            writer.write(bytes([0x88, 0x82, 1, 2, 3, 4, 0x03 ^ 1, 0xE8 ^ 2]))
+            opcode, payload = await asyncio.wait_for(wind_server.read_websocket_frame(reader), 10)
+            self.assertEqual((opcode, payload), (wind_server.WS_CLOSE, b"\x03\xe8"))
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+
+class TestGapSegments(unittest.TestCase):
+    FILENAME = "resources/direwolfTestFile1July16.csv"
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        with open(self.FILENAME) as file:
+            header, *rows = file.readlines()
+        # Packets are 20 s apart; losing 3 of them leaves an 80 s gap
+        self.gapped = os.path.join(self.tempdir, "gapped.csv")
+        self.halves = [os.path.join(self.tempdir, "first.csv"), os.path.join(self.tempdir, "second.csv")]
+        for filename, kept in ((self.gapped, rows[:5] + rows[8:]), (self.halves[0], rows[:5]),
+                               (self.halves[1], rows[8:])):
+            with open(filename, "w") as file:
+                file.writelines([header] + kept)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_segments(self):
+        table = datapoints.DataPointTable.from_columns(range(7), range(7), range(7), range(7),
+                                                       [0, 5, 10, 100, 105, 105, 110])
+        self.assertEqual(table.segments(30), [(0, 3), (3, 5), (5, 7)])
+
+        resampler = analyzer_sd.Resampler(1, max_gap=10)
+        block = datapoints.DataPointTable.from_columns(*[[0, 2, 4, 50, 52]] * 5)
+        self.assertEqual(resampler.feed(block).times.tolist(), [0, 1, 2, 3, 4, 50, 51, 52])
+
+    def test_split_at_gaps(self):
+        t = analyzer_direwolf.DirewolfAnalyzer(self.gapped, 5)
+        self.assertEqual(len(t.vectors), len(t.data_points) - 1)
+
+        # Same as decoding each side of the gap on its own
+        t.max_gap = 30
+        halves = [analyzer_direwolf.DirewolfAnalyzer(filename, 5) for filename in self.halves]
+        self.assertEqual(t.data_points.tolist(), halves[0].data_points.tolist() + halves[1].data_points.tolist())
+        self.assertEqual(t.vectors, halves[0].vectors + halves[1].vectors)
+        self.assertEqual(len(t.data_points.segments(30)), 2)
+
+        vectors = os.path.join(self.tempdir, "vec.csv")
+        streamed = analyzer_direwolf.DirewolfAnalyzer(self.gapped, 5)
+        streamed.max_gap = 30
+        self.assertEqual(streamed.update_outputs(vectors), (len(t.data_points), len(t.vectors)))
+        with open(vectors) as file:
+            rows = [[float(value) for value in row] for row in list(csv.reader(file))[1:]]
+        self.assertEqual(rows, t.vectors)
+
+    def test_stream_matches_batch(self):
+        for time_interpolation in (False, True):
+            t = analyzer_direwolf.DirewolfAnalyzer(self.gapped, 5, time_interpolation=time_interpolation)
+            t.max_gap = 30
+            t.earth_model = geodesy.WGS84
+            data_points = datapoints.DataPointTable()
+            vectors = []
+            for new_data_points, new_vectors in t.stream():
+                data_points.extend(new_data_points)
+                vectors.extend(new_vectors)
+            self.assertEqual(data_points.tolist(), t.data_points.tolist())
+            self.assertEqual(vectors, t.vectors)
+
+        receiver = tnc_receiver.TncReceiver([], 5, time_interpolation=True, earth_model=geodesy.WGS84, max_gap=30)
+        self.assertEqual((receiver.decoder.time_interpolation, receiver.decoder.earth_model, receiver.decoder.max_gap),
+                         (True, geodesy.WGS84, 30))
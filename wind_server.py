@@ -0,0 +1,459 @@
+"""
+Local wind-profile service for launch day: one process decodes the flight and keeps it in memory, and every laptop or
+display in the room gets the current profile from it over HTTP instead of running its own analyzer.
+
+    GET /vectors      [Altitude, WindY, WindX] rows, as returned by Analyzer.vectors
+    GET /datapoints   [Lat, Long, Alt, Wind] rows
+    GET /profile      mean wind in altitude bins (see AltitudeIndex.bins), ?step=100&phase=ascent&low=0&high=30000
+    GET /ws           WebSocket: a snapshot of the vectors, then each batch of new vectors as soon as it is decoded
+
+/vectors, /datapoints and /profile are JSON, or CSV when the path ends in .csv or with ?format=csv. Each response is
+serialized once per update of the flight and sent with an ETag, so clients polling with If-None-Match get a 304 while
+nothing changed.
+
+Usage: python wind_server.py INPUT [-t TIMESTEP] [--follow] [--host HOST] [--port PORT]
+       python wind_server.py --tnc ENDPOINT [ENDPOINT ...] [--callsign CALL] [-t TIMESTEP] [--host HOST] [--port PORT]
+Both also take [--time-interpolation] [--earth-model {sphere,wgs84}] [--max-gap SECONDS].
+"""
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urlsplit
+import argparse
+import asyncio
+import base64
+import csv
+import hashlib
+import io
+import json
+import math
+import struct
+
+import numpy as np
+
+import altitude_index
+import analyzer_compressed
+import batch
+import geodesy
+import tnc_receiver
+from datapoints import DataPointTable
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+
+VECTOR_COLUMNS = ["Altitude", "WindY", "WindX"]
+DATAPOINT_COLUMNS = ["Lat", "Long", "Alt", "Wind"]
+PROFILE_COLUMNS = ["Altitude", "Count", "WindY", "WindX"]
+# Header rows of the CSV responses, the same as in the files written by the analyzers
+CSV_HEADERS = {'vectors': "Altitude,WindY,WindX", 'datapoints': "Lat, Long, Alt, Wind",
+               'profile': ",".join(PROFILE_COLUMNS)}
+
+# Serialized responses kept per update of the flight (one per resource, format and query)
+MAX_CACHED_RESPONSES = 64
+
+# Largest # of altitude bins of a /profile response
+MAX_PROFILE_BINS = 10000
+
+# Largest request head and WebSocket message accepted from a client, in bytes
+MAX_REQUEST_BYTES = 16384
+
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WS_TEXT = 0x1
+WS_CLOSE = 0x8
+WS_PING = 0x9
+WS_PONG = 0xA
+
+REASONS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+
+class Response(NamedTuple):
+    status: int
+    body: bytes = b""
+    content_type: str = "application/json"
+    etag: Optional[str] = None
+
+
+class FlightState:
+    """
+    The decoded flight, with its vectors indexed by altitude, the serialized responses of its current version and the
+    queues of the WebSocket subscribers.
+    """
+
+    def __init__(self, hysteresis=50.0):
+        """
+        :param hysteresis: see AltitudeIndex
+        """
+        self.data_points = DataPointTable()
+        self.vectors = []
+        self.index = altitude_index.AltitudeIndex(hysteresis=hysteresis)
+        self.version = 0
+        self._responses = {}
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    def add(self, data_points: DataPointTable, vectors):
+        """
+        Adds an update of the flight, as yielded by DirewolfAnalyzer.astream or TncReceiver.updates, and pushes the new
+        vectors to the subscribers.
+        """
+        vectors = np.asarray(vectors, dtype=float).reshape(-1, 3).tolist()
+        start = len(self.vectors)
+        self.data_points.extend(data_points)
+        self.vectors.extend(vectors)
+        self.index.extend(vectors)
+        self.version += 1
+        self._responses.clear()
+        if vectors and self._subscribers:
+            message = FlightState.vectors_message('vectors', start, vectors, self.version)
+            for queue in self._subscribers:
+                queue.put_nowait(message)
+
+    def subscribe(self) -> asyncio.Queue:
+        """
+        :return: queue of the JSON messages for a new subscriber, starting with a snapshot of every vector so far
+        """
+        queue = asyncio.Queue()
+        queue.put_nowait(FlightState.vectors_message('snapshot', 0, self.vectors, self.version))
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    @staticmethod
+    def vectors_message(kind, start, vectors, version) -> str:
+        """
+        :param kind: 'snapshot' for every vector, 'vectors' for new vectors
+        :param start: index of the first vector of the message
+        """
+        return json.dumps({'type': kind, 'version': version, 'start': start, 'columns': VECTOR_COLUMNS,
+                           'rows': json_rows(vectors, len(VECTOR_COLUMNS))})
+
+    def response(self, resource, output_format, query: Dict[str, str]) -> Response:
+        """
+        :param resource: 'vectors', 'datapoints' or 'profile'
+        :param output_format: 'json' or 'csv'
+        :param query: query parameters (only used by 'profile')
+        :return: the serialized resource, from the cache if it was already serialized since the last update
+        """
+        key = (resource, output_format, tuple(sorted(query.items())) if resource == 'profile' else ())
+        cached = self._responses.get(key)
+        if cached is not None:
+            return cached
+
+        if resource == 'vectors':
+            columns, rows = VECTOR_COLUMNS, self.vectors
+        elif resource == 'datapoints':
+            columns, rows = DATAPOINT_COLUMNS, self.data_points.tolist()
+        else:
+            columns, rows = PROFILE_COLUMNS, self.profile(query)
+        if output_format == 'csv':
+            body = csv_body(CSV_HEADERS[resource], rows, len(columns)).encode()
+            content_type = "text/csv; charset=utf-8"
+        else:
+            body = json.dumps({'version': self.version, 'columns': columns,
+                               'rows': json_rows(rows, len(columns))}).encode()
+            content_type = "application/json"
+        etag = f'"{self.version}-{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+        response = Response(200, body, content_type, etag)
+
+        if len(self._responses) >= MAX_CACHED_RESPONSES:
+            self._responses.clear()
+        self._responses[key] = response
+        return response
+
+    def profile(self, query: Dict[str, str]) -> np.ndarray:
+        """
+        :param query: optional 'step' (default 100 m), 'low', 'high' and 'phase' (ascent or descent)
+        :return: AltitudeIndex.bins rows, at most MAX_PROFILE_BINS of them
+        :raises ValueError: if a parameter is invalid, or too many bins are requested
+        """
+        values = {name: float(query[name]) for name in ('step', 'low', 'high') if name in query}
+        for name, value in values.items():
+            if not math.isfinite(value):
+                raise ValueError(f"{name} must be finite")
+        step = values.get('step', 100.0)
+        if not step > 0:
+            raise ValueError("step must be positive")
+        low, high = values.get('low'), values.get('high')
+        if low is not None and high is not None and not low < high:
+            raise ValueError("low must be below high")
+        return self.index.bins(step, low, high, query.get('phase') or None, MAX_PROFILE_BINS)
+
+
+def json_rows(rows, width) -> List[List[Optional[float]]]:
+    """
+    :return: rows as lists, with NaN (not valid JSON) replaced by None
+    """
+    rows = np.asarray(rows, dtype=float).reshape(-1, width)
+    missing = np.isnan(rows)
+    if not missing.any():
+        return rows.tolist()
+    return np.where(missing, None, rows.astype(object)).tolist()
+
+
+def csv_body(header, rows, width) -> str:
+    output = io.StringIO()
+    output.write(header + "\n")
+    csv.writer(output).writerows(np.asarray(rows, dtype=float).reshape(-1, width).tolist())
+    return output.getvalue()
+
+
+"""
+HTTP and WebSocket handling
+"""
+
+
+def websocket_accept(key: str) -> str:
+    """
+    :return: the Sec-WebSocket-Accept value answering the Sec-WebSocket-Key of a handshake
+    """
+    return base64.b64encode(hashlib.sha1(key.strip().encode() + WEBSOCKET_GUID).digest()).decode()
+
+
+def websocket_frame(payload: bytes, opcode=WS_TEXT) -> bytes:
+    """
+    :return: an unmasked, unfragmented WebSocket frame, as sent by a server
+    """
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+
+async def read_websocket_frame(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    """
+    :return: (opcode, unmasked payload) of the next frame sent by a client
+    :raises ValueError: if the frame is larger than MAX_REQUEST_BYTES
+    """
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length, = struct.unpack('!H', await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack('!Q', await reader.readexactly(8))
+    if length > MAX_REQUEST_BYTES:
+        raise ValueError("WebSocket frame too large")
+    mask = await reader.readexactly(4) if second & 0x80 else bytes(4)
+    payload = await reader.readexactly(length)
+    if second & 0x80:
+        payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+    return first & 0x0F, payload
+
+
+class WindServer:
+    """
+    Serves a FlightState over HTTP/1.1 (with keep-alive) and WebSocket.
+    """
+
+    def __init__(self, state: FlightState, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """
+        :param port: TCP port to listen on (0 picks a free one, see port once started)
+        """
+        self.state = state
+        self.host = host
+        self.port = port
+        self.server = None
+        # Writer and task of each open connection
+        self._connections: Dict[asyncio.StreamWriter, asyncio.Task] = {}
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            # Closing the connections ends their handlers
+            for writer in list(self._connections):
+                writer.close()
+            await asyncio.gather(*self._connections.values(), return_exceptions=True)
+            await self.server.wait_closed()
+
+    async def feed(self, updates):
+        """
+        :param updates: async iterator of (new data points, new vectors), e.g. DirewolfAnalyzer.astream(follow=True)
+        """
+        async for data_points, vectors in updates:
+            self.state.add(data_points, vectors)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.LimitOverrunError:
+                    await self._send(writer, Response(400, b"Request too large", "text/plain"), False)
+                    return
+                if len(head) > MAX_REQUEST_BYTES:
+                    await self._send(writer, Response(400, b"Request too large", "text/plain"), False)
+                    return
+                lines = head.decode('latin-1').split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ")
+                except ValueError:
+                    await self._send(writer, Response(400, b"Bad request line", "text/plain"), False)
+                    return
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length') or 0)
+                if length:
+                    await reader.readexactly(length)
+
+                path = urlsplit(target).path
+                if path == "/ws" and headers.get('upgrade', "").lower() == "websocket":
+                    await self._websocket(reader, writer, headers)
+                    return
+                connection = headers.get('connection', "").lower()
+                keep_alive = connection == "keep-alive" or (version == "HTTP/1.1" and connection != "close")
+                await self._send(writer, self.route(method, target, headers), keep_alive)
+                if not keep_alive:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+            self._connections.pop(writer, None)
+
+    def route(self, method, target, headers: Dict[str, str]) -> Response:
+        """
+        :return: the response to an HTTP request (other than a WebSocket upgrade)
+        """
+        if method != "GET":
+            return Response(405, b"Only GET is supported", "text/plain")
+        parts = urlsplit(target)
+        query = dict(parse_qsl(parts.query))
+        resource, _, extension = parts.path.strip("/").partition(".")
+        output_format = extension or query.pop('format', 'json')
+        query.pop('format', None)
+        if resource not in ('vectors', 'datapoints', 'profile') or output_format not in ('json', 'csv'):
+            return Response(404, b"Not found", "text/plain")
+        try:
+            response = self.state.response(resource, output_format, query)
+        except ValueError as e:
+            return Response(400, str(e).encode(), "text/plain")
+
+        matches = [tag.strip() for tag in headers.get('if-none-match', "").split(",")]
+        if response.etag in matches or "*" in matches:
+            return Response(304, etag=response.etag)
+        return response
+
+    @staticmethod
+    async def _send(writer: asyncio.StreamWriter, response: Response, keep_alive):
+        head = [f"HTTP/1.1 {response.status} {REASONS[response.status]}",
+                f"Content-Length: {len(response.body)}",
+                "Cache-Control: no-cache",
+                "Access-Control-Allow-Origin: *",
+                f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        if response.status != 304:
+            head.append(f"Content-Type: {response.content_type}")
+        if response.etag is not None:
+            head.append(f"ETag: {response.etag}")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + response.body)
+        await writer.drain()
+
+    async def _websocket(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, headers: Dict[str, str]):
+        key = headers.get('sec-websocket-key')
+        if key is None:
+            await self._send(writer, Response(400, b"Missing Sec-WebSocket-Key", "text/plain"), False)
+            return
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {websocket_accept(key)}\r\n\r\n").encode('latin-1'))
+        await writer.drain()
+
+        queue = self.state.subscribe()
+
+        async def push():
+            while True:
+                message = await queue.get()
+                writer.write(websocket_frame(message.encode()))
+                await writer.drain()
+
+        pusher = asyncio.ensure_future(push())
+        try:
+            while not pusher.done():
+                receive = asyncio.ensure_future(read_websocket_frame(reader))
+                await asyncio.wait([receive, pusher], return_when=asyncio.FIRST_COMPLETED)
+                if not receive.done():
+                    receive.cancel()
+                    break
+                opcode, payload = receive.result()
+                if opcode == WS_CLOSE:
+                    writer.write(websocket_frame(payload[:2], WS_CLOSE))
+                    await writer.drain()
+                    break
+                if opcode == WS_PING:
+                    writer.write(websocket_frame(payload, WS_PONG))
+                    await writer.drain()
+        except ValueError:
+            writer.write(websocket_frame(struct.pack('!H', 1009), WS_CLOSE))
+        finally:
+            self.state.unsubscribe(queue)
+            pusher.cancel()
+            await asyncio.gather(pusher, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the wind profile of a flight to every client on the network.")
+    parser.add_argument('input', nargs='?', help="flight log (any format batch.py recognizes)")
+    parser.add_argument('--tnc', nargs='+', type=tnc_receiver.parse_endpoint, metavar="ENDPOINT",
+                        help="decode live from TNCs instead: kiss://host:port, agw://host:port or host:port")
+    parser.add_argument('--callsign', help="only decode packets from this callsign (with --tnc)")
+    parser.add_argument('-t', '--timestep', type=float, default=15, help="# of seconds between two datapoints")
+    parser.add_argument('--follow', action='store_true', help="keep decoding a Direwolf log as it grows")
+    parser.add_argument('--time-interpolation', action='store_true',
+                        help="place samples using the time between packets (packet logs and --tnc)")
+    parser.add_argument('--earth-model', choices=geodesy.MODELS, default=geodesy.SPHERE,
+                        help="shape of the Earth used to turn positions into wind vectors")
+    parser.add_argument('--max-gap', type=float,
+                        help="split the flight where no data arrived for more than MAX_GAP seconds, and compute "
+                             "vectors from the actual time between data points")
+    parser.add_argument('--host', default=DEFAULT_HOST, help="address to listen on (0.0.0.0 for every interface)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    if (args.input is None) == (args.tnc is None):
+        parser.error("give either an INPUT log or --tnc endpoints")
+    input_format = None if args.input is None else batch.detect_format(args.input)
+    if args.input is not None and input_format is None:
+        parser.error(f"{args.input} isn't a recognized flight log")
+
+    async def run():
+        server = WindServer(FlightState(), args.host, args.port)
+        if args.tnc is not None:
+            updates = tnc_receiver.TncReceiver(args.tnc, args.timestep, args.callsign,
+                                               time_interpolation=args.time_interpolation,
+                                               earth_model=args.earth_model, max_gap=args.max_gap).updates()
+        else:
+            t = batch.ANALYZERS[input_format](args.input, args.timestep)
+            t.earth_model = args.earth_model
+            t.max_gap = args.max_gap
+            if isinstance(t, analyzer_compressed.CompressedAnalyzer):
+                t.time_interpolation = args.time_interpolation
+            if input_format == 'direwolf':
+                updates = t.astream(follow=args.follow)
+            else:
+                # Other logs can't grow during a flight; decode them once
+                server.state.add(t.data_points, t.vectors)
+                updates = None
+        await server.start()
+        print(f"Serving on http://{args.host}:{server.port}/", flush=True)
+        try:
+            if updates is not None:
+                await server.feed(updates)
+            await asyncio.Event().wait()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()